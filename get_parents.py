@@ -5,6 +5,11 @@ import sys
 from src.shared_functions import *
 from src.get_parent_ids import *
 from src.api_call import *
+from src.id_set import MMSIdSet
+from src.fetch_planner import get_planned_records
+from src.parent_prefetch import ParentPrefetcher
+from src.bib_cache import BibCache
+from src.record_store import get_marc_files
 
 """Set up logging"""
 
@@ -21,6 +26,9 @@ print("")
 """Debugging flag - use to prevent API calls."""
 downloaded_records = False
 
+"""Request parent records while many records download. Parents missed are requested afterwards."""
+prefetch_parents = True
+
 """Set up directories"""
 setup_directories()
 ROOT_DIR = os.path.abspath(os.curdir)
@@ -32,6 +40,8 @@ print(
 if downloaded_records:
     print("Not clearing directory, working with downloaded records.")
     logger.info("Working with existing files.")
+elif resume_unfinished_download():
+    print("Not clearing directory, resuming unfinished download.")
 else:
     print("This process will clear downloaded content. Continue? (y/n)")
     response = input()
@@ -82,33 +92,13 @@ if not response.lower().startswith("y"):
 print("")
 
 """Get ids from file"""
-id_list = []
-for file in file_list:
-    if ".xls" in file:
-        data = get_identifiers_from_spreadsheet(os.path.join(load_dir, file))
-        for column in data.columns:
-            if column.startswith("mms_id"):
-                ids = data[column].to_list()
-                id_list.extend(ids)
-                print(f"MMS_ids found: {len(ids)} ids added to list from file {file}.")
-                logger.info(
-                    f"MMS_ids found: {len(ids)} ids added to list from file {file}."
-                )
-    else:
-        with open(os.path.join(load_dir, file), "r") as f:
-            ids = re.findall("99\d+7636", f.read())
-            id_list.extend(ids)
-            print(f"MMS_ids found: {len(ids)} ids added to list from file {file}.")
-            logger.info(
-                f"MMS_ids found: {len(ids)} ids added to list from file {file}."
-            )
-
-logger.info(f"Created list of ids with length {len(id_list)}")
-print(f"Created list of ids with length {len(id_list)}")
-logger.info("Filtering to unique values...")
-print("Filtering to unique values...")
-
-identifiers = list(set(id_list))
+logger.info("Reading ids and filtering to valid, unique values...")
+print("Reading ids and filtering to valid, unique values...")
+
+# Held as integers, see id_set. Duplicates are removed by the set.
+identifiers = MMSIdSet(
+    filter_identifiers(iter_ids_from_file(load_dir, file_list), dedupe=False)
+)
 
 logger.info(f"Final list has {len(identifiers)} items")
 print(f"Final list has {len(identifiers)} items\n")
@@ -117,11 +107,22 @@ print(f"Final list has {len(identifiers)} items\n")
 if downloaded_records:
     print("Not calling API, working with downloaded records.")
 else:
+    # Parents found in each chunk of many records are requested while the download continues.
+    prefetcher = None
+    if prefetch_parents:
+        prefetcher = ParentPrefetcher(output_many, skip=identifiers, cache=BibCache())
     try:
-        get_missing_records([], identifiers, output_many)
+        get_missing_records(
+            [],
+            identifiers,
+            output_many,
+            on_records=prefetcher.on_records if prefetcher else None,
+        )
     except Exception as e:
         print(f"Error retrieving bibs: {e}")
         logger.error(f"Error retrieving bibs: {e}")
+    if prefetcher is not None:
+        prefetcher.finish()
 
 """Print relevant info to user"""
 num_files = len(os.listdir(output_many))
@@ -131,7 +132,7 @@ print(f"Files written to: {output_many}")
 
 
 """Get PARENT records from API"""
-record_files = get_callable_files(output_many)
+record_files = get_marc_files(output_many)
 parent_id_list = iterate_get_parents(record_files, True)
 parent_id_list = list(set(parent_id_list))
 logger.info(parent_id_list)
@@ -142,7 +143,7 @@ if downloaded_records:
     print("Not calling API, working with downloaded records.")
 else:
     try:
-        get_missing_records([], parent_id_list, output_many)
+        get_planned_records([(parent_id_list, output_many)])
     except Exception as e:
         print(f"Error retrieving bibs: {e}")
         logger.error(f"Error retrieving bibs: {e}")
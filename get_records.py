@@ -4,6 +4,9 @@ import time
 import sys
 from src.shared_functions import *
 from src.api_call import *
+from src.id_set import MMSIdSet
+from src.bulk_export import get_records_with_export
+from src.record_store import count_directory_records, open_store
 
 """Set up logging"""
 
@@ -16,6 +19,9 @@ print("")
 """Debugging flag - use to prevent API calls."""
 downloaded_records = False
 
+"""Keep downloaded records in one indexed file rather than one file per record."""
+use_record_store = True
+
 """Set up directories"""
 setup_directories()
 ROOT_DIR = os.path.abspath(os.curdir)
@@ -23,6 +29,8 @@ ROOT_DIR = os.path.abspath(os.curdir)
 if downloaded_records:
     print("Not clearing directory, working with downloaded records.")
     logger.info("Working with existing files.")
+elif resume_unfinished_download():
+    print("Not clearing directory, resuming unfinished download.")
 else:
     print("This process will clear downloaded content. Continue? (y/n)")
     response = input()
@@ -71,52 +79,34 @@ if not response.lower().startswith("y"):
 print("")
 
 """Get ids from file"""
-id_list = []
-for file in file_list:
-    if ".xls" in file:
-        data = get_identifiers_from_spreadsheet(os.path.join(load_dir, file))
-        for column in data.columns:
-            if column.startswith("mms_id"):
-                ids = data[column].to_list()
-                id_list.extend(ids)
-                print(f"MMS_ids found: {len(ids)} ids added to list from file {file}.")
-                logger.info(
-                    f"MMS_ids found: {len(ids)} ids added to list from file {file}."
-                )
-    else:
-        with open(os.path.join(load_dir, file), "r") as f:
-            ids = re.findall("99\d+7636", f.read())
-            id_list.extend(ids)
-            print(f"MMS_ids found: {len(ids)} ids added to list from file {file}.")
-            logger.info(
-                f"MMS_ids found: {len(ids)} ids added to list from file {file}."
-            )
-
-logger.info(f"Created list of ids with length {len(id_list)}")
-print(f"Created list of ids with length {len(id_list)}")
-logger.info("Filtering to unique values...")
-print("Filtering to unique values...")
-
-identifiers = list(set(id_list))
+logger.info("Reading ids and filtering to valid, unique values...")
+print("Reading ids and filtering to valid, unique values...")
+
+# Held as integers, see id_set. Duplicates are removed by the set.
+identifiers = MMSIdSet(
+    filter_identifiers(iter_ids_from_file(load_dir, file_list), dedupe=False)
+)
 
 logger.info(f"Final list has {len(identifiers)} items")
 print(f"Final list has {len(identifiers)} items\n")
 
 """Get MARC records from API"""
+if use_record_store:
+    open_store(output_many, create=True)
 if downloaded_records:
     print("Not calling API, working with downloaded records.")
 else:
     if check_api_key():
         try:
-            get_missing_records([], identifiers, output_many)
+            get_records_with_export(identifiers, output_many)
         except Exception as e:
             print(f"Error retrieving bibs: {e}")
             logger.error(f"Error retrieving bibs: {e}")
 
 """Print relevant info to user"""
-num_files = len(os.listdir(output_many))
+num_files = count_directory_records(output_many)
 print("")
-print(f"Number of files captured: {num_files}")
+print(f"Number of records captured: {num_files}")
 print(f"Files written to: {output_many}")
 
 """Create merge file"""
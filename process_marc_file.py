@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 from copy import deepcopy
@@ -6,7 +7,12 @@ from src.shared_functions import *
 from src.xml_load_and_process import *
 from src.get_parent_ids import *
 from src.transform_marc_file import *
-
+from src.async_api_call import async_get_missing_records
+from src.fetch_planner import plan_fetch
+from src.bib_cache import BibCache
+from src.write_back import write_back_file
+from src.record_store import get_directory_record, open_store
+from src.marc_index import MappedMARCFile
 
 """Set up logging"""
 
@@ -27,6 +33,9 @@ response = input()
 if response.lower().startswith("y"):
     downloaded_records = True
 
+# Keep split and downloaded records in one indexed file per directory rather than one file per record.
+use_record_store = True
+
 # Setup workspace
 setup_directories()
 
@@ -80,13 +89,34 @@ for root, dir, files in os.walk(input_path):
         if not response.lower().startswith("y"):
             sys.exit()
 
+# Supplied records are read from the input files by MMS Id rather than split into directories.
+read_from_input = not (start_fresh or downloaded_records)
+input_files = []
+if read_from_input:
+    input_files = [MappedMARCFile(file) for file in output_list]
+
+
+def find_record(directory, id):
+    """Returns a record from the input files, or from directory if it is not in them.
+
+    Records are LazyRecords, so the cleanup only decodes and re-encodes the fields it uses.
+    """
+    for input_file in input_files:
+        if id in input_file:
+            return input_file.get_record(id, lazy=True)
+    return get_directory_record(directory, id, lazy=True)
+
+
 # split the files
+if use_record_store and not downloaded_records:
+    open_store(parent_records_path, create=True)
+    open_store(many_records_path, create=True)
 many_records = []
 parent_records = []
 parent_ids = []
 id_dictionary = {}
 for file in output_list:
-    identifiers = split_marc_records(file)
+    identifiers = split_marc_records(file, write_records=not read_from_input)
     many_records.extend(identifiers["many_records"])
     parent_records.extend(identifiers["parent_records"])
     parent_ids.extend(identifiers["parent_ids"])
@@ -100,72 +130,84 @@ for file in output_list:
 if start_fresh and not downloaded_records:
     # clear directories
     clear_temporary_files()
+    if use_record_store:
+        open_store(parent_records_path, create=True)
+        open_store(many_records_path, create=True)
 
     many_records = list(set(many_records))
     many_records.sort()
 
     parent_ids = parent_records + parent_ids
 
-    # Get many records
-    get_missing_records([], many_records, many_records_path)
-
 
 parent_ids = list(set(parent_ids))
 parent_ids.sort()
+if read_from_input:
+    # Parents supplied in the input files do not need to be requested.
+    parent_ids = [
+        id
+        for id in parent_ids
+        if not any(id in input_file for input_file in input_files)
+    ]
 
 if not downloaded_records:
-    # get required parents
-    get_missing_records(parent_records, parent_ids, parent_records_path)
-
-parent_files = [
-    os.path.join(parent_records_path, filename)
-    for filename in os.listdir(parent_records_path)
-]
-many_files = [
-    os.path.join(many_records_path, filename)
-    for filename in os.listdir(many_records_path)
-]
+    # get required parents, and many records if starting fresh, in one set of requests
+    phases = [(parent_ids, parent_records_path)]
+    if start_fresh:
+        phases.insert(0, (many_records, many_records_path))
+    plan = plan_fetch(phases, BibCache())
+    asyncio.run(
+        async_get_missing_records(
+            [],
+            plan["request_ids"],
+            parent_records_path,
+            destinations=plan["destinations"],
+        )
+    )
+
 
 ## Basic cleanup loop.
 exceptions = []
 valid_file = ""
 
 for key in id_dictionary:
-    filename = f"record_{key}.mrc"
-    many_filenames = [f"record_{id}.mrc" for id in id_dictionary[key]]
-    with open(os.path.join(parent_records_path, filename), "rb") as pf:
-        p_reader = pymarc.MARCReader(pf)
-        for p_record in p_reader:
-            parent_rec = deepcopy(p_record)
-            for file in many_filenames:
-                with open(os.path.join(many_records_path, file), "rb") as mf:
-                    reader = pymarc.MARCReader(mf)
-                    for record in reader:
-                        wr = deepcopy(record)
-                        ## Now we have both our parent record open and our many record open.
-                        try:
-                            fix_record = many_record_cleanup(wr, parent_rec)
-                            has_exception = check_fields(
-                                fix_record,
-                                ("100", "110", "111", "130"),
-                                ("700", "710", "711", "720", "730"),
-                            )
-                            if has_exception:
-                                if p_record["001"].value() not in exceptions:
-                                    exceptions.append(p_record["001"].value())
-                                    with open(invalid_output, "ab") as output:
-                                        output.write(p_record.as_marc())
-                                with open(invalid_output, "ab") as output:
-                                    output.write(fix_record.as_marc())
-                            else:
-                                with open(valid_output, "ab") as output:
-                                    output.write(fix_record.as_marc())
-                        except Exception as e:
-                            print("Error occurred while transforming file: " + e)
-                            logger.error(f"Error occurred while transforming file: {e}")
-                            exceptions.append(fix_record["001"].value())
-                            with open(invalid_output, "ab") as output:
-                                output.write(fix_record.as_marc())
+    # Records are read from the input files, or the record store or record_<id>.mrc files.
+    p_record = find_record(parent_records_path, key)
+    if p_record is None:
+        print(f"Parent record {key} not found.")
+        logger.error(f"Parent record {key} not found in {parent_records_path}")
+        continue
+    parent_rec = deepcopy(p_record)
+    for id in id_dictionary[key]:
+        record = find_record(many_records_path, id)
+        if record is None:
+            logger.error(f"Many record {id} not found in {many_records_path}")
+            continue
+        wr = deepcopy(record)
+        ## Now we have both our parent record open and our many record open.
+        try:
+            fix_record = many_record_cleanup(wr, parent_rec)
+            has_exception = check_fields(
+                fix_record,
+                ("100", "110", "111", "130"),
+                ("700", "710", "711", "720", "730"),
+            )
+            if has_exception:
+                if p_record["001"].value() not in exceptions:
+                    exceptions.append(p_record["001"].value())
+                    with open(invalid_output, "ab") as output:
+                        output.write(p_record.as_marc())
+                with open(invalid_output, "ab") as output:
+                    output.write(fix_record.as_marc())
+            else:
+                with open(valid_output, "ab") as output:
+                    output.write(fix_record.as_marc())
+        except Exception as e:
+            print("Error occurred while transforming file: " + e)
+            logger.error(f"Error occurred while transforming file: {e}")
+            exceptions.append(fix_record["001"].value())
+            with open(invalid_output, "ab") as output:
+                output.write(fix_record.as_marc())
 
 
 # Validate and return how many records failed.
@@ -186,8 +228,34 @@ if os.path.isfile(invalid_output):
 else:
     print("No exceptions written to file.")
 
+# Send updated many records back to Alma instead of importing the file by hand.
+if os.path.isfile(valid_output):
+    print("Write updated records back to Alma? (y/n)")
+    response = input()
+    if response.lower().startswith("y"):
+        write_back_file(
+            valid_output, record_filter=lambda record: get_record_type(record) == "MANY"
+        )
+
 # Build archive file of unmodified MANY records.
-many_records_path
-output_file_with_validation(
-    many_records_path, merge_path, output_filename="unedited_many_backup.mrc"
-)
+if read_from_input:
+    backup_output = os.path.join(merge_path, "unedited_many_backup.mrc")
+    with open(backup_output, "ab") as output:
+        # Each record is written once, from the first input file holding it, as in find_record.
+        for id in dict.fromkeys(many_records):
+            for input_file in input_files:
+                if id in input_file:
+                    output.write(input_file.get(id))
+                    break
+    output_file_with_validation(
+        backup_output,
+        merge_path,
+        output_filename="unedited_many_backup.mrc",
+        merged=True,
+    )
+else:
+    output_file_with_validation(
+        many_records_path, merge_path, output_filename="unedited_many_backup.mrc"
+    )
+for input_file in input_files:
+    input_file.close()
@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger()
+
+# Adaptive concurrency settings
+INITIAL_WINDOW = 4
+MIN_WINDOW = 1
+MAX_WINDOW = 32
+TARGET_LATENCY = 5.0  # seconds for one chunk of 100 records
+DECREASE_FACTOR = 0.5
+LOW_QUOTA = 20000  # remaining calls below which the window stops growing
+THROTTLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class AdaptiveLimiter:
+    """Limits requests in flight with a window adjusted by additive-increase/multiplicative-decrease.
+
+    Each successful response with latency under target_latency grows the window by
+    1/window, so a full window of successes adds one request. A throttled or server error
+    response, or a response slower than target_latency, multiplies the window by
+    decrease_factor. The window is cut at most once per target_latency so a burst of
+    429s from requests already in flight counts as one signal. While the remaining
+    quota reported by Alma is below low_quota the window does not grow.
+    """
+
+    def __init__(
+        self,
+        initial=INITIAL_WINDOW,
+        minimum=MIN_WINDOW,
+        maximum=MAX_WINDOW,
+        target_latency=TARGET_LATENCY,
+        decrease_factor=DECREASE_FACTOR,
+        low_quota=LOW_QUOTA,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.low_quota = low_quota
+        self.window = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.completed = 0
+        self.throttled = 0
+        self.total_latency = 0.0
+        self.remaining = None
+        self._last_decrease = None
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Blocks until a request can be sent within the current window."""
+        with self._condition:
+            while self.in_flight >= int(self.window):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        """Marks a request as finished so another can be sent."""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def observe(self, status_code, latency, headers=None):
+        """Adjusts the window from one API response.
+
+        Args:
+            status_code (int) | HTTP status of the response, None if the connection failed.
+            latency (float) | Seconds taken by the request.
+            headers (dict) | Response headers, read for X-Exl-Api-Remaining.
+        """
+        with self._condition:
+            old_window = int(self.window)
+            self.completed += 1
+            self.total_latency += latency
+            if headers is not None and headers.get("X-Exl-Api-Remaining") is not None:
+                self.remaining = int(headers.get("X-Exl-Api-Remaining"))
+            failed = status_code is None or status_code in THROTTLE_STATUS_CODES
+            if failed or latency > self.target_latency:
+                if failed:
+                    self.throttled += 1
+                now = time.monotonic()
+                if (
+                    self._last_decrease is None
+                    or now - self._last_decrease > self.target_latency
+                ):
+                    self._last_decrease = now
+                    self.window = max(self.minimum, self.window * self.decrease_factor)
+            elif self.remaining is None or self.remaining >= self.low_quota:
+                self.window = min(self.maximum, self.window + 1 / self.window)
+            new_window = int(self.window)
+            if new_window != old_window:
+                logger.info(
+                    f"Adaptive concurrency window changed from {old_window} to {new_window} "
+                    f"(status {status_code}, latency {latency:.2f}s, remaining {self.remaining})."
+                )
+            self._condition.notify_all()
+
+    def stats(self):
+        """Returns a dictionary of current window and response metrics."""
+        with self._condition:
+            return {
+                "window": int(self.window),
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "throttled": self.throttled,
+                "average_latency": (
+                    self.total_latency / self.completed if self.completed else None
+                ),
+                "remaining": self.remaining,
+            }
@@ -1,26 +1,77 @@
 import logging
 import requests
 import os
+import random
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from src.quota_governor import (
+    QuotaGovernor,
+    QuotaExceeded,
+    QUOTA_FLOOR,
+    IDS_PER_CALL,
+    estimate_calls,
+)
+from src.adaptive_concurrency import AdaptiveLimiter, MAX_WINDOW
+from src.id_set import MMSIdSet
+import src.response_capture as response_capture
 
 logger = logging.getLogger()
 
-API_CALL_LIMIT = 10000
+API_CALL_LIMIT = QUOTA_FLOOR
+ADAPTIVE = "auto"  # max_workers value that adjusts concurrency to API responses
+MAX_WORKERS = ADAPTIVE  # default for bib fetches, a number sets a fixed thread count
+
+# HTTP client settings
+POOL_SIZE = (
+    MAX_WINDOW + 8
+)  # every adaptive request, plus prefetch and write back workers
+REQUEST_TIMEOUT = 120
+MAX_RETRIES = 5
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+_governor = None
+
+
+def get_governor():
+    """Returns the QuotaGovernor shared by all API calls in this process.
+
+    The governor shares remaining quota and request rate with other running scripts.
+    """
+    global _governor
+    with _session_lock:
+        if _governor is None:
+            _governor = QuotaGovernor(floor=API_CALL_LIMIT)
+    return _governor
 
 
 def api_volume_check(api_return):
-    """Returns True if remaining API calls above API_CALL_LIMIT"""
+    """Returns True if remaining API calls above API_CALL_LIMIT.
+
+    Returns False rather than quitting so a run can stop requesting records and keep
+    what has already been retrieved. Remaining calls are shared with other processes by
+    the quota governor in api_request."""
     remaining_calls = int(api_return.headers["X-Exl-Api-Remaining"])
     limit = API_CALL_LIMIT
     if remaining_calls < limit:
         print(
             f"WARNING: Remaining API calls ({remaining_calls}) is less than limit: {limit}."
         )
-        print(f"Too few API calls remaining. Quitting...")
+        print(f"Too few API calls remaining. No further records will be requested.")
         logger.warning(
             f"Remaining API calls at or below limit of {limit}. Request cancelled."
         )
-        sys.exit()
+        return False
     else:
         print(f"Remaining API calls: {remaining_calls}.")
         logger.info(f"Remaining API calls: {remaining_calls}. Request continues...")
@@ -35,7 +86,12 @@ def validate_mmsid(mms_id):
         )
         logger.warning(f"Probable invalid MMS Id: {mms_id}")
         return False
-    elif mms_id.startswith("99") and mms_id.endswith("7636") and len(mms_id) > 6:
+    elif (
+        mms_id.startswith("99")
+        and mms_id.endswith("7636")
+        and len(mms_id) > 6
+        and mms_id.isdigit()
+    ):
         return True
     else:
         return False
@@ -43,22 +99,78 @@ def validate_mmsid(mms_id):
 
 def split_identifiers(identifiers):
     """Taks a comma separated string of identifiers and checks all values are valid. Bad values are added to log."""
-    id_list = identifiers.split(",")
-    bad_ids = []
-    for id in id_list:
-        if not validate_mmsid(id):
+    id_list = []
+    bad_ids = 0
+    for id in identifiers.split(","):
+        if validate_mmsid(id):
+            id_list.append(id)
+        else:
             logger.error(f"Validation error for MMS id, id removed from API call: {id}")
-            bad_ids += [id]
-    if len(bad_ids) > 0:
+            bad_ids += 1
+    if bad_ids > 0:
         print(
-            f"WARNING: {len(bad_ids)} MMS Ids were invalid. Removed from query. Consult logfile for more information."
+            f"WARNING: {bad_ids} MMS Ids were invalid. Removed from query. Consult logfile for more information."
         )
-        logger.error(f"{len(bad_ids)} MMS Ids were invalid.")
-        for id in bad_ids:
-            id_list.remove(id)
+        logger.error(f"{bad_ids} MMS Ids were invalid.")
     return id_list
 
 
+def filter_identifiers(identifiers, dedupe=True):
+    """Yields each valid identifier once, in the order first seen.
+
+    Args:
+        identifiers: iterable (str) - e.g. from shared_functions.iter_ids_from_file.
+        dedupe: bool - set to False when the caller removes duplicates, e.g. when
+            building an MMSIdSet, to avoid holding a set of every identifier.
+
+    Processing:
+        Strips whitespace, drops values failing validate_mmsid and duplicates. Only the
+        set of identifiers already yielded is held in memory.
+    """
+    seen = set()
+    bad_ids = 0
+    duplicates = 0
+    for id in identifiers:
+        id = str(id).strip()
+        if id in seen:
+            duplicates += 1
+        elif validate_mmsid(id):
+            if dedupe:
+                seen.add(id)
+            yield id
+        else:
+            logger.error(f"Validation error for MMS id, id removed from API call: {id}")
+            bad_ids += 1
+    if bad_ids > 0:
+        print(
+            f"WARNING: {bad_ids} MMS Ids were invalid. Removed from query. Consult logfile for more information."
+        )
+        logger.error(f"{bad_ids} MMS Ids were invalid.")
+    if dedupe:
+        logger.info(f"{len(seen)} unique identifiers, {duplicates} duplicates removed.")
+
+
+def iter_chunks(identifiers, size=IDS_PER_CALL):
+    """Yields (chunk number as str, up to size identifiers separated by commas).
+
+    Consumes identifiers lazily, so any iterable or generator can be chunked in one pass.
+    An MMSIdSet is chunked from its array, so ids are only strings once joined.
+    """
+    if isinstance(identifiers, MMSIdSet):
+        for counter, chunk in enumerate(identifiers.joined_chunks(size)):
+            yield str(counter), chunk
+        return
+    iterator = iter(identifiers)
+    counter = 0
+    while True:
+        chunk = list(islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        logger.debug(f"Created chunk with key: {counter}")
+        yield str(counter), ",".join(chunk)
+        counter += 1
+
+
 def chunk_identifiers(id_list):
     """Convert list of identifiers into chunks of 100 identifiers
 
@@ -67,62 +179,326 @@ def chunk_identifiers(id_list):
         Keys are numbers from 0 - number of keys.
         Values (str) 100 identifiers separated by commas.
     """
-    counter = 0
-    request_dict = {}
-    while len(id_list) > 100:
-        list_slice = id_list[0:100]
-        request_dict.update({str(counter): ",".join(list_slice)})
-        logger.debug(f"Created chunk with key: {counter}")
-        counter += 1
-        del id_list[0:100]
-        logger.debug(f"Removed items added to chunk {counter - 1} from original list.")
-    if len(id_list) > 0:
-        logger.debug(f"List has remainder of: {str(len(id_list))}")
-        request_dict.update({str(counter): ",".join(id_list)})
+    request_dict = dict(iter_chunks(id_list))
     print(
         "Number of queries required to get all bibs: " + str(len(request_dict.keys()))
     )
     return request_dict
 
 
-BASEURL = "https://api-ap.hosted.exlibrisgroup.com/almaws/v1/bibs/"
+def get_session():
+    """Returns a requests Session shared by all API calls.
+
+    Connections are pooled and kept alive between chunks so each call does not
+    repeat the TLS handshake. Responses are requested with gzip compression.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Accept-Encoding": "gzip, deflate"})
+            _session = session
+    return _session
+
+
+def get_retry_delay(response, attempt):
+    """Returns seconds to wait before retrying a failed request.
+
+    Uses the Retry-After header if the response has one (seconds or HTTP date),
+    otherwise exponential backoff with full jitter capped at BACKOFF_MAX.
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    retry_date = parsedate_to_datetime(retry_after)
+                    delay = (retry_date - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0), BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def api_request(
+    method, url, params=None, headers=None, data=None, on_response=None, stream=False
+):
+    """Sends a request through the shared session, retrying on throttling and server errors.
+
+    Args:
+        method (str) | HTTP method, e.g. "GET".
+        url (str) | Request url.
+        params (dict) | Query parameters.
+        headers (dict) | Request headers.
+        data (str/bytes) | Request body.
+        on_response (function) | Called after every attempt with (status code, latency in
+            seconds, response headers). Status code is None if the connection failed.
+        stream (bool) | Return before the body is downloaded, so it can be read in pieces
+            with response.iter_content. The caller should close the response.
+
+    Processing:
+        Claims each attempt from the quota governor, which raises QuotaExceeded if the call
+        would take the remaining quota below API_CALL_LIMIT. Retries responses with a status
+        in RETRY_STATUS_CODES and connection errors up to MAX_RETRIES times, waiting
+        get_retry_delay between attempts. With API_CAPTURE_MODE "record" the final response
+        is stored by response_capture, and with "replay" it is read from the store instead
+        of sending the request.
+
+    Returns:
+        Api response. The last response is returned if retries are exhausted.
+    """
+    if response_capture.CAPTURE_MODE == "replay":
+        response = response_capture.replay_response(method, url, params, data)
+        if on_response is not None:
+            on_response(response.status_code, 0.0, response.headers)
+        return response
+    governor = get_governor()
+    for attempt in range(MAX_RETRIES + 1):
+        governor.acquire()
+        start = time.monotonic()
+        try:
+            response = get_session().request(
+                method,
+                url,
+                params=params,
+                headers=headers,
+                data=data,
+                timeout=REQUEST_TIMEOUT,
+                stream=stream,
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if on_response is not None:
+                on_response(None, time.monotonic() - start, None)
+            if attempt == MAX_RETRIES:
+                raise
+            logger.warning(
+                f"Request failed with {e}. Retry {attempt + 1} of {MAX_RETRIES}."
+            )
+            response = None
+        else:
+            if on_response is not None:
+                on_response(
+                    response.status_code, time.monotonic() - start, response.headers
+                )
+            governor.record_response(response)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                if response_capture.CAPTURE_MODE == "record":
+                    response_capture.capture_response(
+                        response, method, url, params, data
+                    )
+                return response
+            logger.warning(
+                f"Request returned status {response.status_code}. Retry {attempt + 1} of {MAX_RETRIES}."
+            )
+            if stream:
+                response.close()  # release the connection without reading the body
+        time.sleep(get_retry_delay(response, attempt))
+
+
+BASEURL = os.getenv(
+    "ALMA_API_BASEURL", "https://api-ap.hosted.exlibrisgroup.com/almaws/v1/bibs/"
+)
 
 KEY = os.getenv("KEY", None)
 
 
+def get_api_key():
+    """Returns KEY, or a placeholder when replaying captured responses without a key."""
+    if KEY is None and response_capture.CAPTURE_MODE == "replay":
+        # Replayed responses need no key, but the API functions require one to be set.
+        return "replay"
+    return KEY
+
+
 def check_api_key():
     """Makes a test call to the API and returns a boolean."""
-    if KEY == None:
+    key = get_api_key()
+    if key == None:
         logger.info("Check API Key: Key not configured in API call.")
         return None
-    headers = {"Authorization": "apikey " + KEY, "Accept": "application/json"}
-    response = requests.get(BASEURL + "test", headers=headers)
+    headers = {"Authorization": "apikey " + key, "Accept": "application/json"}
+    response = api_request("GET", BASEURL + "test", headers=headers)
     logger.info(response)
     if response.status_code == 200:
-        api_volume_check(response)
-        return True
+        return api_volume_check(response)
     else:
         print("Invalid API key, confirm permissions.")
         logger.error("API call unsuccessful. Check key.")
         return False
 
 
-def get_bibs(part, mms_ids):
+def get_bibs(part, mms_ids, view="full", on_response=None, stream=False):
     """Query API for bibliographic records. Assumes mutliple calls will be passed.
 
     Args:
         part (str) | Number as string representing the chunk of identifiers being sent to API.
         mms_ids (str) | Up to 100 MMS Ids separated by commas.
+        view (str) | "full" returns the MARCxml in 'anies'. "brief" returns only record metadata.
+        on_response (function) | Passed to api_request.
+        stream (bool) | Passed to api_request, to read the response with
+            extract_xml.iter_response_text as it arrives.
 
     Returns:
         Api response (JSON)
     """
-    if KEY == None:
+    key = get_api_key()
+    if key == None:
         logger.info("Get bibs: Key not configured in API call.")
         return None
-    headers = {"Authorization": "apikey " + KEY, "Accept": "application/json"}
-    query = {"mms_id": mms_ids}
-    api_call = requests.get(BASEURL, params=query, headers=headers)
+    headers = {"Authorization": "apikey " + key, "Accept": "application/json"}
+    query = {"mms_id": mms_ids, "view": view}
+    api_call = api_request(
+        "GET",
+        BASEURL,
+        params=query,
+        headers=headers,
+        on_response=on_response,
+        stream=stream,
+    )
     logger.debug(f"API GET request sent. Batch number {part}")
     logger.debug(api_call)
     return api_call
+
+
+def _next_completed_batch(pending, total, limiter=None):
+    """Waits on the oldest submitted chunk and logs it as retrieved."""
+    key, future = pending.popleft()
+    response = future.result()
+    if limiter is None:
+        logger.info(f"Retrieved batch {key} ({int(key) + 1} of {total}).")
+    else:
+        logger.info(
+            f"Retrieved batch {key} ({int(key) + 1} of {total}). Concurrency window: {limiter.stats()['window']}."
+        )
+    return key, response
+
+
+def _read_bibs(response, read):
+    """Returns read(response) and closes the response, or the response if read is None."""
+    if read is None or response is None:
+        return response
+    try:
+        return read(response)
+    finally:
+        response.close()
+
+
+def _get_bibs_adaptive(limiter, part, mms_ids, view, read=None):
+    """Calls get_bibs once the adaptive limiter has room, reporting each response to it.
+
+    The slot is held until the response has been read, so a response that has not been
+    read still counts against the window and holds its connection. Failed and throttled
+    attempts are reported as they happen. The final response is reported once read has
+    finished, so its latency covers downloading and parsing the body, not just the headers.
+    """
+    limiter.acquire()
+    received = []
+
+    def on_response(status_code, latency, headers):
+        if status_code is None or status_code in RETRY_STATUS_CODES:
+            limiter.observe(status_code, latency, headers)
+        else:
+            received.append((status_code, latency, headers, time.monotonic()))
+
+    try:
+        response = get_bibs(
+            part, mms_ids, view, on_response=on_response, stream=read is not None
+        )
+        return _read_bibs(response, read)
+    finally:
+        for status_code, latency, headers, received_at in received:
+            latency += time.monotonic() - received_at
+            limiter.observe(status_code, latency, headers)
+        limiter.release()
+
+
+def _get_chunk(part, mms_ids, view, read=None, limiter=None):
+    """Requests and reads one chunk of fetch_bibs, returning None if either failed.
+
+    Connection errors and timeouts left after MAX_RETRIES, responses missing from a
+    replay, and ValueErrors raised by read only fail their own chunk. QuotaExceeded is
+    raised so the caller stops.
+    """
+    try:
+        if limiter is None:
+            response = get_bibs(part, mms_ids, view, stream=read is not None)
+            return _read_bibs(response, read)
+        return _get_bibs_adaptive(limiter, part, mms_ids, view, read)
+    except (
+        ValueError,
+        requests.RequestException,
+        response_capture.CaptureMissing,
+    ) as e:
+        logger.error(f"Batch {part} failed with {e}.")
+        return None
+
+
+def _discard_pending(pending):
+    """Cancels chunks not yet sent and waits for those already in progress."""
+    for key, future in pending:
+        future.cancel()
+    for key, future in pending:
+        if not future.cancelled():
+            future.exception()
+    pending.clear()
+
+
+def fetch_bibs(request_dict, max_workers=MAX_WORKERS, view="full", read=None):
+    """Query API for every chunk in a request dictionary with bounded parallelism.
+
+    Args:
+        request_dict (dict) | Output of chunk_identifiers, keys are chunk numbers as strings.
+        max_workers (int) | Maximum number of requests in flight. 1 or None calls the API in series.
+            ADAPTIVE ("auto") lets an AdaptiveLimiter set the number from API latency,
+            throttling and remaining quota.
+        view (str) | Passed to get_bibs.
+        read (function) | Called with each response in the worker thread that requested
+            it, e.g. extract_xml.read_records_from_response. The response is streamed,
+            read and closed there, so no connection is held by a response waiting for
+            the caller, and its result is yielded instead of the response.
+
+    Processing:
+        Submits get_bibs calls to a thread pool, holding no more than twice
+        max_workers chunks that have been submitted but not yet returned. A chunk whose
+        request raises a connection error, timeout or CaptureMissing, or whose read
+        raises ValueError, is logged and yielded as None, and later chunks are still
+        requested. If the caller stops early or an exception such as QuotaExceeded ends
+        the run, chunks not yet sent are cancelled.
+
+    Yields:
+        Tuple of (key, API response or result of read) in the same order as request_dict.
+    """
+    total = len(request_dict)
+    if max_workers is None or (max_workers != ADAPTIVE and max_workers <= 1):
+        for key in request_dict:
+            response = _get_chunk(key, request_dict[key], view, read)
+            logger.info(f"Retrieved batch {key} ({int(key) + 1} of {total}).")
+            yield key, response
+        return
+    limiter = None
+    if max_workers == ADAPTIVE:
+        limiter = AdaptiveLimiter()
+        max_workers = limiter.maximum
+    window = max_workers * 2
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        try:
+            for key in request_dict:
+                future = executor.submit(
+                    _get_chunk, key, request_dict[key], view, read, limiter
+                )
+                pending.append((key, future))
+                while len(pending) >= window:
+                    yield _next_completed_batch(pending, total, limiter)
+            while pending:
+                yield _next_completed_batch(pending, total, limiter)
+        finally:
+            _discard_pending(pending)
+    if limiter is not None:
+        logger.info(f"Adaptive concurrency summary: {limiter.stats()}")
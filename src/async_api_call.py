@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import aiohttp
+from src.api_call import *
+from src.extract_xml import iter_records_from_bibs
+from src.bib_cache import BibCache, write_cached_records
+from src.id_set import without
+from src.record_store import write_record
+
+logger = logging.getLogger()
+
+ASYNC_MAX_IN_FLIGHT = 100
+
+
+def create_session(max_in_flight=ASYNC_MAX_IN_FLIGHT):
+    """Returns an aiohttp ClientSession with at most max_in_flight open connections.
+
+    Must be created and closed inside a running event loop, e.g. `async with create_session() as session:`.
+    """
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        headers={"Accept-Encoding": "gzip, deflate"},
+    )
+
+
+async def async_get_bibs(session, part, mms_ids):
+    """Async counterpart of get_bibs.
+
+    Args:
+        session (aiohttp.ClientSession) | Session from create_session.
+        part (str) | Number as string representing the chunk of identifiers being sent to API.
+        mms_ids (str) | Up to 100 MMS Ids separated by commas.
+
+    Processing:
+        Claims each attempt from the quota governor and retries throttled and server error
+        responses with the same backoff as api_request.
+
+    Returns:
+        Api response body (str), or None if the request failed.
+    """
+    key = get_api_key()
+    if key == None:
+        logger.info("Async get bibs: Key not configured in API call.")
+        return None
+    headers = {"Authorization": "apikey " + key, "Accept": "application/json"}
+    query = {"mms_id": mms_ids}
+    if response_capture.CAPTURE_MODE == "replay":
+        response = response_capture.replay_response("GET", BASEURL, query)
+        return response.text if response.status_code == 200 else None
+    governor = get_governor()
+    for attempt in range(MAX_RETRIES + 1):
+        await asyncio.to_thread(governor.acquire)
+        try:
+            async with session.get(BASEURL, params=query, headers=headers) as response:
+                logger.debug(f"Async API GET request sent. Batch number {part}")
+                await asyncio.to_thread(governor.record_response, response)
+                if response.status in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+                    logger.warning(
+                        f"Batch {part} returned status {response.status}. Retry {attempt + 1} of {MAX_RETRIES}."
+                    )
+                    delay = get_retry_delay(response, attempt)
+                elif response.status != 200:
+                    logger.error(f"Batch {part} failed with status {response.status}.")
+                    return None
+                else:
+                    body = await response.read()
+                    if response_capture.CAPTURE_MODE == "record":
+                        await asyncio.to_thread(
+                            response_capture.save_capture,
+                            "GET",
+                            BASEURL,
+                            query,
+                            None,
+                            response.status,
+                            response.headers,
+                            body,
+                        )
+                    return body.decode("utf-8", errors="backslashreplace")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == MAX_RETRIES:
+                logger.error(f"Batch {part} failed: {e}")
+                return None
+            logger.warning(
+                f"Batch {part} failed with {e}. Retry {attempt + 1} of {MAX_RETRIES}."
+            )
+            delay = get_retry_delay(None, attempt)
+        await asyncio.sleep(delay)
+    return None
+
+
+async def async_fetch_records(request_dict, session, max_in_flight=ASYNC_MAX_IN_FLIGHT):
+    """Query API for every chunk in a request dictionary on the running event loop.
+
+    Args:
+        request_dict (dict) | Output of chunk_identifiers.
+        session (aiohttp.ClientSession) | Session from create_session.
+        max_in_flight (int) | Maximum number of chunk requests awaiting a response.
+
+    Yields:
+        Tuple of (key, list of pymarc Record objects, {mms_id: last_modified_date}) in
+        order of completion. A chunk that fails after retries is logged with its
+        identifiers and yields no records.
+    """
+    total = len(request_dict)
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def fetch(key):
+        async with semaphore:
+            body = await async_get_bibs(session, key, request_dict[key])
+        dates = {}
+        try:
+            if body is None:
+                raise ValueError("no response")
+            # The body is parsed one bib at a time rather than loaded as a whole.
+            records = list(iter_records_from_bibs([body], dates))
+        except ValueError as e:
+            print(f"WARNING: Batch {key} failed. Consult logfile for more information.")
+            logger.error(
+                f"Batch {key} failed with {e}. Records not retrieved: {request_dict[key]}"
+            )
+            return key, [], {}
+        return key, records, dates
+
+    tasks = [asyncio.create_task(fetch(key)) for key in request_dict]
+    try:
+        for task in asyncio.as_completed(tasks):
+            key, records, dates = await task
+            logger.info(
+                f"Retrieved batch {key} ({len(records)} records, {total} batches)."
+            )
+            yield key, records, dates
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def async_get_missing_records(
+    existing_records,
+    request_ids,
+    output_directory,
+    session=None,
+    max_in_flight=ASYNC_MAX_IN_FLIGHT,
+    use_cache=True,
+    destinations=None,
+):
+    """Async counterpart of get_missing_records.
+
+    Args:
+        existing_records: list (str) - identifiers for already downloaded records.
+        request_ids: list (str) or MMSIdSet - identifiers required for download (may overlap with existing)
+        output_directory: str - directory to write retrieved records to.
+        session: aiohttp.ClientSession - shared session. A new session is created if None.
+        max_in_flight: int - maximum number of chunk requests awaiting a response.
+        use_cache: bool - load fresh records from the local bib cache and add retrieved records to it.
+        destinations: dict - {mms_id: list of directories} to write records to instead of
+                    output_directory, e.g. from fetch_planner.plan_fetch.
+
+    Processing:
+        Reserves the calls needed with the quota governor. Writes each record to
+        record_<id>.mrc as soon as its chunk is returned. The cache is not used when
+        API_CAPTURE_MODE is record or replay. The reservation is released when
+        the job ends, leaving those of other jobs sharing the session in place.
+
+    Returns:
+        List of identifiers retrieved from the API and written to output_directory.
+    """
+    if destinations is None:
+        destinations = {}
+    if response_capture.CAPTURE_MODE in ("record", "replay"):
+        # Captures are keyed by the ids of each chunk, see get_missing_records.
+        use_cache = False
+    missing_list = without(request_ids, existing_records)
+    if use_cache:
+        cache = BibCache()
+        missing_list = await asyncio.to_thread(
+            write_cached_records, cache, missing_list, output_directory, destinations
+        )
+    logger.info(f"Async request for {len(missing_list)} missing records.")
+    required = chunk_identifiers(missing_list)
+    written = []
+    if len(required) == 0 or not await asyncio.to_thread(check_api_key):
+        return written
+    governor = get_governor()
+    reservation = await asyncio.to_thread(governor.reserve, len(required))
+    if reservation is None:
+        print(
+            "WARNING: Too few API calls remaining to retrieve records. Consult logfile for more information."
+        )
+        return written
+    own_session = session is None
+    if own_session:
+        session = create_session(max_in_flight)
+    try:
+        async for key, records, dates in async_fetch_records(
+            required, session, max_in_flight
+        ):
+            retrieved = {}
+            for record in records:
+                id = record.get_fields("001")[0].value()
+                retrieved[id] = record.as_marc()
+                for directory in destinations.get(id, [output_directory]):
+                    write_record(directory, id, retrieved[id])
+                written.append(id)
+            if use_cache:
+                await asyncio.to_thread(cache.put_many, retrieved, dates)
+    except QuotaExceeded as e:
+        print(
+            f"WARNING: API quota floor reached. Keeping records retrieved so far. {e}"
+        )
+        logger.error(f"API quota floor reached, retrieval stopped: {e}")
+    finally:
+        if own_session:
+            await session.close()
+        await asyncio.to_thread(governor.release, reservation)
+    return written
+
+
+async def async_get_missing_records_together(
+    jobs, max_in_flight=ASYNC_MAX_IN_FLIGHT, use_cache=True
+):
+    """Runs several get missing records jobs concurrently on one event loop and session.
+
+    Args:
+        jobs: list of tuples (existing_records, request_ids, output_directory).
+        max_in_flight: int - maximum number of open connections shared by all jobs.
+        use_cache: bool - passed to async_get_missing_records.
+
+    Returns:
+        List with the identifiers written by each job, in the same order as jobs.
+    """
+    async with create_session(max_in_flight) as session:
+        return await asyncio.gather(
+            *(
+                async_get_missing_records(
+                    existing,
+                    request_ids,
+                    output_directory,
+                    session,
+                    max_in_flight,
+                    use_cache,
+                )
+                for existing, request_ids, output_directory in jobs
+            )
+        )
@@ -0,0 +1,215 @@
+import logging
+import os
+import sqlite3
+import time
+from itertools import islice
+
+from src.id_set import without
+from src.marc_index import LazyRecord
+from src.record_sinks import DirectorySink
+
+logger = logging.getLogger()
+
+# Cache settings, can be overridden in .env
+CACHE_PATH = os.getenv("BIB_CACHE_PATH", os.path.join("cache", "bib_cache.sqlite"))
+CACHE_TTL = int(os.getenv("BIB_CACHE_TTL", 7 * 24 * 60 * 60))  # seconds
+CACHE_MAX_BYTES = int(os.getenv("BIB_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+SQLITE_TIMEOUT = 60
+SQLITE_BATCH = 500
+
+
+def iter_batches(mms_ids, size=SQLITE_BATCH):
+    """Yields lists of up to size identifiers, without copying mms_ids to a list first."""
+    iterator = iter(mms_ids)
+    while True:
+        batch = list(islice(iterator, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+class BibCache:
+    """Persistent cache of MARC records keyed by MMS Id.
+
+    Records are stored as MARC (.mrc) bytes in a SQLite database so several scripts
+    can read and write the same cache at once. Entries older than ttl seconds are
+    treated as missing. When the cache holds more than max_bytes of records the
+    least recently used entries are removed.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bibs ("
+                "mms_id TEXT PRIMARY KEY, "
+                "data BLOB NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "fetched_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL, "
+                "last_modified TEXT)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS bibs_accessed ON bibs (accessed_at)"
+            )
+            # Caches created before modification dates were recorded.
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(bibs)")]
+            if "last_modified" not in columns:
+                conn.execute("ALTER TABLE bibs ADD COLUMN last_modified TEXT")
+        conn.close()
+
+    def _connect(self):
+        """Opens a connection. A new connection is used for each operation so the cache
+        can be shared between threads."""
+        conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get_many(self, mms_ids):
+        """Returns a dictionary of {mms_id: MARC bytes} for fresh cached records.
+
+        Marks the returned records as recently used.
+        """
+        found = {}
+        now = time.time()
+        with self._connect() as conn:
+            for batch in iter_batches(mms_ids):
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT mms_id, data FROM bibs WHERE fetched_at >= ? AND mms_id IN ({placeholders})",
+                    [now - self.ttl] + batch,
+                ).fetchall()
+                found.update(rows)
+            conn.executemany(
+                "UPDATE bibs SET accessed_at = ? WHERE mms_id = ?",
+                [(now, mms_id) for mms_id in found],
+            )
+        conn.close()
+        return found
+
+    def get(self, mms_id):
+        """Returns MARC bytes for a fresh cached record or None."""
+        return self.get_many([mms_id]).get(mms_id)
+
+    def put_many(self, records, modified=None):
+        """Adds or replaces records from a dictionary of {mms_id: MARC bytes}, then evicts
+        least recently used records if the cache is over max_bytes.
+
+        modified is an optional dictionary of {mms_id: Alma last_modified_date}."""
+        if len(records) == 0:
+            return
+        if modified is None:
+            modified = {}
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO bibs "
+                "(mms_id, data, size, fetched_at, accessed_at, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (mms_id, data, len(data), now, now, modified.get(mms_id))
+                    for mms_id, data in records.items()
+                ],
+            )
+            self._evict(conn)
+        conn.close()
+
+    def put(self, mms_id, data, modified=None):
+        """Adds or replaces a single record."""
+        self.put_many({mms_id: data}, {mms_id: modified})
+
+    def get_fetched(self, mms_ids):
+        """Returns a dictionary of {mms_id: time fetched (seconds since the epoch)} for
+        cached records, whether or not they are still fresh."""
+        found = {}
+        with self._connect() as conn:
+            for batch in iter_batches(mms_ids):
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT mms_id, fetched_at FROM bibs WHERE mms_id IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                found.update(rows)
+        conn.close()
+        return found
+
+    def touch(self, mms_ids):
+        """Marks records as fetched now, e.g. once Alma confirms they are unchanged."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE bibs SET fetched_at = ?, accessed_at = ? WHERE mms_id = ?",
+                [(now, now, mms_id) for mms_id in mms_ids],
+            )
+        conn.close()
+
+    def _evict(self, conn):
+        """Deletes least recently used records until the cache fits within max_bytes."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM bibs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        removed = 0
+        for mms_id, size in conn.execute(
+            "SELECT mms_id, size FROM bibs ORDER BY accessed_at ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM bibs WHERE mms_id = ?", (mms_id,))
+            total -= size
+            removed += 1
+        logger.info(f"Bib cache over size limit. Removed {removed} records.")
+
+    def clear(self):
+        """Removes all records from the cache."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM bibs")
+        conn.close()
+
+
+def write_cached_records(
+    cache, request_ids, output_directory, destinations=None, sink=None, on_records=None
+):
+    """Writes fresh cached records to output_directory as record_<id>.mrc, or to its record store.
+
+    Args:
+        cache (BibCache) | cache to read from.
+        request_ids (list or MMSIdSet) | identifiers required for download.
+        output_directory (str) | directory to write records to.
+        destinations (dict) | {mms_id: list of directories} to write records to instead of
+            output_directory, as in get_missing_records.
+        sink (object) | where records go, as in get_missing_records. Defaults to a
+            DirectorySink for output_directory and destinations.
+        on_records (function) | called with the list of records loaded from the cache.
+
+    Returns:
+        List of identifiers not found in the cache, in the same order as request_ids, or
+        an MMSIdSet if request_ids is one.
+        Cached records that cannot be read are logged and left to be requested again.
+    """
+    cached = cache.get_many(request_ids)
+    own_sink = sink is None
+    if own_sink:
+        sink = DirectorySink(output_directory, destinations)
+    written = set()
+    records = []
+    for mms_id, data in cached.items():
+        try:
+            record = LazyRecord(data)
+        except Exception as e:
+            logger.error(f"Unable to read cached record {mms_id}: {e}")
+            continue
+        sink.write(record, data)
+        written.add(mms_id)
+        records.append(record)
+    if own_sink:
+        sink.close()
+    if on_records is not None and len(records) > 0:
+        on_records(records)
+    print(f"Records loaded from cache: {len(written)}")
+    logger.info(f"Records loaded from cache: {len(written)} of {len(request_ids)}")
+    return without(request_ids, written)
@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import time
+from urllib.parse import urljoin
+
+import pymarc
+
+import src.api_call as api_call
+from src.id_set import MMSIdSet
+from src.record_sinks import DirectorySink
+from src.shared_functions import get_missing_records
+
+logger = logging.getLogger()
+
+# Bulk export settings, can be overridden in .env
+BULK_EXPORT_THRESHOLD = int(os.getenv("BULK_EXPORT_THRESHOLD", 50000))
+EXPORT_JOB_ID = os.getenv("ALMA_EXPORT_JOB_ID")
+EXPORT_PATH = os.getenv("ALMA_EXPORT_PATH")
+SET_MEMBER_BATCH = 1000
+POLL_INTERVAL = 30
+JOB_TIMEOUT = 6 * 60 * 60
+JOB_FAILED = ("COMPLETED_FAILED", "FAILED", "SYSTEM_ABORTED", "MANUALLY_ABORTED")
+# Keyword arguments of get_records_with_export used only by the export job.
+EXPORT_OPTIONS = ("job_id", "export_dir", "poll_interval", "timeout")
+
+
+class BulkExportError(Exception):
+    """Raised when a set or export job cannot be created or does not complete."""
+
+
+def get_conf_url():
+    """Returns the Alma configuration API url for the current BASEURL."""
+    return urljoin(api_call.BASEURL, "../conf/")
+
+
+def get_headers():
+    return {
+        "Authorization": "apikey " + api_call.get_api_key(),
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+    }
+
+
+def _post(url, body, params=None):
+    response = api_call.api_request(
+        "POST", url, params=params, headers=get_headers(), data=json.dumps(body)
+    )
+    if response.status_code != 200:
+        raise BulkExportError(
+            f"POST {url} returned status {response.status_code}: {response.text}"
+        )
+    return response.json()
+
+
+def _members(mms_ids):
+    return {"members": {"member": [{"id": mms_id} for mms_id in mms_ids]}}
+
+
+def create_set(mms_ids, name):
+    """Creates an itemized set of bib records in Alma.
+
+    Args:
+        mms_ids: list (str) - identifiers to add to the set.
+        name: str - set name shown in Alma.
+
+    Returns:
+        Set id (str). Members are added SET_MEMBER_BATCH at a time.
+    """
+    batches = [
+        mms_ids[i : i + SET_MEMBER_BATCH]
+        for i in range(0, len(mms_ids), SET_MEMBER_BATCH)
+    ]
+    body = {
+        "name": name,
+        "type": {"value": "ITEMIZED"},
+        "content": {"value": "BIB_MMS"},
+        "private": {"value": "true"},
+    }
+    body.update(_members(batches[0] if batches else []))
+    set_id = _post(get_conf_url() + "sets", body)["id"]
+    logger.info(f"Created set {set_id} for bulk export.")
+    for batch in batches[1:]:
+        _post(get_conf_url() + f"sets/{set_id}", _members(batch), {"op": "add_members"})
+    logger.info(f"Added {len(mms_ids)} members to set {set_id}.")
+    return set_id
+
+
+def delete_set(set_id):
+    """Deletes a set created for an export."""
+    response = api_call.api_request(
+        "DELETE", get_conf_url() + f"sets/{set_id}", headers=get_headers()
+    )
+    if response.status_code not in (200, 204):
+        logger.warning(f"Could not delete set {set_id}: status {response.status_code}.")
+
+
+def run_export_job(set_id, job_id):
+    """Runs the export job on a set and returns the url of the job instance."""
+    body = {"parameter": [{"name": {"value": "set_id"}, "value": set_id}]}
+    job = _post(get_conf_url() + f"jobs/{job_id}", body, {"op": "run"})
+    link = job["additional_info"]["link"]
+    logger.info(f"Export job started: {job['additional_info'].get('value')}")
+    return urljoin(api_call.BASEURL, link)
+
+
+def wait_for_job(instance_url, poll_interval=POLL_INTERVAL, timeout=JOB_TIMEOUT):
+    """Polls a job instance until it completes.
+
+    Returns:
+        Job instance (dict) once its status is COMPLETED_SUCCESS or COMPLETED_WARNING.
+        Raises BulkExportError if the job fails or does not finish within timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        response = api_call.api_request("GET", instance_url, headers=get_headers())
+        if response.status_code != 200:
+            raise BulkExportError(
+                f"Job status request returned status {response.status_code}."
+            )
+        instance = response.json()
+        status = instance["status"]["value"]
+        logger.info(
+            f"Export job status: {status}, progress {instance.get('progress')}."
+        )
+        if status.startswith("COMPLETED") and status not in JOB_FAILED:
+            return instance
+        if status in JOB_FAILED:
+            raise BulkExportError(f"Export job finished with status {status}.")
+        if time.monotonic() > deadline:
+            raise BulkExportError(f"Export job not finished after {timeout} seconds.")
+        time.sleep(poll_interval)
+
+
+def find_export_files(export_dir, instance_id, started):
+    """Returns the export files written by a job instance.
+
+    Files named with the instance id are preferred. Otherwise MARC files modified since
+    the job started are returned, oldest first.
+    """
+    files = [
+        os.path.join(export_dir, file)
+        for file in os.listdir(export_dir)
+        if os.path.isfile(os.path.join(export_dir, file))
+    ]
+    named = sorted(file for file in files if instance_id in os.path.basename(file))
+    if len(named) > 0:
+        return named
+    recent = [
+        file
+        for file in files
+        if file.endswith(".mrc") and os.path.getmtime(file) >= started
+    ]
+    return sorted(recent, key=os.path.getmtime)
+
+
+def ingest_export_file(
+    export_file,
+    output_directory,
+    destinations=None,
+    wanted=None,
+    sink=None,
+    on_records=None,
+):
+    """Splits an exported MARC file into record files, one record at a time.
+
+    Args:
+        export_file: path - binary MARC file from the export job.
+        output_directory: path - directory to write record_<mms_id>.mrc files to.
+        destinations: dict - {mms_id: list of directories} to write to instead of output_directory.
+        wanted: set (str) - only write these identifiers, all records if None.
+        sink: object with write(record, data) - where records go, as for get_missing_records.
+        on_records: function - called with each list of up to IDS_PER_CALL records written.
+
+    Returns:
+        List of identifiers written.
+    """
+    if sink is None:
+        sink = DirectorySink(output_directory, destinations)
+    written = []
+    batch = []
+    with open(export_file, "rb") as fh:
+        for record in pymarc.MARCReader(fh):
+            if record is None or len(record.get_fields("001")) == 0:
+                logger.warning(f"Skipping unreadable record in {export_file}")
+                continue
+            id = record.get_fields("001")[0].value()
+            if wanted is not None and id not in wanted:
+                continue
+            sink.write(record, record.as_marc())
+            written.append(id)
+            if on_records is not None:
+                batch.append(record)
+                if len(batch) == api_call.IDS_PER_CALL:
+                    on_records(batch)
+                    batch = []
+    if len(batch) > 0:
+        on_records(batch)
+    return written
+
+
+def get_records_by_export(
+    request_ids,
+    output_directory,
+    destinations=None,
+    job_id=EXPORT_JOB_ID,
+    export_dir=EXPORT_PATH,
+    poll_interval=POLL_INTERVAL,
+    timeout=JOB_TIMEOUT,
+    sink=None,
+    on_records=None,
+):
+    """Retrieves records with an Alma export job instead of bibs API requests.
+
+    Args:
+        request_ids: list (str) or MMSIdSet - identifiers required for download.
+        output_directory: path - directory to write record files to.
+        destinations: dict - {mms_id: list of directories}, as for get_missing_records.
+        job_id: str - id of the institution's Export Bibliographic Records job.
+        export_dir: path - directory the job's export profile delivers files to.
+        sink, on_records: passed to ingest_export_file.
+
+    Processing:
+        Creates an itemized set of request_ids, runs the export job on it and polls until
+        it completes. Streams the exported file into the output directories, then deletes
+        the set. Uses one API call per SET_MEMBER_BATCH identifiers plus status polls, rather
+        than one per 100.
+
+    Returns:
+        List of identifiers written.
+    """
+    if job_id is None or export_dir is None:
+        raise BulkExportError("ALMA_EXPORT_JOB_ID and ALMA_EXPORT_PATH must be set.")
+    if api_call.get_api_key() is None:
+        raise BulkExportError("API Key not configured.")
+    started = time.time()
+    set_id = create_set(
+        list(request_ids), f"metadata_cleanup_{time.strftime('%Y%m%d-%H%M%S')}"
+    )
+    try:
+        instance_url = run_export_job(set_id, job_id)
+        instance = wait_for_job(instance_url, poll_interval, timeout)
+    finally:
+        delete_set(set_id)
+
+    instance_id = str(instance.get("id", instance_url.rstrip("/").split("/")[-1]))
+    wanted = request_ids if isinstance(request_ids, MMSIdSet) else set(request_ids)
+    written = []
+    for export_file in find_export_files(export_dir, instance_id, started):
+        logger.info(f"Ingesting export file {export_file}")
+        written.extend(
+            ingest_export_file(
+                export_file, output_directory, destinations, wanted, sink, on_records
+            )
+        )
+    print(f"Bulk export wrote {len(written)} of {len(wanted)} records.")
+    logger.info(f"Bulk export wrote {len(written)} of {len(wanted)} records.")
+    return written
+
+
+def get_records_with_export(
+    request_ids, output_directory, threshold=BULK_EXPORT_THRESHOLD, **kwargs
+):
+    """Retrieves records by export job for large jobs and by bibs API requests otherwise.
+
+    Jobs with at least threshold identifiers are exported when ALMA_EXPORT_JOB_ID and
+    ALMA_EXPORT_PATH are set. Records missing from the export, or every record if the
+    export fails, are then requested with get_missing_records.
+
+    kwargs in EXPORT_OPTIONS are passed to get_records_by_export. The others, e.g.
+    destinations, sink and on_records, are passed to get_missing_records, and
+    destinations, sink and on_records to get_records_by_export as well.
+
+    Returns:
+        List of identifiers written.
+    """
+    export_options = {key: kwargs.pop(key) for key in EXPORT_OPTIONS if key in kwargs}
+    for key in ("destinations", "sink", "on_records"):
+        if key in kwargs:
+            export_options[key] = kwargs[key]
+    exported = []
+    if len(request_ids) >= threshold:
+        try:
+            exported = get_records_by_export(
+                request_ids, output_directory, **export_options
+            )
+        except (BulkExportError, api_call.QuotaExceeded) as e:
+            print(f"Bulk export failed, requesting records individually: {e}")
+            logger.error(f"Bulk export failed: {e}")
+    retrieved = get_missing_records(exported, request_ids, output_directory, **kwargs)
+    return exported + retrieved
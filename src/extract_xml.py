@@ -1,9 +1,131 @@
+import codecs
 import json
 import logging
-from os import getenv, path, walk
+import re
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count, getenv, path, walk
+
+from lxml import etree
+
+from src.xml_load_and_process import record_from_element
 
 logger = logging.getLogger()
 
+XML_PARSER = etree.XMLParser(huge_tree=True)
+JSON_CHUNK_SIZE = 64 * 1024
+CONVERT_PROCESSES = cpu_count() or 1
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+class _JSONStream:
+    """Decodes JSON values one at a time from an iterable of text chunks.
+
+    Only the unread part of the text is kept, so memory is bounded by the largest single
+    value plus one chunk rather than by the whole document.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ""
+        self.pos = 0
+        self.done = False
+
+    def _read(self):
+        """Appends the next chunk to the unread text. Returns False at the end."""
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.done = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Returns the next character that is not whitespace, or "" at the end."""
+        while True:
+            self.pos = _whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next value, reading more chunks until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk.
+                if end < len(self.buffer) or self.done:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.done:
+                    raise
+            self._read()
+
+
+def iter_bib_items(chunks):
+    """Yields each item of the 'bib' array in an Alma bibs API response as it is read.
+
+    Args:
+        chunks: iterable of str - the response text in pieces, e.g. from iter_text_file or
+                iter_response_text.
+
+    Processing:
+        Walks the top level object with an incremental decoder. Other keys, e.g.
+        'total_record_count', are decoded and skipped. Raises json.JSONDecodeError if the
+        text is not valid JSON.
+    """
+    stream = _JSONStream(chunks)
+    stream.expect("{")
+    while stream.peek() != "}":
+        key = stream.value()
+        stream.expect(":")
+        if key == "bib" and stream.peek() == "[":
+            stream.expect("[")
+            while stream.peek() != "]":
+                yield stream.value()
+                if stream.peek() != ",":
+                    break
+                stream.expect(",")
+            stream.expect("]")
+        else:
+            stream.value()
+        if stream.peek() != ",":
+            break
+        stream.expect(",")
+    stream.expect("}")
+
+
+def iter_text_file(filename, chunk_size=JSON_CHUNK_SIZE):
+    """Yields the text of a saved API response in chunks."""
+    with open(filename, "r", encoding="utf-8", errors="backslashreplace") as file:
+        for chunk in iter(lambda: file.read(chunk_size), ""):
+            yield chunk
+
+
+def iter_response_text(response, chunk_size=JSON_CHUNK_SIZE):
+    """Yields the text of a requests Response in chunks, as it arrives when sent with stream=True."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="backslashreplace")
+    for chunk in response.iter_content(chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def iter_records_from_json(chunks):
+    """Yields ("mms_id", anies) for each bib with MARCxml in an API response, as it is read."""
+    for item in iter_bib_items(chunks):
+        if "anies" in item:
+            yield item["mms_id"], item["anies"]
+
 
 def get_record_from_json(json_object):
     """
@@ -11,68 +133,165 @@ def get_record_from_json(json_object):
     Processing: json.loads(file) converts ASCII backslash replaced characters with UTF-8.
     Generates a list of records as dictionary "mms_id" : "xml" key value pairs.
     """
-
-    bibs = json.loads(json_object)
+    records = dict(iter_records_from_json([json_object]))
     logger.debug("Json loaded from api output")
-    records = {}
-    for item in bibs["bib"]:
-        for key in item:
-            if key == "anies":
-                records.update({item["mms_id"]: item["anies"]})
     return records
 
 
-def iterate_returned_requests(dir_name, output_dir):
+def get_modified_dates_from_bibs(bibs):
+    """Returns the Alma modification date for each record in a parsed bibs API response.
+
+    Args:
+        bibs (dict) | API response loaded from json with a 'bib' list.
+
+    Returns:
+        Dictionary of "mms_id" : "last_modified_date" (e.g. "2023-10-20Z").
+        Falls back to "created_date" for records that have never been modified.
+    """
+    dates = {}
+    for item in bibs.get("bib", []):
+        modified = item.get("last_modified_date", item.get("created_date"))
+        dates.update({item["mms_id"]: modified})
+    return dates
+
+
+def iter_records_from_bibs(chunks, dates=None):
+    """Yields a pymarc Record for each bib with MARCxml in an API response, as it is read.
+
+    Args:
+        chunks: iterable of str - the response text in pieces, e.g. from iter_response_text.
+        dates: dict or None - filled with "mms_id" : "last_modified_date" for each record
+                yielded, as get_modified_dates_from_bibs returns.
+
+    Raises ValueError if the response is not valid JSON or a record is not valid MARCxml,
+    so callers can fail the chunk rather than the run.
+    """
+    for item in iter_bib_items(chunks):
+        try:
+            record = get_pymarc_record_from_bib(item)
+        except etree.XMLSyntaxError as e:
+            raise ValueError(f"Invalid MARCxml for {item.get('mms_id')}: {e}") from e
+        if record is None:
+            continue
+        if dates is not None:
+            dates[item["mms_id"]] = item.get(
+                "last_modified_date", item.get("created_date")
+            )
+        yield record
+
+
+def read_records_from_response(response):
+    """Reads a streamed bibs API response, e.g. as the read function of api_call.fetch_bibs.
+
+    Returns:
+        Tuple (list of pymarc Records, {"mms_id": "last_modified_date"}).
+        Raises ValueError if the response status is not 200 or its body cannot be read.
+    """
+    if response.status_code != 200:
+        raise ValueError(f"status {response.status_code}")
+    dates = {}
+    records = list(iter_records_from_bibs(iter_response_text(response), dates))
+    return records, dates
+
+
+def get_pymarc_record_from_bib(item):
+    """Converts one bib from an API response to a pymarc Record. Returns None without 'anies'."""
+    if "anies" not in item:
+        return None
+    xml = fix_xml_header_encoding(item["anies"][0])
+    if xml is None:
+        return None
+    return record_from_element(etree.fromstring(xml.encode("utf-8"), XML_PARSER))
+
+
+def convert_json_file(filename, output_dir):
+    """Writes each MARCxml record in one saved API response to record_<mms_id>.xml.
+
+    Runs in a worker process in iterate_returned_requests, so errors are returned rather
+    than logged.
+
+    Returns:
+        Tuple (filename, list of ids written, list of error messages).
+    """
+    written = []
+    errors = []
+    try:
+        for key, anies in iter_records_from_json(iter_text_file(filename)):
+            try:
+                xml = fix_xml_header_encoding(anies[0])
+                with open(
+                    path.join(output_dir, f"record_{key}.xml"),
+                    "w",
+                    encoding="utf-8",
+                    errors="backslashreplace",
+                ) as output:
+                    output.write(xml)
+                written.append(key)
+            except Exception as e:
+                errors.append(f"Error updating encoding for record {key}: {e}")
+    except Exception as e:
+        errors.append(f"Error occured while iterating dictionary in {filename}: {e}")
+    return filename, written, errors
+
+
+def iterate_returned_requests(dir_name, output_dir, processes=None):
     """Processes json files retrieved from Alma API to xml records.
 
     args:
         dir_name (path) - location of json files.
         output_dir (path) - output directory for xml files.
+        processes (int) - number of worker processes. None (the default) uses
+                          CONVERT_PROCESSES (one per core), 1 converts the files in
+                          this process.
 
     Processing:
-        - Opens each file in the directory.
-        - Gets MARCxml record from json as a dict of 'mms_id':'xml'.
+        - Reads each file in the directory a chunk at a time.
+        - Gets MARCxml records from json as 'mms_id', 'xml' pairs as they are read.
         - Strips header which contains incorrect encoding.
+        - An error in one file is logged and the remaining files are still converted.
 
     Output: writes the files to the desired location.
+
+    Returns:
+        List of MMS Ids written.
     """
     logger.debug("Inside iterate_directory")
-    for root, dirs, files in walk(dir_name):
-        logger.debug(files)
-        log_list = []
-        for file in files:
-            filename = path.join(dir_name, file)
-            try:
-                with open(
-                    filename, "r", encoding="utf-8", errors="backslashreplace"
-                ) as json_file:
-                    json = json_file.read()
-                records = get_record_from_json(json)
-                for key in records:
-                    try:
-                        records.update(
-                            {key: (fix_xml_header_encoding(records[key][0]))}
-                        )
-                        with open(
-                            path.join(
-                                output_dir,
-                                f"record_{key}.xml",
-                                "w",
-                                encoding="utf-8",
-                                errors="backslashreplace",
-                            )
-                        ) as file:
-                            file.write(records[key])
-                            log_list.append(key)
-                    except Exception as e:
-                        logger.error(f"Error updating encoding for record {key}: {e}")
-                logger.info("Records written to: " + output_dir)
-                final_list = ";".join(log_list)
-                logger.debug(f"Created file for records: {final_list}")
-            except Exception as e:
-                logger.error(f"Error occured while iterating dictionary: {e}")
-                break
-        return True
+    files = sorted(next(walk(dir_name), (None, None, []))[2])
+    logger.debug(files)
+    filenames = [path.join(dir_name, file) for file in files]
+    if processes is None:
+        processes = CONVERT_PROCESSES
+    processes = max(1, min(processes, len(filenames)))
+
+    if processes == 1:
+        results = (convert_json_file(filename, output_dir) for filename in filenames)
+        log_list = _log_converted_files(results)
+    else:
+        output_dirs = [output_dir] * len(filenames)
+        chunksize = max(1, len(filenames) // (processes * 4))
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = executor.map(
+                convert_json_file, filenames, output_dirs, chunksize=chunksize
+            )
+            log_list = _log_converted_files(results)
+
+    logger.info(
+        f"{len(log_list)} records from {len(filenames)} files written to: {output_dir}"
+    )
+    final_list = ";".join(log_list)
+    logger.debug(f"Created file for records: {final_list}")
+    return log_list
+
+
+def _log_converted_files(results):
+    """Logs the errors from each convert_json_file result. Returns all ids written."""
+    log_list = []
+    for filename, written, errors in results:
+        for error in errors:
+            logger.error(error)
+        logger.debug(f"{len(written)} records written from {filename}")
+        log_list.extend(written)
+    return log_list
 
 
 def fix_xml_header_encoding(xml_record):
@@ -0,0 +1,449 @@
+"""Local stand-in for the Alma bibs API used to test the fetch path without using quota.
+
+Point api_call.BASEURL (or ALMA_API_BASEURL in .env) at the url returned by start_server,
+or run as a script: python -m src.fake_alma_api tests/test_data/marc_data/parent
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pymarc
+
+logger = logging.getLogger()
+
+API_PATH = "/almaws/v1/"
+BIBS_PATH = API_PATH + "bibs/"
+SETS_PATH = API_PATH + "conf/sets"
+JOBS_PATH = API_PATH + "conf/jobs/"
+DEFAULT_QUOTA = 100000
+DEFAULT_MODIFIED = "2023-10-20Z"
+ERROR_STATUS_CODES = (500, 502, 503, 504)
+
+
+def get_modified_date(record):
+    """Returns an Alma style modification date ("YYYY-MM-DDZ") from the record's 005 field."""
+    fields = record.get_fields("005")
+    if len(fields) == 0 or len(fields[0].value()) < 8:
+        return DEFAULT_MODIFIED
+    value = fields[0].value()
+    return f"{value[0:4]}-{value[4:6]}-{value[6:8]}Z"
+
+
+def bib_from_record(record):
+    """Builds a bibs API entry in the shape returned by Alma from a pymarc Record."""
+    mms_id = record.get_fields("001")[0].value()
+    xml = pymarc.record_to_xml(record).decode("utf-8")
+    return {
+        "mms_id": mms_id,
+        "record_format": "marc21",
+        "title": record.title,
+        "last_modified_date": get_modified_date(record),
+        "anies": ['<?xml version="1.0" encoding="UTF-16"?>' + xml],
+    }
+
+
+def load_corpus(paths):
+    """Loads the records served by the fake API.
+
+    Args:
+        paths: list of files or directories. MARC files (.mrc) are converted to bibs API
+               entries. JSON files saved from the bibs API (.json) are served as returned.
+
+    Returns:
+        Dictionary of "mms_id" : bib entry.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            files.append(path)
+
+    corpus = {}
+    for file in files:
+        if file.endswith(".json"):
+            with open(file, "r", encoding="utf-8") as f:
+                for bib in json.load(f).get("bib", []):
+                    corpus[bib["mms_id"]] = bib
+        elif file.endswith(".mrc"):
+            with open(file, "rb") as f:
+                for record in pymarc.MARCReader(f):
+                    if record is not None and len(record.get_fields("001")) > 0:
+                        bib = bib_from_record(record)
+                        corpus[bib["mms_id"]] = bib
+    logger.info(f"Fake Alma API corpus loaded with {len(corpus)} records.")
+    return corpus
+
+
+def fixed_latency(seconds):
+    """Returns a latency function that always waits seconds."""
+    return lambda: seconds
+
+
+def uniform_latency(low, high):
+    """Returns a latency function drawing seconds evenly between low and high."""
+    return lambda: random.uniform(low, high)
+
+
+def lognormal_latency(median, sigma=0.5):
+    """Returns a latency function with a long tail, as seen from the hosted API."""
+    if median <= 0:
+        return fixed_latency(0)
+    return lambda: random.lognormvariate(math.log(median), sigma)
+
+
+class FakeAlmaAPI:
+    """Behaviour and counters for the fake bibs API.
+
+    Each request:
+        - waits for a delay drawn from latency.
+        - returns 429 with Retry-After with probability throttle_rate, or once the quota
+          is used up.
+        - returns a random 5xx error with probability error_rate.
+        - otherwise returns the requested bibs, dropping some of them with probability
+          partial_rate to simulate partial responses.
+    Every response carries X-Exl-Api-Remaining, which decreases with each request.
+
+    PUT requests replace records in the corpus, as used by write_back. Itemized sets and
+    an export job are also simulated for bulk_export. A job run is
+    reported as running for job_polls status requests, then writes the set's records as
+    binary MARC to export_dir and completes, as the export profile would on the FTP server.
+    """
+
+    def __init__(
+        self,
+        corpus,
+        latency=None,
+        throttle_rate=0.0,
+        error_rate=0.0,
+        partial_rate=0.0,
+        quota=DEFAULT_QUOTA,
+        retry_after=1,
+        seed=None,
+        export_dir=None,
+        job_polls=2,
+    ):
+        self.corpus = corpus
+        self.latency = latency if latency is not None else fixed_latency(0)
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.partial_rate = partial_rate
+        self.remaining = quota
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.status_counts = {}
+        self.records_served = 0
+        self.export_dir = export_dir
+        self.job_polls = job_polls
+        self.sets = {}
+        self.instances = {}
+        self.updated = []
+        self._lock = threading.Lock()
+
+    def handle(self, path, query, method="GET", body=None):
+        """Returns (status, headers, body) for one request."""
+        with self._lock:
+            self.requests += 1
+            exhausted = self.remaining <= 0
+            if not exhausted:
+                self.remaining -= 1
+            remaining = self.remaining
+            roll = self.random.random()
+            drop = self.random.random()
+        delay = self.latency()
+        if delay > 0:
+            time.sleep(delay)
+
+        headers = {"X-Exl-Api-Remaining": str(remaining)}
+        if exhausted or roll < self.throttle_rate:
+            headers["Retry-After"] = str(self.retry_after)
+            status, body = 429, error_body("PER_SECOND_THRESHOLD", "Too many requests")
+        elif roll < self.throttle_rate + self.error_rate:
+            status = self.random.choice(ERROR_STATUS_CODES)
+            body = error_body("GENERAL_ERROR", "Simulated server error")
+        elif path.startswith(SETS_PATH):
+            status, body = self.handle_set(path, query, method, body)
+        elif path.startswith(JOBS_PATH):
+            status, body = self.handle_job(path, query, method, body)
+        elif method == "PUT" and path.startswith(BIBS_PATH):
+            status, body = self.update_bib(path[len(BIBS_PATH) :].strip("/"), body)
+        elif path.rstrip("/").endswith("/test"):
+            status, body = 200, {"result": "ok"}
+        else:
+            status, body = 200, self.get_bibs(query, drop)
+        with self._lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        return status, headers, body
+
+    def get_bibs(self, query, drop):
+        """Returns the bibs API body for the mms_id and view query parameters."""
+        mms_ids = ",".join(query.get("mms_id", [])).split(",")
+        view = query.get("view", ["full"])[0]
+        bibs = []
+        for mms_id in mms_ids:
+            bib = self.corpus.get(mms_id.strip())
+            if bib is None:
+                continue
+            if view == "brief":
+                bib = {key: value for key, value in bib.items() if key != "anies"}
+            bibs.append(bib)
+        if drop < self.partial_rate and len(bibs) > 1:
+            bibs = self.random.sample(bibs, self.random.randint(1, len(bibs) - 1))
+        with self._lock:
+            self.records_served += len(bibs)
+        return {"bib": bibs, "total_record_count": len(bibs)}
+
+    def update_bib(self, mms_id, body):
+        """Replaces a record in the corpus with the MARCXML in a PUT bib body."""
+        if mms_id not in self.corpus:
+            return 400, error_body(
+                "402203", f"Input parameters mmsId {mms_id} is not valid."
+            )
+        if not body or "<record" not in body:
+            return 400, error_body("402204", "Bib record is missing.")
+        start = body.index("<record")
+        end = body.rindex("</record>") + len("</record>")
+        xml = body[start:end]
+        collection = "<collection>" + xml + "</collection>"
+        try:
+            records = pymarc.parse_xml_to_array(BytesIO(collection.encode("utf-8")))
+        except Exception as e:
+            return 400, error_body("402204", f"Bib record could not be parsed: {e}")
+        if len(records) != 1 or records[0]["001"].value() != mms_id:
+            return 400, error_body("402204", "Record 001 does not match mms_id.")
+        bib = bib_from_record(records[0])
+        with self._lock:
+            self.corpus[mms_id] = bib
+            self.updated.append(mms_id)
+        return 200, bib
+
+    def handle_set(self, path, query, method, body):
+        """Creates itemized sets, adds members and deletes sets."""
+        set_id = path[len(SETS_PATH) :].strip("/")
+        with self._lock:
+            if method == "POST" and set_id == "":
+                set_id = str(9000000000 + len(self.sets) + 1)
+                self.sets[set_id] = []
+                members = (body or {}).get("members") or {}
+                self.sets[set_id].extend(m["id"] for m in members.get("member", []))
+            elif set_id not in self.sets:
+                return 400, error_body("INVALID_SET", f"Set {set_id} not found")
+            elif method == "POST" and query.get("op", [""])[0] == "add_members":
+                members = (body or {}).get("members") or {}
+                self.sets[set_id].extend(m["id"] for m in members.get("member", []))
+            elif method == "DELETE":
+                del self.sets[set_id]
+                return 204, None
+            return 200, {
+                "id": set_id,
+                "number_of_members": {"value": len(self.sets[set_id])},
+            }
+
+    def handle_job(self, path, query, method, body):
+        """Runs the export job on a set and reports the status of job instances."""
+        parts = path[len(JOBS_PATH) :].strip("/").split("/")
+        job_id = parts[0]
+        if method == "POST" and query.get("op", [""])[0] == "run":
+            parameters = {
+                p["name"]["value"]: p["value"]
+                for p in (body or {}).get("parameter", [])
+            }
+            set_id = parameters.get("set_id")
+            with self._lock:
+                if set_id not in self.sets or self.export_dir is None:
+                    return 400, error_body("INVALID_PARAMETER", "Job could not be run")
+                instance_id = str(7000000000 + len(self.instances) + 1)
+                self.instances[instance_id] = {"set_id": set_id, "polls": 0}
+            link = f"{JOBS_PATH}{job_id}/instances/{instance_id}"
+            return 200, {
+                "id": job_id,
+                "additional_info": {
+                    "value": f"Job no. {instance_id} triggered",
+                    "link": link,
+                },
+            }
+        if method == "GET" and len(parts) == 3 and parts[1] == "instances":
+            with self._lock:
+                instance = self.instances.get(parts[2])
+                if instance is None:
+                    return 400, error_body("INVALID_INSTANCE", "Job instance not found")
+                instance["polls"] += 1
+                done = instance["polls"] > self.job_polls
+                if done and "file" not in instance:
+                    instance["file"] = self.write_export(parts[2], instance["set_id"])
+                    instance["count"] = len(self.sets.get(instance["set_id"], []))
+            if not done:
+                return 200, {
+                    "id": parts[2],
+                    "status": {"value": "RUNNING"},
+                    "progress": 50,
+                }
+            return 200, {
+                "id": parts[2],
+                "status": {"value": "COMPLETED_SUCCESS"},
+                "progress": 100,
+                "counter": [
+                    {
+                        "type": {"value": "label.new.records"},
+                        "value": str(instance["count"]),
+                    }
+                ],
+            }
+        return 400, error_body("INVALID_REQUEST", "Unsupported job request")
+
+    def write_export(self, instance_id, set_id):
+        """Writes the set's records to a binary MARC export file. Call with the lock held."""
+        os.makedirs(self.export_dir, exist_ok=True)
+        export_file = os.path.join(self.export_dir, f"export_{instance_id}.mrc")
+        with open(export_file, "wb") as out:
+            for mms_id in self.sets[set_id]:
+                bib = self.corpus.get(mms_id)
+                if bib is None:
+                    continue
+                xml = bib["anies"][0].replace(
+                    '<?xml version="1.0" encoding="UTF-16"?>', ""
+                )
+                collection = "<collection>" + xml + "</collection>"
+                for record in pymarc.parse_xml_to_array(
+                    BytesIO(collection.encode("utf-8"))
+                ):
+                    out.write(record.as_marc())
+        return export_file
+
+    def stats(self):
+        """Returns a dictionary of request counters."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "status_counts": dict(self.status_counts),
+                "records_served": self.records_served,
+                "remaining": self.remaining,
+            }
+
+
+def error_body(code, message):
+    """Returns an Alma style error body."""
+    return {
+        "errorsExist": True,
+        "errorList": {"error": [{"errorCode": code, "errorMessage": message}]},
+    }
+
+
+def _make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.respond("GET")
+
+        def do_POST(self):
+            self.respond("POST")
+
+        def do_PUT(self):
+            self.respond("PUT")
+
+        def do_DELETE(self):
+            self.respond("DELETE")
+
+        def respond(self, method):
+            url = urlparse(self.path)
+            if not url.path.startswith(API_PATH):
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request_body = None
+            if length > 0:
+                request_body = self.rfile.read(length).decode("utf-8")
+                if "json" in self.headers.get("Content-Type", ""):
+                    request_body = json.loads(request_body)
+            status, headers, body = api.handle(
+                url.path, parse_qs(url.query), method, request_body
+            )
+            data = b"" if body is None else json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug("Fake Alma API: " + format % args)
+
+    return Handler
+
+
+def start_server(api, host="127.0.0.1", port=0):
+    """Serves api on a background thread.
+
+    Args:
+        api: FakeAlmaAPI
+        host: str
+        port: int - 0 to pick a free port.
+
+    Returns:
+        (server, baseurl). Call server.shutdown() to stop.
+    """
+    server = ThreadingHTTPServer((host, port), _make_handler(api))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    baseurl = f"http://{host}:{server.server_address[1]}{BIBS_PATH}"
+    logger.info(f"Fake Alma API serving at {baseurl}")
+    return server, baseurl
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Alma bibs API."
+    )
+    parser.add_argument(
+        "corpus", nargs="+", help="MARC (.mrc) or bibs JSON files/directories"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="median seconds")
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal spread")
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--partial-rate", type=float, default=0.0)
+    parser.add_argument("--quota", type=int, default=DEFAULT_QUOTA)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--export-dir", default=None, help="where export jobs write files"
+    )
+    args = parser.parse_args()
+
+    api = FakeAlmaAPI(
+        load_corpus(args.corpus),
+        latency=lognormal_latency(args.latency, args.sigma),
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        partial_rate=args.partial_rate,
+        quota=args.quota,
+        seed=args.seed,
+        export_dir=args.export_dir,
+    )
+    server, baseurl = start_server(api, args.host, args.port)
+    print(f"Serving {len(api.corpus)} records at {baseurl}")
+    print("Set ALMA_API_BASEURL to this url. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(api.stats())
+
+
+if __name__ == "__main__":
+    main()
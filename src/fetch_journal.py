@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+
+JOURNAL_DIR = os.path.join("output", "journal")
+
+
+def get_journal_path(output_directory, journal_dir=JOURNAL_DIR):
+    """Returns the journal filename for downloads into output_directory."""
+    name = os.path.normpath(output_directory).replace(os.sep, "_").replace(":", "")
+    return os.path.join(journal_dir, f"{name}.jsonl")
+
+
+def get_unfinished_journals(journal_dir=JOURNAL_DIR):
+    """Returns a list of journal files left by downloads that did not finish."""
+    if not os.path.exists(journal_dir):
+        return []
+    return [
+        os.path.join(journal_dir, file)
+        for file in sorted(os.listdir(journal_dir))
+        if file.endswith(".jsonl")
+    ]
+
+
+def write_record_file(output_file, data):
+    """Writes MARC bytes to output_file so the file is either complete or absent.
+
+    Data is written to a temporary file and moved into place.
+    """
+    temp_file = output_file + ".tmp"
+    with open(temp_file, "wb") as mrc_out:
+        mrc_out.write(data)
+        mrc_out.flush()
+        os.fsync(mrc_out.fileno())
+    os.replace(temp_file, output_file)
+
+
+class FetchJournal:
+    """Records which chunks of a download have been written so an interrupted run can resume.
+
+    Each completed chunk is appended to a journal file in output/journal as one JSON line
+    with the identifiers written. The line is flushed to disk before the next chunk is
+    recorded, so an interruption loses at most the chunk in progress. The journal is
+    removed when the download finishes.
+    """
+
+    def __init__(self, output_directory, journal_dir=JOURNAL_DIR):
+        self.output_directory = output_directory
+        self.path = get_journal_path(output_directory, journal_dir)
+        if not os.path.exists(journal_dir):
+            os.makedirs(journal_dir, exist_ok=True)
+
+    def completed_ids(self):
+        """Returns a set of identifiers recorded in the journal whose files all still exist."""
+        completed = {}
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, "r", encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Line cut short by an interruption.
+                    logger.warning(f"Ignoring incomplete journal entry in {self.path}")
+                    continue
+                completed.update(entry["records"])
+        return {
+            identifier
+            for identifier, files in completed.items()
+            if all(os.path.isfile(file) for file in files)
+        }
+
+    def record_chunk(self, key, records):
+        """Appends a completed chunk.
+
+        Args:
+            key (str) | chunk number.
+            records (dict) | {mms_id: list of files written for the record}.
+        """
+        line = json.dumps({"chunk": key, "records": records})
+        with open(self.path, "a", encoding="utf-8") as journal:
+            journal.write(line + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def finish(self):
+        """Removes the journal once every chunk has been written."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
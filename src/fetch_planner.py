@@ -0,0 +1,118 @@
+import logging
+from src.bib_cache import BibCache
+from src.quota_governor import estimate_calls
+from src.record_store import get_directory_ids, read_record_data, write_record
+from src.shared_functions import get_missing_records, MAX_WORKERS
+
+logger = logging.getLogger()
+
+
+def get_ids_on_disk(directory):
+    """Returns a set of MMS Ids with a record_<id>.mrc file, or in the record store, in directory."""
+    return get_directory_ids(directory)
+
+
+def plan_fetch(phases, cache=None):
+    """Plans the smallest set of API requests covering every phase of a job.
+
+    Args:
+        phases: list of tuples (request_ids, output_directory), e.g. many records and
+                parent records for the same job.
+        cache: BibCache or None - cache to take fresh records from.
+
+    Processing:
+        - Records already in a phase's output directory are skipped.
+        - Records on disk in another phase's directory are copied rather than requested.
+        - Fresh cached records are written to every directory that needs them.
+        - Identifiers needed by more than one phase are requested once.
+        The remaining identifiers are packed in order so only the last chunk of 100 is partly full.
+
+    Returns:
+        dictionary with keys:
+            'request_ids': list of identifiers to request from the API.
+            'destinations': {mms_id: list of output directories} for request_ids.
+            'on_disk': number of records already in place or copied between directories.
+            'from_cache': number of records written from the cache.
+            'calls': number of API calls needed for request_ids.
+    """
+    destinations = {}
+    on_disk = {}
+    for request_ids, output_directory in phases:
+        if output_directory not in on_disk:
+            on_disk[output_directory] = get_ids_on_disk(output_directory)
+        for identifier in request_ids:
+            directories = destinations.setdefault(identifier, [])
+            if output_directory not in directories:
+                directories.append(output_directory)
+
+    # Records already written, or that can be copied from another phase's directory.
+    in_place = 0
+    for identifier in list(destinations):
+        directories = destinations[identifier]
+        source = next(
+            (directory for directory in on_disk if identifier in on_disk[directory]),
+            None,
+        )
+        if source is None:
+            continue
+        for directory in directories:
+            if identifier not in on_disk[directory]:
+                write_record(
+                    directory, identifier, read_record_data(source, identifier)
+                )
+                on_disk[directory].add(identifier)
+        in_place += 1
+        del destinations[identifier]
+
+    from_cache = 0
+    if cache is not None and len(destinations) > 0:
+        cached = cache.get_many(destinations)
+        for identifier, data in cached.items():
+            for directory in destinations.pop(identifier):
+                write_record(directory, identifier, data)
+        from_cache = len(cached)
+
+    request_ids = list(destinations)
+    plan = {
+        "request_ids": request_ids,
+        "destinations": destinations,
+        "on_disk": in_place,
+        "from_cache": from_cache,
+        "calls": estimate_calls(len(request_ids)),
+    }
+    print(
+        f"Fetch plan: {len(request_ids)} records to request in {plan['calls']} calls, "
+        f"{in_place} already on disk, {from_cache} from cache."
+    )
+    logger.info(
+        f"Fetch plan: {len(request_ids)} records to request in {plan['calls']} calls, "
+        f"{in_place} already on disk, {from_cache} from cache."
+    )
+    return plan
+
+
+def get_planned_records(phases, max_workers=MAX_WORKERS, use_cache=True):
+    """Plans and retrieves the records for every phase of a job with one set of API requests.
+
+    Args:
+        phases: list of tuples (request_ids, output_directory).
+        max_workers: int - passed to get_missing_records.
+        use_cache: bool - take fresh records from the bib cache and add retrieved records to it.
+
+    Returns:
+        List of identifiers retrieved from the API.
+    """
+    cache = BibCache() if use_cache else None
+    plan = plan_fetch(phases, cache)
+    if len(plan["request_ids"]) == 0:
+        return []
+    # Cached records have already been written, so get_missing_records will only add
+    # the retrieved records to the cache.
+    return get_missing_records(
+        [],
+        plan["request_ids"],
+        phases[0][1],
+        max_workers,
+        use_cache=use_cache,
+        destinations=plan["destinations"],
+    )
@@ -2,6 +2,7 @@ from os import path
 from copy import deepcopy
 import pymarc
 from src.api_call import validate_mmsid
+from src.record_store import iter_file_relationships
 from src.shared_functions import get_callable_files
 from src.xml_load_and_process import *
 
@@ -213,7 +214,10 @@ def get_record_type(record):
 def get_id_dictionary(filepath_list):
     """Iterates through .mrc files and adds ids to dictionary.
     If record has parent Id, uses that as the key, otherwise uses record type from 956$b (ONE|MANY|PARENT)
-    Else uses 'unknown' as key."""
+    Else uses 'unknown' as key.
+    Records are read with marc_index.scan_relationship rather than parsed. The data file of
+    a record store is read through the store, so replaced records are only counted once.
+    """
     id_dict = {}
 
     if filepath_list == None or len(filepath_list) == 0:
@@ -222,28 +226,16 @@ def get_id_dictionary(filepath_list):
 
     for file in filepath_list:
         if file.endswith(".mrc"):
-            with open(file, "rb") as fh:
-                reader = pymarc.MARCReader(fh)
-                for record in reader:
-                    id = record["001"].value()
-                    parent_id = get_parent_id(record)
-                    ## Handle cases where there is no parent id
-                    ## Add them to same record type
-                    if parent_id is not None:
-                        category = parent_id
-                    else:
-                        record_type = get_record_type(record)
-                        if record_type is not None:
-                            category = record_type
-                        else:
-                            category = "unknown"
-                    ## Check if key is already in dictionary
-                    existing_data = id_dict.get(category)
-                    if existing_data is not None:
-                        new_list = existing_data + [id]
-                        id_dict.update({category: new_list})
-                    else:
-                        id_dict.update({category: [id]})
+            for relationship, data in iter_file_relationships(file):
+                ## Handle cases where there is no parent id
+                ## Add them to same record type
+                if relationship.parent_id is not None:
+                    category = relationship.parent_id
+                elif relationship.record_type is not None:
+                    category = relationship.record_type
+                else:
+                    category = "unknown"
+                id_dict.setdefault(category, []).append(relationship.mms_id)
     return id_dict
 
 
@@ -273,38 +265,35 @@ def iterate_get_parents(
             parent_id_list = []
             parent_id_dict = {}
             for file in filepath_list:
-                with open(file, "rb") as fh:
-                    reader = pymarc.MARCReader(fh)
-                    for record in reader:
-                        try:
-                            if record["956"]["b"] == "MANY":
-                                id = record["001"].value()
-                                parent_id = get_parent_id(record)
-                                logger.debug(f"Record id: {id}, parent_id {parent_id}")
-                                if parent_id is not None:
-                                    parent_id_list.append(parent_id)
-                                    parent_id_dict.update({index: [id, parent_id]})
-                                    index += 1
-                                else:  # checks record is not a Parent and if so
-                                    logger.info(
-                                        f"Missing parent id: Many record {id} did not contain Parent id in 950$p"
-                                    )
-                                    records_without_parents = True
-                            else:
-                                logger.info(
-                                    f"Not MANY record: Record {record['001'].value()} is not a MANY record."
-                                )
-                        except KeyError:
-                            logger.info(f"No 956$b: Record {id} did not contain 956$b")
+                # Only 001, 950$p and 956$b are needed, so records are scanned, not parsed.
+                for relationship, data in iter_file_relationships(file):
+                    id = relationship.mms_id
+                    if relationship.record_type == "MANY":
+                        parent_id = relationship.parent_id
+                        logger.debug(f"Record id: {id}, parent_id {parent_id}")
+                        if parent_id is not None:
+                            parent_id_list.append(parent_id)
+                            parent_id_dict.update({index: [id, parent_id]})
+                            index += 1
+                        else:  # checks record is not a Parent and if so
+                            logger.info(
+                                f"Missing parent id: Many record {id} did not contain Parent id in 950$p"
+                            )
                             records_without_parents = True
+                    elif relationship.record_type is None:
+                        logger.info(f"No 956$b: Record {id} did not contain 956$b")
+                        records_without_parents = True
+                    else:
+                        logger.info(
+                            f"Not MANY record: Record {id} is not a MANY record."
+                        )
         except Exception as e:
             logger.error(f"Error reading marc from iterating parent ids: {e}")
     elif filepath_list[0].endswith(".xml"):
         try:
             parent_id_dict = {}
             for file in filepath_list:
-                records = pymarc.parse_xml_to_array(file)
-                for record in records:
+                for record in iter_marcxml_records(file):
                     id = record["001"].value()
                     parent_id = get_parent_id(record)
                     if parent_id is not None:
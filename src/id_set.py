@@ -0,0 +1,163 @@
+import logging
+from itertools import islice
+
+import numpy as np
+
+logger = logging.getLogger()
+
+ID_DTYPE = np.uint64  # MMS Ids have up to 19 digits, beyond the range of int64.
+PARSE_BATCH = 100000
+
+
+def is_canonical_id(identifier):
+    """Returns True if identifier is a string of digits that an MMSIdSet can hold.
+
+    Leading zeros and whitespace are not allowed, so the id converts back to the same string.
+    """
+    return (
+        isinstance(identifier, str)
+        and identifier.isdigit()
+        and identifier.isascii()
+        and (identifier[0] != "0" or identifier == "0")
+        and int(identifier) < 2**64
+    )
+
+
+def parse_ids(identifiers, strict=True):
+    """Converts MMS Id strings to a uint64 array, keeping their order.
+
+    Identifiers are parsed PARSE_BATCH at a time, so a generator is consumed without
+    holding all of its strings. Only canonical ids are accepted (see is_canonical_id).
+    With strict set to False other values are skipped, e.g. for ids to exclude, which
+    cannot match a canonical id anyway.
+
+    Raises:
+        ValueError in strict mode if an identifier is not canonical.
+    """
+    if isinstance(identifiers, MMSIdSet):
+        return identifiers.array
+    iterator = iter(identifiers)
+    if not strict:
+        iterator = filter(is_canonical_id, iterator)
+    arrays = []
+    while True:
+        batch = list(islice(iterator, PARSE_BATCH))
+        if len(batch) == 0:
+            break
+        text = np.array(batch)
+        if text.dtype.kind != "U":
+            raise ValueError(f"MMS Ids must be strings, not {text.dtype}.")
+        try:
+            values = text.astype(ID_DTYPE)
+        except (OverflowError, ValueError) as e:
+            raise ValueError(f"Invalid MMS Id: {e}")
+        invalid = np.flatnonzero(values.astype(text.dtype) != text)
+        if len(invalid) > 0:
+            raise ValueError(f"Invalid MMS Id: {text[invalid[0]]!r}")
+        arrays.append(values)
+    if len(arrays) == 0:
+        return np.empty(0, dtype=ID_DTYPE)
+    return np.concatenate(arrays)
+
+
+def _sorted_unique(array):
+    """Sorts array and drops repeated values. Faster than np.unique for integer ids."""
+    array = np.sort(array)
+    if len(array) == 0:
+        return array
+    keep = np.empty(len(array), dtype=bool)
+    keep[0] = True
+    np.not_equal(array[1:], array[:-1], out=keep[1:])
+    return array[keep]
+
+
+class MMSIdSet:
+    """A set of MMS Ids stored as a sorted array of unsigned 64-bit integers.
+
+    Uses 8 bytes per identifier rather than around 70 for a Python string in a set, and
+    union, difference and membership are vectorised over the whole array. Build it from
+    validated ids, e.g. from api_call.filter_identifiers, and pass it to
+    get_missing_records, which only converts identifiers back to strings for each
+    request. Iterating yields identifiers as strings in ascending order.
+    """
+
+    def __init__(self, identifiers=()):
+        self.array = _sorted_unique(parse_ids(identifiers))
+
+    @classmethod
+    def from_array(cls, array):
+        """Wraps an array that is already sorted and unique without copying it."""
+        id_set = cls()
+        id_set.array = np.asarray(array, dtype=ID_DTYPE)
+        return id_set
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        for start in range(0, len(self.array), PARSE_BATCH):
+            for id in self.array[start : start + PARSE_BATCH].tolist():
+                yield str(id)
+
+    def __contains__(self, identifier):
+        if not is_canonical_id(identifier):
+            return False
+        value = ID_DTYPE(int(identifier))
+        index = np.searchsorted(self.array, value)
+        return bool(index < len(self.array) and self.array[index] == value)
+
+    def __eq__(self, other):
+        return isinstance(other, MMSIdSet) and np.array_equal(self.array, other.array)
+
+    def __repr__(self):
+        return f"MMSIdSet({len(self)} ids)"
+
+    def _other_array(self, other, strict=False):
+        if isinstance(other, MMSIdSet):
+            return other.array
+        return _sorted_unique(parse_ids(other, strict))
+
+    def union(self, other):
+        """Raises ValueError if other holds an id that is not canonical."""
+        return MMSIdSet.from_array(
+            _sorted_unique(
+                np.concatenate((self.array, self._other_array(other, strict=True)))
+            )
+        )
+
+    # Ids in other that are not canonical cannot be in the set, so they are ignored.
+    def difference(self, other):
+        return MMSIdSet.from_array(
+            np.setdiff1d(self.array, self._other_array(other), assume_unique=True)
+        )
+
+    def intersection(self, other):
+        return MMSIdSet.from_array(
+            np.intersect1d(self.array, self._other_array(other), assume_unique=True)
+        )
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+
+    def to_list(self):
+        """Returns the identifiers as a list of strings."""
+        return list(self)
+
+    def joined_chunks(self, size=100):
+        """Yields comma separated strings of up to size identifiers, as get_bibs expects."""
+        for start in range(0, len(self.array), size):
+            yield ",".join(str(id) for id in self.array[start : start + size].tolist())
+
+
+def without(identifiers, excluded):
+    """Returns the identifiers that are not in excluded.
+
+    Returns an MMSIdSet if identifiers is one, otherwise a list in the same order as
+    identifiers, so callers can accept either.
+    """
+    if isinstance(identifiers, MMSIdSet):
+        return identifiers.difference(excluded)
+    if not isinstance(excluded, (set, frozenset, dict, MMSIdSet)):
+        excluded = set(excluded)
+    return [identifier for identifier in identifiers if identifier not in excluded]
@@ -0,0 +1,427 @@
+import logging
+import mmap
+import os
+from copy import deepcopy
+from typing import NamedTuple, Optional
+
+import pymarc
+from pymarc.exceptions import (
+    BaseAddressInvalid,
+    BaseAddressNotFound,
+    NoFieldsFound,
+    RecordDirectoryInvalid,
+    RecordLeaderInvalid,
+    TruncatedRecord,
+)
+from pymarc.record import normalize_subfield_code
+
+logger = logging.getLogger()
+
+LEADER_LENGTH = 24
+DIRECTORY_ENTRY_LENGTH = 12
+FIELD_TERMINATOR = 0x1E
+RECORD_TERMINATOR = b"\x1d"
+SUBFIELD_DELIMITER = b"\x1f"
+FIELD_TERMINATOR_BYTE = b"\x1e"
+
+
+class Relationship(NamedTuple):
+    """The values used to group records, read by scan_relationship."""
+
+    mms_id: Optional[str]  # 001
+    parent_id: Optional[str]  # first 950$p, as get_parent_id
+    record_type: Optional[str]  # first 956$b, as get_record_type
+    is_parent: bool  # any 956$b is PARENT, as is_parent
+
+
+def find_control_number(data, offset=0):
+    """Returns the 001 of the ISO 2709 record starting at offset in data, or None.
+
+    Reads the leader's base address and the directory only. The 001 is normally the
+    first directory entry, so usually a single entry is checked.
+    """
+    base = int(data[offset + 12 : offset + 17])
+    position = offset + LEADER_LENGTH
+    end = offset + base - 1
+    while position + DIRECTORY_ENTRY_LENGTH <= end:
+        if data[position : position + 3] == b"001":
+            length = int(data[position + 3 : position + 7])
+            start = offset + base + int(data[position + 7 : position + 12])
+            value = data[start : start + length]
+            if len(value) > 0 and value[-1] == FIELD_TERMINATOR:
+                value = value[:-1]
+            return bytes(value).decode("utf-8").strip()
+        position += DIRECTORY_ENTRY_LENGTH
+    return None
+
+
+def get_subfield(field, code):
+    """Returns the first value of subfield code in the bytes of a data field, or None."""
+    for part in field.split(SUBFIELD_DELIMITER)[1:]:
+        if part[:1] == code:
+            return part[1:].decode("utf-8", "replace")
+    return None
+
+
+def scan_relationship(data, offset=0):
+    """Returns the Relationship of the ISO 2709 record starting at offset in data.
+
+    Only the leader, directory and the 001, 950 and 956 fields are read, which is much
+    faster than parsing the record with pymarc to read the same three values.
+    """
+    base = int(data[offset + 12 : offset + 17])
+    position = offset + LEADER_LENGTH
+    end = offset + base - 1
+    mms_id = parent_id = record_type = None
+    seen_950 = seen_956 = parent = False
+    while position + DIRECTORY_ENTRY_LENGTH <= end:
+        tag = data[position : position + 3]
+        if tag == b"001" or tag == b"950" or tag == b"956":
+            length = int(data[position + 3 : position + 7])
+            start = offset + base + int(data[position + 7 : position + 12])
+            field = bytes(data[start : start + length])
+            if len(field) > 0 and field[-1] == FIELD_TERMINATOR:
+                field = field[:-1]
+            if tag == b"001":
+                if mms_id is None:
+                    mms_id = field.decode("utf-8").strip()
+            elif tag == b"950":
+                if not seen_950:
+                    seen_950 = True
+                    parent_id = get_subfield(field, b"p")
+            else:
+                value = get_subfield(field, b"b")
+                if not seen_956:
+                    seen_956 = True
+                    record_type = value
+                if value == "PARENT":
+                    parent = True
+        position += DIRECTORY_ENTRY_LENGTH
+    return Relationship(mms_id, parent_id, record_type, parent)
+
+
+def iter_record_spans(data, source="", on_skip=None):
+    """Yields (offset, length) of each record in ISO 2709 data, from the leader lengths.
+
+    A record whose leader cannot be read is logged and skipped by searching for the next
+    end of record mark, and on_skip is called with its offset.
+    """
+    size = len(data)
+    offset = 0
+    while offset < size:
+        try:
+            length = int(data[offset : offset + 5])
+            if length < LEADER_LENGTH or offset + length > size:
+                raise ValueError(f"record length {length}")
+        except ValueError as e:
+            end = data.find(RECORD_TERMINATOR, offset)
+            logger.warning(
+                f"Skipping unreadable record at byte {offset} of {source}: {e}"
+            )
+            if on_skip is not None:
+                on_skip(offset)
+            offset = size if end == -1 else end + 1
+            continue
+        yield offset, length
+        offset += length
+
+
+def iter_relationships(filename):
+    """Yields (Relationship, MARC bytes) for each record in a binary MARC file.
+
+    The file is memory mapped and read with scan_relationship, without parsing records.
+    Records whose leader or directory cannot be read are logged and skipped.
+    """
+    with open(filename, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset, length in iter_record_spans(data, filename):
+                try:
+                    relationship = scan_relationship(data, offset)
+                except ValueError as e:
+                    logger.warning(
+                        f"Skipping unreadable record at byte {offset} of {filename}: {e}"
+                    )
+                    continue
+                yield relationship, data[offset : offset + length]
+
+
+class RawEntry(NamedTuple):
+    """A field of a LazyRecord that has not been decoded: its tag and its bytes in data."""
+
+    tag: str
+    start: int
+    end: int  # excludes the field terminator
+
+
+def decode_field(tag, data):
+    """Returns a pymarc Field from the UTF-8 bytes of one field, as pymarc.Record does."""
+    if tag < "010" and tag.isdigit():
+        return pymarc.Field(tag=tag, data=data.decode("utf-8"))
+    subs = data.split(SUBFIELD_DELIMITER)
+    indicators = subs[0].decode("ascii")
+    if len(indicators) != 2:
+        logger.warning(f"{len(indicators)} indicators found in {tag}: {data}")
+    indicators = (indicators + "  ")[:2]
+    subfields = []
+    for subfield in subs[1:]:
+        if len(subfield) == 0:
+            continue
+        skip_bytes = 1
+        try:
+            code = subfield[0:1].decode("ascii")
+        except UnicodeDecodeError:
+            code, skip_bytes = normalize_subfield_code(subfield)
+        subfields.append(
+            pymarc.Subfield(code=code, value=subfield[skip_bytes:].decode("utf-8"))
+        )
+    return pymarc.Field(tag=tag, indicators=list(indicators), subfields=subfields)
+
+
+class LazyRecord(pymarc.Record):
+    """A pymarc Record that decodes its fields only when they are asked for.
+
+    The leader and directory are read when the record is created, but each field is
+    kept as a RawEntry until get_fields, record[tag], record.get or record.fields needs
+    it, when only the fields with the requested tags are decoded into pymarc Fields.
+    remove_fields and add_ordered_field work on tags without decoding anything.
+
+    as_marc writes fields that were never decoded straight from the original bytes and
+    encodes only the decoded or added ones, so a record passed through cleanup functions
+    that touch a few tags is not decoded and re-encoded in full. Fields returned to the
+    caller may have been changed, so they are always re-encoded.
+
+    Records that are not UTF-8 (leader position 9 is not "a") are decoded in full, as
+    pymarc.Record would.
+
+    Args:
+        data: bytes - one ISO 2709 record.
+    """
+
+    __slots__ = ("_entries", "_data")
+
+    def __init__(self, data=b""):
+        self._data = b""
+        super().__init__()
+        if len(data) > 0:
+            self._read_directory(bytes(data))
+
+    def _read_directory(self, marc):
+        self.leader = marc[0:LEADER_LENGTH].decode("ascii")
+        if len(self.leader) != LEADER_LENGTH:
+            raise RecordLeaderInvalid
+        if self.leader[9] != "a":
+            self.decode_marc(marc)
+            return
+        base = int(marc[12:17])
+        if base <= 0:
+            raise BaseAddressNotFound
+        if base >= len(marc):
+            raise BaseAddressInvalid
+        if len(marc) < int(self.leader[:5]):
+            raise TruncatedRecord
+        directory = marc[LEADER_LENGTH : base - 1].decode("ascii")
+        if len(directory) % DIRECTORY_ENTRY_LENGTH != 0:
+            raise RecordDirectoryInvalid
+        if len(directory) == 0:
+            raise NoFieldsFound
+        self._data = marc
+        for position in range(0, len(directory), DIRECTORY_ENTRY_LENGTH):
+            entry = directory[position : position + DIRECTORY_ENTRY_LENGTH]
+            start = base + int(entry[7:12])
+            end = start + int(entry[3:7]) - 1
+            self._entries.append(RawEntry(entry[0:3], start, end))
+
+    def _decode(self, index):
+        entry = self._entries[index]
+        if isinstance(entry, RawEntry):
+            entry = decode_field(entry.tag, self._data[entry.start : entry.end])
+            self._entries[index] = entry
+        return entry
+
+    @property
+    def fields(self):
+        """Every field of the record, decoding any that have not been decoded yet."""
+        for index in range(len(self._entries)):
+            self._decode(index)
+        return self._entries
+
+    @fields.setter
+    def fields(self, fields):
+        self._entries = fields
+
+    def decoded_count(self):
+        """Returns how many fields have been decoded or added."""
+        return sum(1 for entry in self._entries if not isinstance(entry, RawEntry))
+
+    def get_fields(self, *args):
+        if len(args) == 0:
+            return self.fields
+        return [
+            self._decode(index)
+            for index, entry in enumerate(self._entries)
+            if entry.tag in args
+        ]
+
+    def __contains__(self, tag):
+        return any(entry.tag == tag for entry in self._entries)
+
+    def add_field(self, *fields):
+        self._entries.extend(fields)
+
+    def add_grouped_field(self, *fields):
+        for field in fields:
+            self._insert_sorted(field, lambda tag: int(tag[0]))
+
+    def add_ordered_field(self, *fields):
+        for field in fields:
+            self._insert_sorted(field, int)
+
+    def _insert_sorted(self, field, key):
+        # Matches pymarc's _sort_fields, comparing the tags of undecoded entries.
+        if len(self._entries) == 0 or not field.tag.isdigit():
+            self._entries.append(field)
+            return
+        tag = key(field.tag)
+        for index, entry in enumerate(self._entries):
+            if not entry.tag.isdigit() or key(entry.tag) > tag:
+                self._entries.insert(index, field)
+                return
+        self._entries.append(field)
+
+    def remove_fields(self, *tags):
+        self._entries[:] = [entry for entry in self._entries if entry.tag not in tags]
+
+    def __deepcopy__(self, memo):
+        # Undecoded entries and the record bytes are immutable, so only fields are copied.
+        record = LazyRecord()
+        memo[id(self)] = record
+        record.leader = deepcopy(self.leader, memo)
+        record._data = self._data
+        record._entries = [
+            entry if isinstance(entry, RawEntry) else deepcopy(entry, memo)
+            for entry in self._entries
+        ]
+        return record
+
+    def as_marc(self):
+        """Returns the record as MARC21, copying undecoded fields from the original bytes."""
+        if isinstance(self.leader, pymarc.Leader):
+            self.leader.coding_scheme = "a"
+        else:
+            self.leader = self.leader[0:9] + "a" + self.leader[10:]
+        fields = []
+        directory = []
+        offset = 0
+        for entry in self._entries:
+            if isinstance(entry, RawEntry):
+                field_data = self._data[entry.start : entry.end] + FIELD_TERMINATOR_BYTE
+            else:
+                field_data = entry.as_marc(encoding="utf-8")
+            fields.append(field_data)
+            tag = "%03d" % int(entry.tag) if entry.tag.isdigit() else "%03s" % entry.tag
+            directory.append(
+                b"%s%04d%05d" % (tag.encode("utf-8"), len(field_data), offset)
+            )
+            offset += len(field_data)
+        directory = b"".join(directory) + FIELD_TERMINATOR_BYTE
+        fields = b"".join(fields) + RECORD_TERMINATOR
+        base = LEADER_LENGTH + len(directory)
+        leader = (
+            f"{base + len(fields):0>5}{self.leader[5:12]}{base:0>5}{self.leader[17:]}"
+        )
+        return leader.encode("utf-8") + directory + fields
+
+    as_marc21 = as_marc
+
+
+class MappedMARCFile:
+    """Random access by MMS Id to the records in a binary MARC file.
+
+    The file is memory mapped and indexed in one pass that jumps from record to record
+    using the record length in each leader, reading only the leader and directory to find
+    the 001. Records are only copied out of the file, and parsed, when requested.
+
+    A record whose leader cannot be read is skipped by searching for the next end of record
+    mark. If an MMS Id appears more than once the last record is returned.
+
+    Args:
+        filename: path - binary MARC (ISO 2709) file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = {}
+        self.skipped = 0
+        self._file = open(filename, "rb")
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._map = b""
+        else:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._build_index()
+
+    def _build_index(self):
+        def skip(offset):
+            self.skipped += 1
+
+        for offset, length in iter_record_spans(self._map, self.filename, skip):
+            try:
+                id = find_control_number(self._map, offset)
+            except ValueError as e:
+                logger.warning(
+                    f"Skipping unreadable record at byte {offset} of {self.filename}: {e}"
+                )
+                id = None
+            if id is None:
+                self.skipped += 1
+            else:
+                self.index[id] = (offset, length)
+        logger.info(
+            f"Indexed {len(self.index)} records in {self.filename}, skipped {self.skipped}."
+        )
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def ids(self):
+        """Returns the MMS Ids in the file, in the order first found."""
+        return list(self.index)
+
+    def get(self, id):
+        """Returns the MARC bytes of the record with 001 id, or None."""
+        location = self.index.get(id)
+        if location is None:
+            return None
+        offset, length = location
+        return self._map[offset : offset + length]
+
+    def get_record(self, id, lazy=False):
+        """Returns the record with 001 id as a pymarc Record, or LazyRecord, or None."""
+        data = self.get(id)
+        if data is None:
+            return None
+        return LazyRecord(data) if lazy else pymarc.Record(data)
+
+    def iter_records(self, ids=None):
+        """Yields pymarc Records for ids, or every record, in file order."""
+        if ids is None:
+            locations = sorted(self.index.values())
+        else:
+            locations = sorted(self.index[id] for id in ids if id in self.index)
+        for offset, length in locations:
+            yield pymarc.Record(self._map[offset : offset + length])
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
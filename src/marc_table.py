@@ -0,0 +1,189 @@
+import logging
+import os
+
+import numpy as np
+
+from src.marc_index import DIRECTORY_ENTRY_LENGTH, FIELD_TERMINATOR, LEADER_LENGTH
+
+logger = logging.getLogger()
+
+RECORD_TERMINATOR_BYTE = 0x1D
+# Leader, one directory entry, the directory terminator and the record terminator.
+MINIMUM_RECORD_LENGTH = LEADER_LENGTH + DIRECTORY_ENTRY_LENGTH + 2
+NON_NUMERIC_TAG = -1
+
+
+def _read_numbers(data, positions, width):
+    """Reads the ASCII numbers of width digits at each of positions in data.
+
+    Returns (values, ok), where ok is False for numbers containing a non digit.
+    """
+    values = np.zeros(len(positions), dtype=np.int64)
+    ok = np.ones(len(positions), dtype=bool)
+    for place in range(width):
+        digits = data[positions + place].astype(np.int64) - 48
+        ok &= (digits >= 0) & (digits <= 9)
+        values = values * 10 + digits
+    return values, ok
+
+
+class MARCTable:
+    """Columnar arrays describing every record and field in a binary MARC file.
+
+    Built by scan_marc_file or scan_marc_data. Records have one row in the record arrays
+    and each field (directory entry) of a valid record one row in the field arrays, so
+    questions about a whole file are answered with array operations, for example:
+
+        table.ids_where(table.tag_counts("260", "264") >= 2)
+        table.ids_where(table.tag_counts("245") == 0)
+
+    Record arrays:
+        record_offsets: byte offset of each record in the file.
+        record_lengths: length of each record in bytes.
+        valid: False for records whose leader or directory cannot be read. They have
+            no fields and no id.
+        record_field_starts: index of the first field of each record in the field arrays.
+        record_field_counts: number of fields in each record.
+        ids: list - the first 001 of each record, or None.
+
+    Field arrays, in file order:
+        field_records: index of the record the field belongs to.
+        field_tags: the tag as an integer, or -1 for tags that are not numeric.
+        field_offsets: byte offset of the field data in the file.
+        field_lengths: length of the field data, including its field terminator.
+    """
+
+    def __init__(self, data, source, record_offsets, record_lengths, valid, bases):
+        self.source = source
+        self._data = data
+        self.record_offsets = record_offsets
+        self.record_lengths = record_lengths
+        self.valid = valid
+        self._read_directories(bases)
+        self.ids = self._read_ids()
+
+    def _read_directories(self, bases):
+        data = self._data
+        counts = np.where(
+            self.valid, (bases - LEADER_LENGTH - 1) // DIRECTORY_ENTRY_LENGTH, 0
+        )
+        records = np.repeat(np.arange(len(counts)), counts)
+        starts = np.cumsum(counts) - counts
+        entries = self.record_offsets[records] + LEADER_LENGTH
+        entries += (np.arange(len(records)) - starts[records]) * DIRECTORY_ENTRY_LENGTH
+        tags, numeric = _read_numbers(data, entries, 3)
+        lengths, lengths_ok = _read_numbers(data, entries + 3, 4)
+        offsets, offsets_ok = _read_numbers(data, entries + 7, 5)
+        # Field data must end before the record terminator.
+        ok = lengths_ok & offsets_ok & (lengths > 0)
+        ok &= bases[records] + offsets + lengths < self.record_lengths[records]
+        bad = np.unique(records[~ok])
+        if len(bad) > 0:
+            logger.warning(
+                f"{len(bad)} records in {self.source} have an unreadable directory entry."
+            )
+            self.valid[bad] = False
+            counts[bad] = 0
+            keep = self.valid[records]
+            records, tags, numeric = records[keep], tags[keep], numeric[keep]
+            lengths, offsets = lengths[keep], offsets[keep]
+        tags[~numeric] = NON_NUMERIC_TAG
+        self.field_records = records
+        self.field_tags = tags.astype(np.int16)
+        self.field_offsets = self.record_offsets[records] + bases[records] + offsets
+        self.field_lengths = lengths
+        self.record_field_starts = np.cumsum(counts) - counts
+        self.record_field_counts = counts
+
+    def _read_ids(self):
+        ids = [None] * len(self)
+        first = np.unique(self.field_records[self.field_tags == 1], return_index=True)
+        fields = np.flatnonzero(self.field_tags == 1)[first[1]]
+        for record, field in zip(first[0].tolist(), fields.tolist()):
+            ids[record] = self.field_data(field).decode("utf-8", "replace").strip()
+        return ids
+
+    def __len__(self):
+        return len(self.record_offsets)
+
+    @property
+    def field_count(self):
+        return len(self.field_tags)
+
+    def tag_counts(self, *tags):
+        """Returns an array of how many fields each record has with any of tags.
+
+        Tags must be numeric, e.g. "245".
+        """
+        codes = [int(tag) for tag in tags]
+        matches = self.field_records[np.isin(self.field_tags, codes)]
+        return np.bincount(matches, minlength=len(self))
+
+    def ids_where(self, mask):
+        """Returns the ids of the valid records where the boolean record array mask is True."""
+        return [self.ids[record] for record in np.flatnonzero(mask & self.valid)]
+
+    def record_fields(self, record):
+        """Returns the range of indexes in the field arrays of the fields of record."""
+        start = self.record_field_starts[record]
+        return range(start, start + self.record_field_counts[record])
+
+    def field_data(self, field):
+        """Returns the bytes of the field at index field, without its field terminator."""
+        offset = self.field_offsets[field]
+        return bytes(self._data[offset : offset + self.field_lengths[field] - 1])
+
+    def get(self, record):
+        """Returns the MARC bytes of the record at index record."""
+        offset = self.record_offsets[record]
+        return bytes(self._data[offset : offset + self.record_lengths[record]])
+
+
+def scan_marc_data(data, source=""):
+    """Returns a MARCTable for ISO 2709 data (bytes or a uint8 array).
+
+    Records are separated at each end of record mark rather than by following the
+    leader lengths from record to record, so all records are located in one vectorised
+    pass. A record is valid if its leader length matches that span, its base address
+    and directory can be read and its fields lie inside it.
+    """
+    if not isinstance(data, np.ndarray):
+        data = np.frombuffer(data, dtype=np.uint8)
+    size = len(data)
+    ends = np.flatnonzero(data == RECORD_TERMINATOR_BYTE) + 1
+    starts = np.concatenate(([0], ends)).astype(np.int64)
+    stops = np.concatenate((ends, [size])).astype(np.int64)
+    present = stops > starts
+    offsets, lengths = starts[present], stops[present] - starts[present]
+
+    valid = lengths >= MINIMUM_RECORD_LENGTH
+    # A span after the last end of record mark is an incomplete record.
+    if size > 0 and data[size - 1] != RECORD_TERMINATOR_BYTE:
+        valid[-1] = False
+    candidates = np.flatnonzero(valid)
+    leader_lengths, length_ok = _read_numbers(data, offsets[candidates], 5)
+    base, base_ok = _read_numbers(data, offsets[candidates] + 12, 5)
+    ok = length_ok & base_ok & (leader_lengths == lengths[candidates])
+    ok &= (base > LEADER_LENGTH + DIRECTORY_ENTRY_LENGTH) & (base < lengths[candidates])
+    ok &= (base - LEADER_LENGTH - 1) % DIRECTORY_ENTRY_LENGTH == 0
+    checked = np.flatnonzero(ok)
+    directory_ends = offsets[candidates[checked]] + base[checked] - 1
+    ok[checked] = data[directory_ends] == FIELD_TERMINATOR
+    valid[candidates[~ok]] = False
+    bases = np.zeros(len(offsets), dtype=np.int64)
+    bases[candidates[ok]] = base[ok]
+
+    table = MARCTable(data, source, offsets, lengths, valid, bases)
+    skipped = len(table) - np.count_nonzero(table.valid)
+    logger.info(
+        f"Scanned {len(table)} records and {table.field_count} fields in {source}, "
+        f"{skipped} unreadable."
+    )
+    return table
+
+
+def scan_marc_file(filename):
+    """Returns a MARCTable for a binary MARC file, read through a memory map."""
+    if os.path.getsize(filename) == 0:
+        return scan_marc_data(b"", filename)
+    return scan_marc_data(np.memmap(filename, dtype=np.uint8, mode="r"), filename)
@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from src.api_call import (
+    get_bibs,
+    get_governor,
+    validate_mmsid,
+    IDS_PER_CALL,
+    QuotaExceeded,
+)
+from src.extract_xml import iter_records_from_bibs, iter_response_text
+from src.get_parent_ids import get_parent_id
+from src.id_set import MMSIdSet
+from src.record_store import has_record, write_record
+
+logger = logging.getLogger()
+
+PREFETCH_WORKERS = 2
+
+
+class ParentPrefetcher:
+    """Requests parent records while many records are still being downloaded.
+
+    Pass on_records to get_missing_records for the many records. Each chunk of many
+    records is scanned for 950$p as it arrives, and every parent id not seen before is
+    queued. Full batches of 100 are requested straight away on background threads, and
+    finish() requests the remainder, so the parent phase overlaps the many phase.
+
+    Each request reserves its call with the quota governor. Ids of failed requests are
+    logged and kept in failed. They are not written, so a following get_planned_records
+    for the parents requests them again.
+    """
+
+    def __init__(
+        self,
+        output_directory,
+        skip=(),
+        cache=None,
+        batch_size=IDS_PER_CALL,
+        max_workers=PREFETCH_WORKERS,
+    ):
+        self.output_directory = output_directory
+        self.skip = skip if isinstance(skip, MMSIdSet) else set(skip)
+        self.cache = cache
+        self.batch_size = batch_size
+        self.seen = set()
+        self.pending = []
+        self.failed = []
+        self.futures = []
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+
+    def add(self, parent_ids):
+        """Queues parent ids not already seen, requested or on disk."""
+        with self._lock:
+            for parent_id in parent_ids:
+                if parent_id in self.seen or parent_id in self.skip:
+                    continue
+                self.seen.add(parent_id)
+                if has_record(self.output_directory, parent_id):
+                    continue
+                self.pending.append(parent_id)
+                if len(self.pending) >= self.batch_size:
+                    self._submit()
+
+    def on_records(self, records):
+        """Queues the parents of a chunk of many records. Passed to get_missing_records."""
+        parent_ids = []
+        for record in records:
+            try:
+                parent_id = get_parent_id(record)
+            except (KeyError, TypeError):
+                parent_id = None
+            if parent_id is not None and validate_mmsid(parent_id):
+                parent_ids.append(parent_id)
+        self.add(parent_ids)
+
+    def _submit(self):
+        """Sends the pending ids as one request. Call with the lock held."""
+        part = f"parent_{len(self.futures)}"
+        batch = self.pending
+        self.pending = []
+        logger.info(f"Prefetching {len(batch)} parent records in request {part}.")
+        future = self.executor.submit(self._fetch, part, batch)
+        self.futures.append((part, batch, future))
+
+    def _fetch(self, part, parent_ids):
+        """Requests one batch of parents and writes them. Returns the ids written.
+
+        The response is streamed, and each record written as soon as it has been read.
+        """
+        governor = get_governor()
+        reservation = governor.reserve(1)
+        if reservation is None:
+            self._log_failed(part, parent_ids, "too few API calls remaining")
+            return []
+        records = {}
+        dates = {}
+        try:
+            response = get_bibs(part, ",".join(parent_ids), stream=True)
+            if response is None or response.status_code != 200:
+                status = None if response is None else response.status_code
+                if response is not None:
+                    response.close()
+                raise ValueError(f"status {status}")
+            try:
+                for record in iter_records_from_bibs(
+                    iter_response_text(response), dates
+                ):
+                    id = record.get_fields("001")[0].value()
+                    records[id] = record.as_marc()
+                    write_record(self.output_directory, id, records[id], atomic=True)
+            finally:
+                response.close()
+        except (ValueError, QuotaExceeded, requests.RequestException) as e:
+            missing = [id for id in parent_ids if id not in records]
+            self._log_failed(part, missing, e)
+        finally:
+            governor.release(reservation)
+        if self.cache is not None:
+            self.cache.put_many(records, dates)
+        return list(records)
+
+    def _log_failed(self, part, parent_ids, error):
+        with self._lock:
+            self.failed.extend(parent_ids)
+        print(f"WARNING: Parent prefetch request {part} failed with {error}.")
+        logger.error(
+            f"Parent prefetch request {part} failed with {error}. "
+            f"Records not retrieved: {parent_ids}"
+        )
+
+    def finish(self):
+        """Requests any remaining parents and waits for every request.
+
+        Returns:
+            List of parent ids written. Ids that could not be retrieved are in failed.
+        """
+        with self._lock:
+            if len(self.pending) > 0:
+                self._submit()
+        written = []
+        for part, batch, future in self.futures:
+            try:
+                written.extend(future.result())
+            except Exception as e:
+                self._log_failed(part, batch, e)
+        self.executor.shutdown()
+        print(f"Prefetched {len(written)} parent records during download.")
+        logger.info(f"Prefetched {len(written)} parent records during download.")
+        if len(self.failed) > 0:
+            logger.warning(f"{len(self.failed)} parent records were not prefetched.")
+        return written
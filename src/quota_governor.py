@@ -0,0 +1,255 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+logger = logging.getLogger()
+
+# Quota settings, can be overridden in .env
+QUOTA_PATH = os.getenv("API_QUOTA_PATH", os.path.join("cache", "api_quota.sqlite"))
+QUOTA_FLOOR = int(os.getenv("API_QUOTA_FLOOR", 10000))
+RATE_LIMIT = float(
+    os.getenv("API_RATE_LIMIT", 20)
+)  # requests per second, all processes
+RESERVATION_TTL = 24 * 60 * 60
+SQLITE_TIMEOUT = 60
+IDS_PER_CALL = 100
+
+
+class QuotaExceeded(Exception):
+    """Raised when a request would take remaining API calls below the quota floor."""
+
+
+def estimate_calls(id_count, passes=1):
+    """Returns the number of API calls needed to retrieve id_count records.
+
+    One call per 100 identifiers for each pass, e.g. passes=2 for the brief then full
+    requests of an incremental download.
+    """
+    return math.ceil(id_count / IDS_PER_CALL) * passes
+
+
+class QuotaGovernor:
+    """Shares the remaining daily API quota and request rate between processes.
+
+    State is kept in a SQLite database so every script running on the machine sees the
+    same numbers:
+        - the last X-Exl-Api-Remaining value reported by Alma, reduced by each call made since.
+        - calls reserved by each running job for the rest of its work, keyed by the token
+          reserve returns, so jobs running at once in one process release only their own.
+        - the next time slot a request may be sent, spacing requests to rate_limit per second.
+    """
+
+    def __init__(self, path=QUOTA_PATH, floor=QUOTA_FLOOR, rate_limit=RATE_LIMIT):
+        self.path = path
+        self.floor = floor
+        self.rate_limit = rate_limit
+        self.pid = os.getpid()
+        self._conn = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quota ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                "remaining INTEGER, "
+                "day TEXT, "
+                "next_slot REAL NOT NULL)"
+            )
+            # Reservations were keyed by process before jobs had tokens. They only last
+            # for a job, so an old table is replaced.
+            columns = [
+                row[1] for row in conn.execute("PRAGMA table_info(reservations)")
+            ]
+            if len(columns) > 0 and "token" not in columns:
+                conn.execute("DROP TABLE reservations")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS reservations ("
+                "token TEXT PRIMARY KEY, "
+                "pid INTEGER NOT NULL, "
+                "calls INTEGER NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO quota (id, remaining, day, next_slot) VALUES (1, NULL, NULL, 0)"
+            )
+
+    def _connect(self):
+        """Opens a connection in autocommit mode so transactions can be started explicitly."""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=SQLITE_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _connection(self):
+        """Returns the connection shared by all threads using the governor. Call with the
+        lock held. A new connection is opened in a process forked after it was created.
+        """
+        if self._conn is None or self._conn_pid != os.getpid():
+            if self._conn_pid is not None:
+                self.pid = os.getpid()
+            self._conn = self._connect()
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+            self._conn_pid = None
+
+    def _state(self, conn):
+        """Returns (remaining, calls reserved by other processes, calls reserved by this process).
+
+        Remaining is None if Alma has not reported a value today (UTC)."""
+        conn.execute(
+            "DELETE FROM reservations WHERE created_at < ?",
+            (time.time() - RESERVATION_TTL,),
+        )
+        remaining, day = conn.execute(
+            "SELECT remaining, day FROM quota WHERE id = 1"
+        ).fetchone()
+        if day != _today():
+            remaining = None
+        others, mine = conn.execute(
+            "SELECT COALESCE(SUM(CASE WHEN pid != ? THEN calls END), 0), "
+            "COALESCE(SUM(CASE WHEN pid = ? THEN calls END), 0) FROM reservations",
+            (self.pid, self.pid),
+        ).fetchone()
+        return remaining, others, mine
+
+    def record_remaining(self, remaining):
+        """Stores the remaining calls reported by Alma in the X-Exl-Api-Remaining header."""
+        with self._lock:
+            self._connection().execute(
+                "UPDATE quota SET remaining = ?, day = ? WHERE id = 1",
+                (int(remaining), _today()),
+            )
+
+    def record_response(self, response):
+        """Stores the remaining calls from a response if it has the quota header."""
+        remaining = response.headers.get("X-Exl-Api-Remaining")
+        if remaining is not None:
+            self.record_remaining(remaining)
+
+    def available(self):
+        """Returns calls available above the floor after other processes' reservations,
+        or None if the remaining quota is not known."""
+        with self._lock:
+            remaining, others, mine = self._state(self._connection())
+        if remaining is None:
+            return None
+        return remaining - others - self.floor
+
+    def reserve(self, calls):
+        """Admits a job needing calls API requests.
+
+        Reserves the calls if the quota can cover them without going below the floor,
+        taking every other job's reservation into account. Jobs are always admitted if
+        the quota is not yet known.
+
+        Returns:
+            A token to pass to release when the job ends, or None if the job is refused.
+        """
+        token = uuid.uuid4().hex
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                remaining, others, mine = self._state(conn)
+                if (
+                    remaining is not None
+                    and remaining - others - mine - calls < self.floor
+                ):
+                    conn.execute("COMMIT")
+                    logger.warning(
+                        f"Quota governor refused job of {calls} calls. Remaining: {remaining}, "
+                        f"reserved by other jobs: {others + mine}, floor: {self.floor}."
+                    )
+                    return None
+                conn.execute(
+                    "INSERT INTO reservations (token, pid, calls, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (token, self.pid, calls, time.time()),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        logger.info(f"Quota governor reserved {calls} calls. Remaining: {remaining}.")
+        return token
+
+    def release(self, token):
+        """Removes any calls still reserved by the job holding token. None is ignored."""
+        if token is None:
+            return
+        with self._lock:
+            self._connection().execute(
+                "DELETE FROM reservations WHERE token = ?", (token,)
+            )
+
+    def acquire(self):
+        """Claims one API call. Call immediately before sending each request.
+
+        Uses a call reserved by one of this process's jobs if there are any. Unreserved
+        calls are only allowed if they leave other processes' reservations and the floor
+        intact, otherwise QuotaExceeded is raised. Sleeps as needed to keep all processes
+        under rate_limit.
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                remaining, others, mine = self._state(conn)
+                if (
+                    mine <= 0
+                    and remaining is not None
+                    and remaining - others - 1 < self.floor
+                ):
+                    raise QuotaExceeded(
+                        f"Remaining API calls ({remaining}) would go below floor of {self.floor}."
+                    )
+                if remaining is not None:
+                    conn.execute(
+                        "UPDATE quota SET remaining = remaining - 1 WHERE id = 1"
+                    )
+                if mine > 0:
+                    conn.execute(
+                        "UPDATE reservations SET calls = calls - 1 WHERE token = "
+                        "(SELECT token FROM reservations WHERE pid = ? AND calls > 0 "
+                        "ORDER BY created_at LIMIT 1)",
+                        (self.pid,),
+                    )
+                now = time.time()
+                next_slot = conn.execute(
+                    "SELECT next_slot FROM quota WHERE id = 1"
+                ).fetchone()[0]
+                slot = max(now, next_slot)
+                conn.execute(
+                    "UPDATE quota SET next_slot = ? WHERE id = 1",
+                    (slot + 1 / self.rate_limit,),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _today():
+    """Alma quotas reset daily, so remaining calls are only trusted on the day they were reported."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
@@ -0,0 +1,61 @@
+import logging
+import os
+
+from src.record_store import write_record
+
+logger = logging.getLogger()
+
+
+class DirectorySink:
+    """Writes each record to record_<mms_id>.mrc in its output directory, or to the
+    directory's record store if it has one.
+
+    Args:
+        output_directory: path - directory for records without a destination.
+        destinations: dict - {mms_id: list of directories} to write records to instead.
+    """
+
+    def __init__(self, output_directory, destinations=None):
+        self.output_directory = output_directory
+        self.destinations = destinations if destinations is not None else {}
+
+    def write(self, record, data=None):
+        """Writes a pymarc Record. Returns the list of files written."""
+        id = record["001"].value()
+        data = data if data is not None else record.as_marc()
+        files = []
+        for directory in self.destinations.get(id, [self.output_directory]):
+            files.append(write_record(directory, id, data, atomic=True))
+        return files
+
+    def close(self):
+        pass
+
+
+class MarcFileSink:
+    """Appends every record to one MARC file, e.g. to merge records as they arrive."""
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self._file = open(output_file, "ab")
+
+    def write(self, record, data=None):
+        self._file.write(data if data is not None else record.as_marc())
+        return [self.output_file]
+
+    def close(self):
+        self._file.close()
+
+
+class MemorySink:
+    """Keeps records in a list, for processing in memory without writing files."""
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record, data=None):
+        self.records.append(record)
+        return []
+
+    def close(self):
+        pass
@@ -0,0 +1,390 @@
+import logging
+import os
+import re
+import threading
+
+import pymarc
+
+from src.fetch_journal import write_record_file
+from src.marc_index import LazyRecord, iter_relationships, scan_relationship
+
+logger = logging.getLogger()
+
+STORE_NAME = "records"
+RECORD_FILENAME = re.compile(r"^record_(\d+)\.mrc$")
+RECORD_TERMINATOR = b"\x1d"
+
+
+class RecordStore:
+    """An append-only store of MARC records in one data file with an MMS Id index.
+
+    Records are appended to <name>.mrc, which is itself a valid MARC file, and each
+    record's offset and length are appended to <name>.idx as "mms_id<TAB>offset<TAB>length".
+    Putting a record again appends the new version and the index points to it. Reads are
+    done in offset order, so splitting, lookup and merging are sequential I/O on one file
+    rather than one file per record.
+
+    If the index is missing or behind the data file, e.g. after an interrupted run, the
+    unindexed records are read from the data file and added to it. A partly written
+    record at the end of the data file is removed if truncate is set, otherwise it is
+    left in place and skipped.
+
+    Args:
+        directory: path - directory to keep the store in, e.g. output/mrc/split/many.
+        name: str - filename of the store without extension.
+        truncate: bool - remove a partly written record from the end of the data file.
+    """
+
+    def __init__(self, directory, name=STORE_NAME, truncate=True):
+        self.directory = directory
+        self.data_path = os.path.join(directory, f"{name}.mrc")
+        self.index_path = os.path.join(directory, f"{name}.idx")
+        self.index = {}
+        self.entries = 0
+        self.truncate = truncate
+        # False if the data file holds bytes that are not indexed records.
+        self.clean = True
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._data = open(self.data_path, "a+b")
+        self._data.seek(0, os.SEEK_END)
+        self.size = self._data.tell()
+        indexed = self._load_index()
+        self._index_file = open(self.index_path, "a", encoding="utf-8")
+        if indexed != self.size:
+            self._recover(indexed)
+
+    def _load_index(self):
+        """Reads the index file. Returns the end of the last complete indexed record."""
+        end = 0
+        if not os.path.isfile(self.index_path):
+            return end
+        with open(self.index_path, "r", encoding="utf-8") as index_file:
+            for line in index_file:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 3 or not line.endswith("\n"):
+                    break
+                id, offset, length = parts[0], int(parts[1]), int(parts[2])
+                if offset + length > self.size:
+                    break
+                self.index[id] = (offset, length)
+                self.entries += 1
+                end = max(end, offset + length)
+        return end
+
+    def _recover(self, start):
+        """Indexes records in the data file after start, dropping a truncated last record."""
+        logger.warning(f"Record store {self.data_path} index incomplete, recovering.")
+        with open(self.index_path, "w", encoding="utf-8") as index_file:
+            for id, (offset, length) in self.index.items():
+                index_file.write(f"{id}\t{offset}\t{length}\n")
+        self.entries = len(self.index)
+        offset = start
+        self._data.seek(offset)
+        while offset < self.size:
+            leader = self._data.read(5)
+            if len(leader) < 5 or not leader.isdigit():
+                break
+            length = int(leader)
+            data = leader + self._data.read(length - 5)
+            if len(data) < length or not data.endswith(RECORD_TERMINATOR):
+                break
+            record = pymarc.Record(data)
+            self._add_to_index(record["001"].value(), offset, length)
+            offset += length
+        if offset < self.size and self.truncate:
+            logger.warning(
+                f"Removing {self.size - offset} bytes of incomplete record from {self.data_path}."
+            )
+            self._data.truncate(offset)
+            self.size = offset
+        elif offset < self.size:
+            logger.warning(
+                f"Skipping {self.size - offset} bytes of incomplete record in {self.data_path}."
+            )
+            self.clean = False
+        self._index_file.flush()
+
+    def _add_to_index(self, id, offset, length):
+        self.index[id] = (offset, length)
+        self.entries += 1
+        self._index_file.write(f"{id}\t{offset}\t{length}\n")
+
+    def put(self, id, data):
+        """Appends one record's MARC bytes."""
+        self.put_many({id: data})
+
+    def put_many(self, records):
+        """Appends records from a {mms_id: MARC bytes} dictionary or (mms_id, bytes) pairs.
+
+        Both files are flushed once all records are written, so a record is only indexed
+        once its data is in the data file.
+        """
+        if isinstance(records, dict):
+            records = records.items()
+        with self._lock:
+            for id, data in records:
+                self._data.write(data)
+                self._add_to_index(id, self.size, len(data))
+                self.size += len(data)
+            self._data.flush()
+            self._index_file.flush()
+
+    def get(self, id):
+        """Returns the MARC bytes stored for id, or None."""
+        location = self.index.get(id)
+        if location is None:
+            return None
+        with self._lock:
+            self._data.seek(location[0])
+            return self._data.read(location[1])
+
+    def get_many(self, ids):
+        """Returns a {mms_id: MARC bytes} dictionary of the ids found, read in file order."""
+        locations = sorted((self.index[id], id) for id in set(ids) if id in self.index)
+        records = {}
+        with self._lock:
+            for (offset, length), id in locations:
+                self._data.seek(offset)
+                records[id] = self._data.read(length)
+        return records
+
+    def get_record(self, id):
+        """Returns the pymarc Record stored for id, or None."""
+        data = self.get(id)
+        return None if data is None else pymarc.Record(data)
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def ids(self):
+        """Returns the identifiers in the store in the order they were first written."""
+        return list(self.index)
+
+    def iter_raw(self, block_size=1024 * 1024):
+        """Yields (mms_id, MARC bytes) for the current version of each record in file order.
+
+        The data file is read sequentially with its own handle, in blocks of block_size.
+        """
+        with self._lock:
+            self._data.flush()
+            locations = sorted(
+                (offset, length, id) for id, (offset, length) in self.index.items()
+            )
+        with open(self.data_path, "rb", buffering=block_size) as data_file:
+            position = 0
+            for offset, length, id in locations:
+                if offset != position:
+                    data_file.seek(offset)
+                yield id, data_file.read(length)
+                position = offset + length
+
+    def iter_records(self):
+        """Yields the current version of each record as a pymarc Record, in file order."""
+        for id, data in self.iter_raw():
+            yield pymarc.Record(data)
+
+    def write_to(self, output, block_size=1024 * 1024):
+        """Writes the current version of every record to a binary file object.
+
+        If no record has been replaced and the data file holds only indexed records, it is
+        copied as it is.
+
+        Returns:
+            Number of records written.
+        """
+        if self.entries == len(self.index) and self.clean:
+            with self._lock:
+                self._data.flush()
+            with open(self.data_path, "rb") as data_file:
+                for block in iter(lambda: data_file.read(block_size), b""):
+                    output.write(block)
+        else:
+            for id, data in self.iter_raw(block_size):
+                output.write(data)
+        return len(self.index)
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_index_path(directory, name=STORE_NAME):
+    return os.path.join(directory, f"{name}.idx")
+
+
+def is_store_file(filename, name=STORE_NAME):
+    """Returns True if filename is the data or index file of a record store."""
+    if os.path.basename(filename) not in (f"{name}.mrc", f"{name}.idx"):
+        return False
+    return open_store(os.path.dirname(filename) or ".") is not None
+
+
+def open_store(directory, create=False):
+    """Returns the shared RecordStore kept in directory.
+
+    A directory only has a store once it has been created here, which writes both the
+    data file and the index. A records.mrc without records.idx, e.g. a file supplied as
+    input, is an ordinary MARC file. A store that was not opened with create never has
+    its data file truncated.
+
+    Args:
+        directory: path - directory holding the store.
+        create: bool - create the store if there is none. Record files already in the
+                directory are left in place and still read by the functions below.
+
+    Returns:
+        RecordStore, or None if the directory has no store and create is False.
+    """
+    key = os.path.abspath(directory)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None and create:
+            store = RecordStore(directory)
+            _stores[key] = store
+        elif store is None and os.path.isfile(get_index_path(directory)):
+            store = RecordStore(directory, truncate=False)
+            _stores[key] = store
+    return store
+
+
+def close_stores():
+    """Closes every open store, e.g. before their directories are cleared."""
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+
+
+def write_record(directory, id, data, atomic=False):
+    """Writes a record to the store in directory, or to directory/record_<id>.mrc without one.
+
+    Args:
+        atomic: bool - write record files with write_record_file so they are complete or absent.
+
+    Returns:
+        Path of the file written.
+    """
+    store = open_store(directory)
+    if store is not None:
+        store.put(id, data)
+        return store.data_path
+    output_file = os.path.join(directory, f"record_{id}.mrc")
+    if atomic:
+        write_record_file(output_file, data)
+    else:
+        with open(output_file, "wb") as mrc_out:
+            mrc_out.write(data)
+    return output_file
+
+
+def read_record_data(directory, id):
+    """Returns the MARC bytes for id from the store or record file in directory, or None."""
+    store = open_store(directory)
+    if store is not None and id in store:
+        return store.get(id)
+    output_file = os.path.join(directory, f"record_{id}.mrc")
+    if not os.path.isfile(output_file):
+        return None
+    with open(output_file, "rb") as mrc:
+        return mrc.read()
+
+
+def get_directory_record(directory, id, lazy=False):
+    """Returns the pymarc Record for id from the store or record file in directory, or None.
+
+    With lazy set a LazyRecord is returned, which decodes fields only when they are used.
+    """
+    data = read_record_data(directory, id)
+    if data is None:
+        return None
+    return LazyRecord(data) if lazy else pymarc.Record(data)
+
+
+def has_record(directory, id):
+    store = open_store(directory)
+    if store is not None and id in store:
+        return True
+    return os.path.isfile(os.path.join(directory, f"record_{id}.mrc"))
+
+
+def get_record_files(directory):
+    """Returns the sorted record_<id>.mrc files in directory, excluding any store."""
+    if not os.path.isdir(directory):
+        return []
+    return [
+        os.path.join(directory, file)
+        for file in sorted(os.listdir(directory))
+        if file.endswith(".mrc") and not is_store_file(os.path.join(directory, file))
+    ]
+
+
+def get_marc_files(directory):
+    """Returns the data file of the store in directory, if any, then its record files."""
+    store = open_store(directory)
+    files = [] if store is None else [store.data_path]
+    return files + get_record_files(directory)
+
+
+def get_directory_ids(directory):
+    """Returns the set of identifiers in the store and record files in directory."""
+    ids = set()
+    store = open_store(directory)
+    if store is not None:
+        ids.update(store.ids())
+    for file in get_record_files(directory):
+        match = RECORD_FILENAME.match(os.path.basename(file))
+        if match is not None:
+            ids.add(match.group(1))
+    return ids
+
+
+def iter_directory_records(directory):
+    """Yields pymarc Records from the store in directory, then from its record files."""
+    store = open_store(directory)
+    if store is not None:
+        yield from store.iter_records()
+    for file in get_record_files(directory):
+        yield from iter_marc_file(file)
+
+
+def iter_marc_file(filename):
+    """Yields pymarc Records from a MARC file, reading a store's data file through its index."""
+    if is_store_file(filename):
+        yield from open_store(os.path.dirname(filename) or ".").iter_records()
+        return
+    with open(filename, "rb") as mrc:
+        for record in pymarc.MARCReader(mrc):
+            yield record
+
+
+def count_directory_records(directory):
+    """Returns the number of records in the store and record files in directory."""
+    return len(get_directory_ids(directory))
+
+
+def iter_file_relationships(filename):
+    """Yields (Relationship, MARC bytes) for each record in a MARC file without parsing it.
+
+    A store's data file is read through its index, so only current records are returned.
+    """
+    if is_store_file(filename):
+        store = open_store(os.path.dirname(filename) or ".")
+        for id, data in store.iter_raw():
+            yield scan_relationship(data), data
+        return
+    yield from iter_relationships(filename)
@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+from urllib.parse import urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger()
+
+# Capture settings, can be overridden in .env
+# "off", "record" to store every API response, or "replay" to answer requests from the store.
+CAPTURE_MODE = os.getenv("API_CAPTURE_MODE", "off").lower()
+CAPTURE_DIR = os.getenv("API_CAPTURE_DIR", os.path.join("json", "capture"))
+CAPTURED_HEADERS = ("Content-Type", "X-Exl-Api-Remaining")
+
+
+class CaptureMissing(Exception):
+    """Raised in replay mode when no response was recorded for a request."""
+
+
+def capture_key(method, url, params=None, data=None):
+    """Returns a filename safe key identifying a request.
+
+    The host is ignored so captures from one server can be replayed against another, and
+    view=full is ignored as it is the default view.
+    """
+    params = {
+        key: str(value)
+        for key, value in (params or {}).items()
+        if not (key == "view" and value == "full")
+    }
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    request = json.dumps(
+        [method.upper(), urlparse(url).path, sorted(params.items())], ensure_ascii=True
+    ).encode("utf-8")
+    digest = hashlib.sha256(request)
+    digest.update(hashlib.sha256(data or b"").digest())
+    return digest.hexdigest()[:40]
+
+
+def get_capture_path(key, directory=None):
+    return os.path.join(directory or CAPTURE_DIR, f"{key}.gz")
+
+
+def save_capture(method, url, params, data, status, headers, body, directory=None):
+    """Stores a response and the request that produced it, gzip compressed.
+
+    The file holds one line of JSON describing the request and response, followed by
+    the raw response body.
+    """
+    directory = directory or CAPTURE_DIR
+    os.makedirs(directory, exist_ok=True)
+    key = capture_key(method, url, params, data)
+    meta = {
+        "method": method.upper(),
+        "url": url,
+        "params": params,
+        "status": status,
+        "headers": {
+            name: headers.get(name) for name in CAPTURED_HEADERS if headers.get(name)
+        },
+    }
+    path = get_capture_path(key, directory)
+    temp_path = path + ".tmp"
+    with gzip.open(temp_path, "wb") as out:
+        out.write(json.dumps(meta).encode("utf-8") + b"\n")
+        out.write(body)
+    os.replace(temp_path, path)
+    logger.debug(f"Captured {method} {url} {params} to {path}")
+
+
+def load_capture(method, url, params=None, data=None, directory=None):
+    """Returns (meta, body) recorded for a request. Raises CaptureMissing if none was."""
+    path = get_capture_path(capture_key(method, url, params, data), directory)
+    if not os.path.isfile(path):
+        raise CaptureMissing(f"No captured response for {method} {url} {params}")
+    with gzip.open(path, "rb") as f:
+        meta = json.loads(f.readline())
+        body = f.read()
+    return meta, body
+
+
+def replay_response(method, url, params=None, data=None, directory=None):
+    """Returns the recorded response for a request as a requests Response."""
+    meta, body = load_capture(method, url, params, data, directory)
+    response = requests.Response()
+    response.status_code = meta["status"]
+    response.headers = CaseInsensitiveDict(meta["headers"])
+    response._content = body
+    response._content_consumed = (
+        True  # so iter_content reads the body, not the connection
+    )
+    response.encoding = "utf-8"
+    response.url = url
+    logger.debug(f"Replayed {method} {url} {params}")
+    return response
+
+
+def capture_response(response, method, url, params=None, data=None, directory=None):
+    """Stores a requests Response."""
+    save_capture(
+        method,
+        url,
+        params,
+        data,
+        response.status_code,
+        response.headers,
+        response.content,
+        directory,
+    )
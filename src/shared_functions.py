@@ -3,13 +3,32 @@ import re
 import pymarc
 import json
 import pandas as pd
+from datetime import datetime, timezone
 from src.api_call import *
 from src.xml_load_and_process import *
 from src.transform_marc_file import *
-
+from src.bib_cache import BibCache, write_cached_records
+from src.id_set import without
+from src.extract_xml import get_modified_dates_from_bibs, read_records_from_response
+from src.record_sinks import DirectorySink
+from src.record_store import (
+    close_stores,
+    get_record_files,
+    iter_file_relationships,
+    open_store,
+    write_record,
+)
+from src.fetch_journal import (
+    FetchJournal,
+    JOURNAL_DIR,
+    get_unfinished_journals,
+)
 
 logger = logging.getLogger()
 
+MMS_ID_PATTERN = re.compile(r"99\d+7636")
+ID_FILE_CHUNK_SIZE = 1024 * 1024  # characters read at a time from text files of ids
+
 
 def setup_logger(
     name,
@@ -42,6 +61,7 @@ def setup_directories():
     output_path_xml = os.path.join("output", "xml")
     parent_records_path = os.path.join(output_path_mrc, "parent")
     many_records_path = os.path.join(output_path_mrc, "many")
+    journal_path = JOURNAL_DIR
     paths = [
         log_path,
         input_path,
@@ -54,6 +74,7 @@ def setup_directories():
         many_records_path,
         output_path_mrc_merge,
         json_path,
+        journal_path,
     ]
 
     for path in paths:
@@ -68,10 +89,14 @@ def setup_directories():
 def clear_temporary_files():
     """Removes temporary files from specific directories once complete."""
     print("Cleaning temporary working directories...")
+    close_stores()
     output_path_mrc = os.path.join("output", "mrc", "split")
     output_path_mrc_merge = os.path.join("output", "mrc", "merge")
     json_path = os.path.join("json")
-    paths = [json_path, output_path_mrc, output_path_mrc_merge]
+    paths = [json_path, output_path_mrc, output_path_mrc_merge, JOURNAL_DIR]
+    if response_capture.CAPTURE_MODE == "replay":
+        # Keep the captured responses being replayed.
+        paths.remove(json_path)
 
     for local_path in paths:
         if os.path.exists(local_path):
@@ -90,6 +115,26 @@ def clear_temporary_files():
         logger.info(f"Removed {count} files from {local_path}")
 
 
+def resume_unfinished_download():
+    """Asks whether to resume a download left unfinished by an earlier run.
+
+    Returns:
+        True if a fetch journal exists and the user chose to resume, in which case
+        temporary files should not be cleared. False otherwise.
+    """
+    journals = get_unfinished_journals()
+    if len(journals) == 0:
+        return False
+    print(f"Found {len(journals)} unfinished download(s) from an earlier run.")
+    print("Resume and only retrieve the missing records? (y/n)")
+    response = input()
+    if response.lower().startswith("y"):
+        logger.info(f"Resuming unfinished downloads: {journals}")
+        return True
+    logger.info("Unfinished downloads discarded.")
+    return False
+
+
 def get_callable_files(dir_name):
     """Get a list of filepaths in target directory"""
     output_list = []
@@ -103,15 +148,19 @@ def get_callable_files(dir_name):
         logger.error(f"Error getting callable files: {e}")
 
 
-def split_marc_records(input_filename):
+def split_marc_records(input_filename, write_records=True):
     """Splits mrc records into Parent and Many records and returns a dictionary of identifiers.
 
     Args:
         input_filename: str - Location and filename of target Marc file.
+        write_records: bool - set to False to only collect identifiers, e.g. when records
+                       are read from the input file with marc_index.MappedMARCFile.
 
     Processing:
         Checks if records are Parent files, and writes those to parent_records.mrc in output/mrc/split/.
         Other records get written into many_records.mrc file in same location.
+        If the parent or many directory has a record store (see record_store.open_store),
+        records are appended to it instead of written to one file each.
 
     Return:
         dictionary with keys:
@@ -126,100 +175,252 @@ def split_marc_records(input_filename):
         "parent_ids": [],
         "parent_many_dict": {},
     }
-    with open(input_filename, "rb") as fh:
-        reader = pymarc.MARCReader(fh)  # creates
-        for record in reader:
-            id = record.get_fields("001")[0].value()
-            if is_parent(record):
-                identifiers["parent_records"].append(id)
-                output_file = os.path.join(
-                    "output", "mrc", "split", "parent", f"record_{id}.mrc"
-                )
+    parent_ids = set()
+    # Only 001, 950$p and 956$b are needed, so records are scanned rather than parsed
+    # and written out as they were read.
+    for relationship, data in iter_file_relationships(input_filename):
+        id = relationship.mms_id
+        if id is None:
+            logger.warning(f"Skipping record without 001 in {input_filename}")
+            continue
+        if relationship.is_parent:
+            identifiers["parent_records"].append(id)
+            output_directory = os.path.join("output", "mrc", "split", "parent")
+        else:
+            identifiers["many_records"].append(id)
+            p_id = relationship.parent_id
+            if p_id is not None:
+                identifiers["parent_many_dict"].setdefault(p_id, []).append(id)
+                if p_id not in parent_ids:
+                    parent_ids.add(p_id)
+                    identifiers["parent_ids"].append(p_id)
             else:
-                identifiers["many_records"].append(id)
-                field_950 = record.get_fields("950")
-                if len(field_950) > 0:
-                    for field in field_950:
-                        if field.get("p") is not None:
-                            p_id = record["950"]["p"]
-                            existing_manys = identifiers["parent_many_dict"].get(p_id)
-                            if existing_manys is not None:
-                                new_list = existing_manys + [id]
-                                identifiers["parent_many_dict"].update({p_id: new_list})
-                            else:
-                                identifiers["parent_many_dict"].update({p_id: [id]})
-                    try:
-                        identifiers["parent_many_dict"].update({})
-                        if record["950"]["p"] not in identifiers["parent_ids"]:
-                            identifiers["parent_ids"].append(record["950"]["p"])
-                    except KeyError:
-                        logger.info("950 p not present in record.")
-                output_file = os.path.join(
-                    "output", "mrc", "split", "many", f"record_{id}.mrc"
-                )
-            with open(output_file, "wb") as f:
-                f.write(record.as_marc())
+                logger.info("950 p not present in record.")
+            output_directory = os.path.join("output", "mrc", "split", "many")
+        if write_records:
+            write_record(output_directory, id, bytes(data))
     return identifiers
 
 
-def get_missing_records(existing_records, request_ids, output_directory):
+def get_missing_records(
+    existing_records,
+    request_ids,
+    output_directory,
+    max_workers=MAX_WORKERS,
+    use_cache=True,
+    incremental=False,
+    destinations=None,
+    on_records=None,
+    sink=None,
+):
     """Call API process to add missing parent records to existing file.
 
     Args:
         existing_records: list (str) - identifiers for already downloaded records.
-        request_ids: list (str) - identifiers required for download (may overlap with existing)
+        request_ids: list (str) or MMSIdSet - identifiers required for download (may overlap
+                    with existing). An MMSIdSet is kept as integers until each chunk is requested.
         output_file: str - MARC file with filepath to write retrieved records to.
+        max_workers: int - number of API requests to run concurrently. Defaults to ADAPTIVE
+                    ("auto"), which adjusts concurrency to API responses. Set to 1 to call in series.
+        use_cache: bool - load fresh records from the local bib cache and add retrieved records to it.
+        incremental: bool - load records that have not been modified in Alma since they
+                    were cached from the cache rather than downloading them again.
+        destinations: dict - {mms_id: list of directories} to write records to instead of
+                    output_directory, e.g. from fetch_planner.plan_fetch.
+        on_records: function - called with the list of pymarc records of each chunk once it
+                    has been written, e.g. ParentPrefetcher.on_records.
+        sink: object with write(record, data) - where retrieved records go, e.g. a MarcFileSink
+                    or MemorySink from record_sinks. Defaults to a DirectorySink writing
+                    record_<mms_id>.mrc files to output_directory or destinations.
 
     Processing:
-        Checks request_ids not in existing_records. Prepares and calls API to retrieve missing records.
-        Writes them to file.
+        Checks request_ids not in existing_records. Passes records found in the cache to the
+        sink and on_records. In incremental mode only cached records that Alma reports as
+        unchanged are taken from the cache. Prepares and calls API to retrieve the
+        remaining records. Each chunk's response is streamed and parsed to pymarc records by
+        the worker that requested it, so only the chunks in flight are held in memory. The
+        records are passed to the sink, then recorded in a fetch journal, so a run
+        interrupted part way only requests the records not yet written when restarted.
+        Retrieved records are added to the cache with their modification date. When
+        API_CAPTURE_MODE is record or replay the cache and journal are not used, so that a
+        replay sends the same chunks that were recorded.
+
+    Returns:
+        List of identifiers retrieved from the API.
     """
     logger.debug(f"Number of existing records: {len(existing_records)}")
     logger.debug(f"Number of request ids: {len(request_ids)}")
+    if destinations is None:
+        destinations = {}
+    capturing = response_capture.CAPTURE_MODE in ("record", "replay")
+    if capturing:
+        # Captures are keyed by the ids of each chunk, so chunks must be requested exactly
+        # as they were recorded, whatever is in the cache or journal.
+        use_cache = incremental = False
 
     # Check what identifiers need to be retrieved.
-    missing_list = []
-    for identifier in request_ids:
-        if identifier not in existing_records:
-            missing_list.append(identifier)
-
-    # Retrieve records.
-    logger.info("Missing list:")
-    logger.info(missing_list)
-
-    required = chunk_identifiers(missing_list)
-    xml = "<collection>"  # Wraps xml in root element collection
-    if check_api_key():
-        for key in required:
-            response = get_bibs(key, required[key])
-            data = response.json()
-            string = json.dumps(data, indent=4)
-            bibs = json.loads(string)
-            for item in bibs["bib"]:
-                for key in item:
-                    if key == "anies":
-                        value = item["anies"][0].replace(
-                            '<?xml version="1.0" encoding="UTF-16"?>', ""
-                        )
-                        xml += value
-    xml += "</collection>"  # Closes root element wrapping.
-    with open(
-        "output//xml//records_retrieved.xml",
-        "w",
-        encoding="utf-8",
-        errors="backslashreplace",
-    ) as out:
-        out.write(xml)
-
-    # Load xml to pymarc Record object array.
-    record_array = pymarc.parse_xml_to_array("output//xml//records_retrieved.xml")
-
-    # Write to mrc.
-    for record in record_array:
-        id = record.get_fields("001")[0].value()
-        output_file = os.path.join(output_directory, f"record_{id}.mrc")
-        with open(output_file, "wb") as mrc_out:
-            mrc_out.write(record.as_marc())
+    # Records written by a custom sink are not journalled, as they may not be on disk.
+    own_sink = sink is None
+    journal = None
+    resumed = set()
+    if own_sink:
+        sink = DirectorySink(output_directory, destinations)
+    if own_sink and not capturing:
+        journal = FetchJournal(output_directory)
+        resumed = journal.completed_ids()
+    if len(resumed) > 0:
+        print(f"Resuming download: {len(resumed)} records already written.")
+        logger.info(f"Resuming download: {len(resumed)} records already written.")
+    missing_list = without(without(request_ids, existing_records), resumed)
+
+    api_ready = check_api_key()
+    if use_cache or incremental:
+        cache = BibCache()
+    if use_cache and not (incremental and api_ready):
+        missing_list = write_cached_records(
+            cache,
+            missing_list,
+            output_directory,
+            destinations,
+            sink=sink,
+            on_records=on_records,
+        )
+
+    # Reserve the calls needed with the quota governor before starting.
+    governor = get_governor()
+    passes = 2 if incremental else 1
+    reservation = None
+    if api_ready:
+        reservation = governor.reserve(estimate_calls(len(missing_list), passes))
+    if api_ready and reservation is None:
+        print(
+            "WARNING: Too few API calls remaining to retrieve records. Consult logfile for more information."
+        )
+        api_ready = False
+
+    retrieved = []
+    completed = True
+    try:
+        if incremental and api_ready:
+            changed = remove_unchanged_records(cache, missing_list, max_workers)
+            unchanged = without(missing_list, changed)
+            # Unchanged records are written from the cache, so the output is complete.
+            not_cached = write_cached_records(
+                cache,
+                unchanged,
+                output_directory,
+                destinations,
+                sink=sink,
+                on_records=on_records,
+            )
+            missing_list = without(missing_list, without(unchanged, not_cached))
+
+        # Retrieve records.
+        logger.info("Missing list:")
+        logger.info(missing_list)
+
+        required = chunk_identifiers(missing_list)
+        if api_ready:
+            for chunk, result in fetch_bibs(
+                required, max_workers, read=read_records_from_response
+            ):
+                if result is None:
+                    # Not journalled, so the chunk is requested again on resume.
+                    completed = False
+                    print(
+                        f"WARNING: Batch {chunk} failed. Consult logfile for more information."
+                    )
+                    logger.error(
+                        f"Batch {chunk} failed. Records not retrieved: {required[chunk]}"
+                    )
+                    continue
+                # Write the chunk's records, then journal them, so an interrupted run
+                # can skip them.
+                records, dates = result
+                written = {}
+                data = {}
+                for record in records:
+                    id = record.get_fields("001")[0].value()
+                    data[id] = record.as_marc()
+                    written[id] = sink.write(record, data[id])
+                    retrieved.append(id)
+                if journal is not None:
+                    journal.record_chunk(chunk, written)
+                if use_cache or incremental:
+                    cache.put_many(data, dates)
+                if on_records is not None:
+                    on_records(records)
+    except QuotaExceeded as e:
+        completed = False
+        print(
+            f"WARNING: API quota floor reached. Keeping records retrieved so far. {e}"
+        )
+        logger.error(f"API quota floor reached, retrieval stopped: {e}")
+    finally:
+        governor.release(reservation)
+        if own_sink:
+            sink.close()
+
+    if completed and api_ready and journal is not None:
+        journal.finish()
+    return retrieved
+
+
+def is_modified_since(modified, fetched_at):
+    """Returns True if an Alma modification date is on or after the day a record was fetched.
+
+    Alma dates are day granular (e.g. "2023-10-20Z"), so a change later on the day the
+    record was fetched cannot be told apart from one earlier that day, and is treated as
+    a change. Dates that are missing or cannot be read also count as changed.
+    """
+    try:
+        modified_day = datetime.strptime(modified[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return True
+    return modified_day >= datetime.fromtimestamp(fetched_at, timezone.utc).date()
+
+
+def remove_unchanged_records(cache, request_ids, max_workers=MAX_WORKERS):
+    """Removes records from a request whose cached version is still current in Alma.
+
+    Args:
+        cache: BibCache - cache holding previously retrieved records.
+        request_ids: list (str) - identifiers required for download.
+        max_workers: int - number of API requests to run concurrently.
+
+    Processing:
+        Requests the brief view (metadata without MARCxml) of every cached record and
+        compares its modification date with the day it was fetched, see is_modified_since.
+        Unchanged records are marked as fresh in the cache.
+
+    Returns:
+        List of identifiers that are new or have changed, in the same order as request_ids,
+        or an MMSIdSet if request_ids is one.
+    """
+    fetched = cache.get_fetched(request_ids)
+    if len(fetched) == 0:
+        return request_ids
+    current = {}
+    for key, response in fetch_bibs(
+        chunk_identifiers(list(fetched)), max_workers, view="brief"
+    ):
+        if response is None or response.status_code != 200:
+            # Records without a current date are treated as changed and requested.
+            logger.error(f"Brief request {key} failed, records will be requested.")
+            continue
+        current.update(get_modified_dates_from_bibs(response.json()))
+    unchanged = {
+        identifier
+        for identifier, fetched_at in fetched.items()
+        if identifier in current
+        and not is_modified_since(current[identifier], fetched_at)
+    }
+    cache.touch(unchanged)
+    print(f"Records unchanged since last retrieved: {len(unchanged)}")
+    logger.info(
+        f"Records unchanged since last retrieved: {len(unchanged)}. These will be loaded from the cache."
+    )
+    return without(request_ids, unchanged)
 
 
 # Load records as dataframe
@@ -265,15 +466,22 @@ def get_identifiers_from_spreadsheet(filename):
 
 
 def merge_marc_records(directory, output_filename):
+    """Appends every record in directory to output_filename.
+
+    Records in the directory's record store are copied first in one sequential read,
+    followed by any record_<id>.mrc files.
+    """
     try:
-        for root, dir, files in os.walk(directory):
-            dir_list = [os.path.join(directory, file) for file in files]
-            dir_list.sort()
+        dir_list = get_record_files(directory)
     except Exception as e:
         logger.error(f"Error getting directory list for marc record merge: {e}")
     logger.debug(f"Directory list: {dir_list}")
     try:
         with open(output_filename, "ab") as output:
+            store = open_store(directory)
+            if store is not None:
+                count = store.write_to(output)
+                logger.debug(f"Merged {count} records from {store.data_path}")
             for file in dir_list:
                 with open(file, "rb") as mrc:
                     reader = pymarc.MARCReader(mrc)
@@ -369,28 +577,53 @@ def list_files(directory):
     return file_list
 
 
-def get_ids_from_file(directory, file_list):
-    """Get ids from file"""
-    id_list = []
+def iter_ids_from_text(file, chunk_size=ID_FILE_CHUNK_SIZE):
+    """Yields each MMS id in an open text file, reading chunk_size characters at a time.
+
+    Id files are often one long comma separated line, so they are not read by line. The
+    digits at the end of each chunk are held back and joined to the next chunk, so an id
+    split between two chunks is still matched whole.
+    """
+    carry = ""
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        text = carry + chunk
+        end = len(text)
+        while end > 0 and text[end - 1].isdigit():
+            end -= 1
+        carry = text[end:]
+        for match in MMS_ID_PATTERN.finditer(text, 0, end):
+            yield match.group(0)
+    for match in MMS_ID_PATTERN.finditer(carry):
+        yield match.group(0)
+
+
+def iter_ids_from_file(directory, file_list):
+    """Yields MMS ids from each spreadsheet or text file in file_list.
+
+    Text files are read in chunks with iter_ids_from_text, so ids are produced without
+    loading the file.
+    """
     for file in file_list:
+        count = 0
         if ".xls" in file:
             data = get_identifiers_from_spreadsheet(os.path.join(directory, file))
             for column in data.columns:
                 if column.startswith("mms_id"):
-                    ids = data[column].to_list()
-                    id_list.extend(ids)
-                    print(
-                        f"MMS_ids found: {len(ids)} ids added to list from file {file}."
-                    )
-                    logger.info(
-                        f"MMS_ids found: {len(ids)} ids added to list from file {file}."
-                    )
+                    for id in data[column]:
+                        count += 1
+                        yield id
         else:
             with open(os.path.join(directory, file), "r") as f:
-                ids = re.findall("99\d+7636", f.read())
-                id_list.extend(ids)
-                print(f"MMS_ids found: {len(ids)} ids added to list from file {file}.")
-                logger.info(
-                    f"MMS_ids found: {len(ids)} ids added to list from file {file}."
-                )
-    return id_list
+                for id in iter_ids_from_text(f):
+                    count += 1
+                    yield id
+        print(f"MMS_ids found: {count} ids added to list from file {file}.")
+        logger.info(f"MMS_ids found: {count} ids added to list from file {file}.")
+
+
+def get_ids_from_file(directory, file_list):
+    """Get ids from file"""
+    return list(iter_ids_from_file(directory, file_list))
@@ -0,0 +1,212 @@
+import csv
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pymarc
+import requests
+
+import src.api_call as api_call
+from src.quota_governor import QuotaExceeded
+
+logger = logging.getLogger()
+
+WRITE_WORKERS = 4
+REPORT_FIELDS = ["mms_id", "result", "status", "message"]
+
+
+def bib_xml_from_record(record):
+    """Returns the bib object Alma expects for an update, wrapping the MARCXML record."""
+    return "<bib>" + pymarc.record_to_xml(record).decode("utf-8") + "</bib>"
+
+
+def get_error_message(response):
+    """Returns the first Alma error message in a response, or its text."""
+    try:
+        return response.json()["errorList"]["error"][0]["errorMessage"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return response.text[:500]
+
+
+def put_bib(record):
+    """Replaces a bib record in Alma with record.
+
+    Returns:
+        Tuple (mms_id, status code, message). Status is None if the request could not be sent.
+    """
+    mms_id = record["001"].value()
+    headers = {
+        "Authorization": "apikey " + api_call.get_api_key(),
+        "Accept": "application/json",
+        "Content-Type": "application/xml",
+    }
+    try:
+        response = api_call.api_request(
+            "PUT",
+            api_call.BASEURL + mms_id,
+            params={"validate": "true", "override_warning": "true"},
+            headers=headers,
+            data=bib_xml_from_record(record).encode("utf-8"),
+        )
+    except (requests.ConnectionError, requests.Timeout) as e:
+        return mms_id, None, str(e)
+    if response.status_code == 200:
+        return mms_id, 200, ""
+    return mms_id, response.status_code, get_error_message(response)
+
+
+def write_back_records(
+    records, max_workers=WRITE_WORKERS, report_file=None, count=None
+):
+    """Sends updated records to Alma with at most max_workers requests in flight.
+
+    Args:
+        records: iterable of pymarc Records, read lazily so large files are not held in memory.
+        max_workers: int - number of concurrent PUT requests.
+        report_file: path - CSV file to write one line per record to, with the result,
+                     status code and Alma error message.
+        count: int - number of records, if records has no length.
+
+    Processing:
+        Reserves one call per record with the quota governor. Records are sent in order. A
+        record whose request raises an error is reported as failed. If the quota floor is
+        reached, no further records are sent and the rest are reported as not sent.
+
+    Returns:
+        Dictionary with lists of mms ids for 'updated', 'failed' and 'not_sent'.
+    """
+    if count is None and hasattr(records, "__len__"):
+        count = len(records)
+    governor = api_call.get_governor()
+    reservation = None
+    if count is not None:
+        reservation = governor.reserve(count)
+    if count is not None and reservation is None:
+        print("WARNING: Too few API calls remaining to write back records.")
+        return {
+            "updated": [],
+            "failed": [],
+            "not_sent": [r["001"].value() for r in records],
+        }
+
+    results = {"updated": [], "failed": [], "not_sent": []}
+    report = None
+    if report_file is not None:
+        report = open(report_file, "w", newline="", encoding="utf-8")
+        writer = csv.DictWriter(report, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+
+    def log_result(mms_id, result, status, message):
+        results[result].append(mms_id)
+        if result == "failed":
+            logger.error(f"Write back failed for {mms_id}: status {status}, {message}")
+        if report is not None:
+            writer.writerow(
+                {
+                    "mms_id": mms_id,
+                    "result": result,
+                    "status": status,
+                    "message": message,
+                }
+            )
+
+    records = iter(records)
+    pending = deque()
+    start = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            stopped = False
+            for record in records:
+                pending.append(
+                    (record["001"].value(), executor.submit(put_bib, record))
+                )
+                # Keep a bounded window so records are read as they are sent.
+                while len(pending) >= max_workers * 2 and not stopped:
+                    stopped = _collect(pending.popleft(), log_result)
+                if stopped:
+                    break
+            while len(pending) > 0:
+                if _collect(pending.popleft(), log_result):
+                    stopped = True
+            if stopped:
+                for record in records:
+                    log_result(
+                        record["001"].value(), "not_sent", None, "Quota floor reached"
+                    )
+    finally:
+        governor.release(reservation)
+        if report is not None:
+            report.close()
+
+    elapsed = time.monotonic() - start
+    summary = (
+        f"Write back: {len(results['updated'])} updated, {len(results['failed'])} failed, "
+        f"{len(results['not_sent'])} not sent in {elapsed:.1f}s."
+    )
+    print(summary)
+    logger.info(summary)
+    return results
+
+
+def _collect(item, log_result):
+    """Records the result of one submitted request. Returns True if the quota floor was reached."""
+    mms_id, future = item
+    try:
+        mms_id, status, message = future.result()
+    except QuotaExceeded as e:
+        log_result(mms_id, "not_sent", None, str(e))
+        return True
+    except Exception as e:
+        # One record failing, e.g. on a request error or a record that cannot be
+        # converted to XML, does not stop the others.
+        log_result(mms_id, "failed", None, f"{type(e).__name__}: {e}")
+        return False
+    if status == 200:
+        log_result(mms_id, "updated", status, message)
+    else:
+        log_result(mms_id, "failed", status, message)
+    return False
+
+
+def count_records(marc_file, block_size=1024 * 1024):
+    """Counts records in a MARC file by their end of record marks, without parsing them."""
+    count = 0
+    with open(marc_file, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            count += block.count(b"\x1d")
+    return count
+
+
+def write_back_file(marc_file, max_workers=WRITE_WORKERS, record_filter=None):
+    """Sends the records in a MARC file to Alma, writing a report next to the file.
+
+    Args:
+        marc_file: path - binary MARC file, e.g. updated_records.mrc.
+        max_workers: int - number of concurrent PUT requests.
+        record_filter: function - returns True for records to send, e.g. to skip parent
+                       records included for reference.
+
+    Returns:
+        Dictionary from write_back_records.
+    """
+    if api_call.get_api_key() is None:
+        print("API Key is None. Records not written back.")
+        return None
+    report_file = os.path.splitext(marc_file)[0] + "_write_back.csv"
+    # An upper bound on the calls needed when record_filter skips some records.
+    count = count_records(marc_file)
+
+    def read_records():
+        with open(marc_file, "rb") as fh:
+            for record in pymarc.MARCReader(fh):
+                if record is None:
+                    logger.warning(f"Skipping unreadable record in {marc_file}")
+                    continue
+                if record_filter is None or record_filter(record):
+                    yield record
+
+    results = write_back_records(read_records(), max_workers, report_file, count)
+    print(f"Write back report written to {report_file}")
+    return results
@@ -7,9 +7,70 @@ import re
 import dateparser
 import dateutil.parser
 from datetime import datetime
+from lxml import etree
 
 logger = logging.getLogger()
 
+MARC_XML_NS = "{http://www.loc.gov/MARC21/slim}"
+RECORD_TAGS = ("record", MARC_XML_NS + "record")
+
+
+def record_from_element(element):
+    """Builds a pymarc Record from a MARCXML <record> element parsed by lxml.
+
+    Elements may be in the MARC21 slim namespace or in no namespace, as in the 'anies'
+    of Alma API responses.
+    """
+    record = pymarc.Record()
+    fields = []
+    for child in element:
+        tag = child.tag
+        if not isinstance(tag, str):  # comments and processing instructions
+            continue
+        if tag[0] == "{":
+            tag = tag[tag.index("}") + 1 :]
+        if tag == "leader":
+            record.leader = child.text or ""
+        elif tag == "controlfield":
+            fields.append(pymarc.Field(tag=child.get("tag"), data=child.text or ""))
+        elif tag == "datafield":
+            subfields = [
+                pymarc.Subfield(subfield.get("code"), subfield.text or "")
+                for subfield in child
+                if isinstance(subfield.tag, str)
+            ]
+            fields.append(
+                pymarc.Field(
+                    tag=child.get("tag"),
+                    indicators=[child.get("ind1", " "), child.get("ind2", " ")],
+                    subfields=subfields,
+                )
+            )
+    record.add_field(*fields)
+    return record
+
+
+def iter_marcxml_records(source):
+    """Yields pymarc Records from a MARCXML file one at a time.
+
+    Args:
+        source: path or binary file object containing a <collection> or single <record>.
+
+    Processing:
+        Parses incrementally with lxml iterparse. Each <record> element is converted and then
+        cleared, and earlier siblings removed, so memory use stays at about one record
+        however large the collection is. Replaces pymarc.parse_xml_to_array for large files.
+    """
+    context = etree.iterparse(source, events=("end",), tag=RECORD_TAGS, huge_tree=True)
+    for event, element in context:
+        yield record_from_element(element)
+        element.clear()
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                del parent[0]
+    del context
+
 
 def fix_655_gmgpc(record):
     """Fixes trailing punctuation from 655 with $2 gmgpc subject headings."""
@@ -10,11 +10,65 @@ ROOT_DIR = os.path.abspath(os.curdir)
 # Path variables
 filename = "test_file_with_errors.mrc"
 single_p_record = "record_9933644453607636.mrc"
-test_marc_file = os.path.join(ROOT_DIR, "tests","test_data","marc_data","test_file_with_errors.mrc")
-test_parents = os.path.join(ROOT_DIR, "tests","test_data","marc_data", "parent")
+test_marc_file = os.path.join(
+    ROOT_DIR, "tests", "test_data", "marc_data", "test_file_with_errors.mrc"
+)
+test_parents = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data", "parent")
 missing_records = ["9938846603607636"]
-validation_fn = "many_records_report.txt" # report generated on 1448 records and found 386 w/ errors
-validation_report = os.path.join(ROOT_DIR, "tests","test_data","validation", validation_fn)
+validation_fn = "many_records_report.txt"  # report generated on 1448 records and found 386 w/ errors
+validation_report = os.path.join(
+    ROOT_DIR, "tests", "test_data", "validation", validation_fn
+)
+
+
+# Keep API quota state for tests out of the working directory.
+@pytest.fixture(autouse=True)
+def temp_quota_governor(tmp_path, monkeypatch):
+    """Replaces the shared quota governor with one stored in the test's temporary directory."""
+    import src.api_call
+    from src.quota_governor import QuotaGovernor
+
+    governor = QuotaGovernor(str(tmp_path / "api_quota.sqlite"), rate_limit=1000)
+    monkeypatch.setattr(src.api_call, "_governor", governor)
+    yield governor
+    governor.close()
+
+
+# Local stand-in for the Alma API, for tests that make API calls.
+@pytest.fixture(scope="session")
+def fake_api_corpus():
+    """Records served by fake_api. Override in a test module to serve other records."""
+    from src.fake_alma_api import load_corpus
+
+    return load_corpus([test_parents])
+
+
+@pytest.fixture
+def fake_api_options():
+    """Keyword arguments for FakeAlmaAPI in fake_api. Override in a test module to change them."""
+    return {}
+
+
+@pytest.fixture
+def fake_api(fake_api_corpus, fake_api_options, monkeypatch, tmp_path):
+    """Starts a FakeAlmaAPI serving a copy of fake_api_corpus and points api_call at it.
+
+    Retries are not delayed. The test runs in tmp_path, which has an output/xml
+    directory. Rates and quota can be changed on the returned api while it is serving.
+    """
+    import src.api_call
+    from src.fake_alma_api import FakeAlmaAPI, start_server
+
+    api = FakeAlmaAPI(deepcopy(fake_api_corpus), seed=1, **fake_api_options)
+    server, baseurl = start_server(api)
+    monkeypatch.setattr(src.api_call, "BASEURL", baseurl)
+    monkeypatch.setattr(src.api_call, "KEY", "test_key_value")
+    monkeypatch.setattr(src.api_call, "get_retry_delay", lambda response, attempt: 0)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join("output", "xml"))
+    yield api
+    server.shutdown()
+
 
 # Create MARC file
 @pytest.fixture(scope="session")
@@ -27,10 +81,11 @@ def temp_marc_file(tmp_path_factory):
     shutil.copyfile(test_marc_file, mrcfn)
     yield mrcfn
 
+
 # Create required directory structure in temp directory
 @pytest.fixture(scope="session")
 def setup_working_directory(tmp_path_factory):
-    """Returns a path to the temporary directory where 
+    """Returns a path to the temporary directory where
     folder structure has been generated.
 
     Used for other tests.
@@ -38,25 +93,35 @@ def setup_working_directory(tmp_path_factory):
     location = tmp_path_factory.getbasetemp()
     os.chdir(location)
     log_path = os.path.join("logs")
-    input_path = os.path.join("input","load")
-    processed_path = os.path.join("output", "record_processing","processed")
-    exception_path = os.path.join("output", "record_processing","exceptions")
-    output_path_mrc = os.path.join("output", "mrc","split")
+    input_path = os.path.join("input", "load")
+    processed_path = os.path.join("output", "record_processing", "processed")
+    exception_path = os.path.join("output", "record_processing", "exceptions")
+    output_path_mrc = os.path.join("output", "mrc", "split")
     input_path_mrc = os.path.join(input_path, "mrc")
-    output_path_xml = os.path.join("output","xml")
-    parent_records_path = os.path.join(output_path_mrc,"parent")
-    many_records_path = os.path.join(output_path_mrc,"many")
-    output_path_mrc_merge = os.path.join("output", "mrc","merge")
-    paths = [log_path, input_path, processed_path, exception_path, output_path_mrc, 
-             input_path_mrc, output_path_xml, parent_records_path, many_records_path, 
-             output_path_mrc_merge]
-    
+    output_path_xml = os.path.join("output", "xml")
+    parent_records_path = os.path.join(output_path_mrc, "parent")
+    many_records_path = os.path.join(output_path_mrc, "many")
+    output_path_mrc_merge = os.path.join("output", "mrc", "merge")
+    paths = [
+        log_path,
+        input_path,
+        processed_path,
+        exception_path,
+        output_path_mrc,
+        input_path_mrc,
+        output_path_xml,
+        parent_records_path,
+        many_records_path,
+        output_path_mrc_merge,
+    ]
+
     for path in paths:
         if not os.path.exists(path):
             # create missing directories
             os.makedirs(path)
     yield location
 
+
 # Create copy of required match records in output directory.
 @pytest.fixture(scope="session")
 def missing_parents(tmp_path_factory):
@@ -71,24 +136,27 @@ def missing_parents(tmp_path_factory):
         copydir = output
         shutil.copytree(test_parents, copydir, dirs_exist_ok=True)
     except Exception as e:
-        print(f"Error occured copying parents in test: {e}")   
+        print(f"Error occured copying parents in test: {e}")
     output = os.path.join(location, output_dir)
     yield output
 
-@pytest.fixture(scope='session')
+
+@pytest.fixture(scope="session")
 def single_record(missing_parents):
     file = os.path.join(missing_parents, "record_9933644453607636.mrc")
-    with open(file, 'rb') as mf:
+    with open(file, "rb") as mf:
         reader = pymarc.MARCReader(mf)
         for record in reader:
             wf = record
     yield wf
 
+
 @pytest.fixture(scope="function")
 def set_field_list(request):
     field = request.param
     return field
 
+
 @pytest.fixture(scope="function")
 def field_replace_record(single_record, set_field_list):
     wr = deepcopy(single_record)
@@ -99,8 +167,9 @@ def field_replace_record(single_record, set_field_list):
         wr.add_field(field)
     yield wr
 
+
 @pytest.fixture(scope="session")
 def get_validation_report(tmp_path_factory):
     vfn = tmp_path_factory.getbasetemp() / validation_fn
     shutil.copyfile(validation_report, vfn)
-    yield vfn
\ No newline at end of file
+    yield vfn
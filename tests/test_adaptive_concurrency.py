@@ -0,0 +1,113 @@
+import threading
+import time
+import pytest
+
+from src.adaptive_concurrency import *
+
+"""Tests for the AIMD concurrency window."""
+
+
+def test_window_grows_additively_with_successes():
+    limiter = AdaptiveLimiter(initial=4, maximum=10)
+    for _ in range(3):
+        limiter.observe(200, 0.1)
+    assert limiter.stats()["window"] == 4
+    for _ in range(3):
+        limiter.observe(200, 0.1)
+    assert limiter.stats()["window"] == 5
+
+
+def test_window_halves_once_for_burst_of_throttling():
+    limiter = AdaptiveLimiter(initial=8, target_latency=60)
+    limiter.observe(429, 0.1)
+    limiter.observe(429, 0.1)
+    stats = limiter.stats()
+    assert stats["window"] == 4
+    assert stats["throttled"] == 2
+
+
+def test_slow_responses_decrease_window():
+    limiter = AdaptiveLimiter(initial=8, target_latency=1)
+    limiter.observe(200, 2)
+    assert limiter.stats()["window"] == 4
+
+
+def test_window_stays_within_bounds():
+    limiter = AdaptiveLimiter(initial=2, minimum=2, maximum=3, target_latency=0)
+    limiter.observe(503, 0.1)
+    assert limiter.stats()["window"] == 2
+    limiter = AdaptiveLimiter(initial=3, maximum=3)
+    for _ in range(20):
+        limiter.observe(200, 0.1)
+    assert limiter.stats()["window"] == 3
+
+
+def test_low_quota_stops_growth():
+    limiter = AdaptiveLimiter(initial=4, low_quota=1000)
+    for _ in range(8):
+        limiter.observe(200, 0.1, {"X-Exl-Api-Remaining": "999"})
+    assert limiter.stats()["window"] == 4
+    assert limiter.stats()["remaining"] == 999
+
+
+def test_acquire_limits_in_flight():
+    limiter = AdaptiveLimiter(initial=2)
+    lock = threading.Lock()
+    in_flight = {"now": 0, "max": 0}
+
+    def work():
+        limiter.acquire()
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        time.sleep(0.01)
+        with lock:
+            in_flight["now"] -= 1
+        limiter.release()
+
+    threads = [threading.Thread(target=work) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert in_flight["max"] == 2
+
+
+def test_fetch_bibs_adaptive(monkeypatch):
+    import src.api_call as api_call
+
+    def fake_get_bibs(part, mms_ids, view="full", on_response=None, stream=False):
+        on_response(200, 0.01, {"X-Exl-Api-Remaining": "100000"})
+        return mms_ids
+
+    monkeypatch.setattr(api_call, "get_bibs", fake_get_bibs)
+    request_dict = {str(i): f"ids_{i}" for i in range(50)}
+    results = list(api_call.fetch_bibs(request_dict, api_call.ADAPTIVE))
+    assert [response for key, response in results] == list(request_dict.values())
+
+
+# Checks that the latency reported for a chunk includes reading its body.
+def test_get_bibs_adaptive_latency_includes_body(monkeypatch):
+    import src.api_call as api_call
+
+    class FakeStreamedResponse:
+        def close(self):
+            pass
+
+    def fake_get_bibs(part, mms_ids, view="full", on_response=None, stream=False):
+        on_response(503, 0.01, {})
+        on_response(200, 0.01, {})
+        return FakeStreamedResponse()
+
+    def read(response):
+        time.sleep(0.05)
+        return "records"
+
+    monkeypatch.setattr(api_call, "get_bibs", fake_get_bibs)
+    limiter = AdaptiveLimiter()
+    assert api_call._get_bibs_adaptive(limiter, "0", "ids_0", "full", read) == "records"
+    stats = limiter.stats()
+    assert stats["completed"] == 2
+    assert stats["throttled"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["average_latency"] >= (0.01 + 0.06) / 2
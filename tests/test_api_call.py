@@ -42,6 +42,39 @@ def test_chunk_identifiers(mms_ids, chunked):
     assert chunked_identifiers == chunked
 
 
+def test_chunk_identifiers_over_100():
+    mms_ids = [f"99{i:010d}7636" for i in range(250)]
+    chunked = chunk_identifiers(mms_ids)
+    assert list(chunked) == ["0", "1", "2"]
+    assert [len(value.split(",")) for value in chunked.values()] == [100, 100, 50]
+    assert ",".join(chunked.values()).split(",") == mms_ids
+    assert len(mms_ids) == 250
+
+
+def test_iter_chunks_from_generator():
+    mms_ids = (f"99{i:010d}7636" for i in range(201))
+    chunks = iter_chunks(mms_ids, size=100)
+    assert next(chunks)[0] == "0"
+    assert [key for key, value in chunks] == ["1", "2"]
+
+
+def test_filter_identifiers():
+    mms_ids = iter(
+        [
+            "9938036653607636",
+            " 9938036613607636",
+            "997636",
+            "9938036653607636",
+            9938164143607636,
+        ]
+    )
+    assert list(filter_identifiers(mms_ids)) == [
+        "9938036653607636",
+        "9938036613607636",
+        "9938164143607636",
+    ]
+
+
 # Checks if the MMS Id validator is behaving as expected. Can only test for obvious issues such as not long enough and not starting and ending with the right characters.""
 @pytest.mark.parametrize(
     "id, expected",
@@ -52,6 +85,8 @@ def test_chunk_identifiers(mms_ids, chunked):
         ("99also_not", False),
         ("999912376367636", False),
         ("999912347636", True),
+        ("99abc7636", False),
+        ("99 12 7636", False),
     ],
 )
 def test_validate_mmsid(id, expected):
@@ -61,3 +96,190 @@ def test_validate_mmsid(id, expected):
 # Checks that the API key is configured correctly. This does call the API.
 def test_check_api_key():
     assert check_api_key() == True
+
+
+# Checks that concurrent fetching returns chunks in request order without exceeding the worker limit.
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_fetch_bibs_order_and_bound(monkeypatch, max_workers):
+    import random
+    import threading
+    import time
+    import src.api_call as api_call
+
+    lock = threading.Lock()
+    in_flight = {"now": 0, "max": 0}
+
+    def fake_get_bibs(part, mms_ids, view="full", stream=False):
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        time.sleep(random.uniform(0, 0.01))
+        with lock:
+            in_flight["now"] -= 1
+        return mms_ids
+
+    monkeypatch.setattr(api_call, "get_bibs", fake_get_bibs)
+    request_dict = {str(i): f"ids_{i}" for i in range(20)}
+    results = list(fetch_bibs(request_dict, max_workers))
+    assert [key for key, response in results] == list(request_dict.keys())
+    assert [response for key, response in results] == list(request_dict.values())
+    assert in_flight["max"] <= max_workers
+
+
+# Checks that a chunk whose request raises is yielded as failed and later chunks are still requested.
+@pytest.mark.parametrize("max_workers", [1, 3, "auto"])
+def test_fetch_bibs_request_error_fails_one_chunk(monkeypatch, max_workers):
+    import requests
+    import src.api_call as api_call
+    from src.response_capture import CaptureMissing
+
+    def fake_get_bibs(part, mms_ids, view="full", on_response=None, stream=False):
+        if part == "2":
+            raise requests.ConnectionError("connection reset")
+        if part == "5":
+            raise CaptureMissing("no capture")
+        return mms_ids
+
+    monkeypatch.setattr(api_call, "get_bibs", fake_get_bibs)
+    request_dict = {str(i): f"ids_{i}" for i in range(8)}
+    results = dict(fetch_bibs(request_dict, max_workers))
+    assert list(results) == list(request_dict)
+    assert results["2"] is None and results["5"] is None
+    assert results["7"] == "ids_7"
+
+
+# Checks that streamed responses are read and closed by the worker, and the result yielded.
+@pytest.mark.parametrize("max_workers", [1, 2, "auto"])
+def test_fetch_bibs_reads_in_worker(monkeypatch, max_workers):
+    import threading
+    import src.api_call as api_call
+
+    class FakeStreamedResponse:
+        def __init__(self, body):
+            self.body = body
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    responses = []
+
+    def fake_get_bibs(part, mms_ids, view="full", on_response=None, stream=False):
+        assert stream
+        response = FakeStreamedResponse(mms_ids)
+        responses.append(response)
+        return response
+
+    def read(response):
+        assert not response.closed
+        if response.body == "ids_1":
+            raise ValueError("invalid JSON")
+        return response.body, threading.current_thread().name
+
+    monkeypatch.setattr(api_call, "get_bibs", fake_get_bibs)
+    request_dict = {str(i): f"ids_{i}" for i in range(4)}
+    results = dict(fetch_bibs(request_dict, max_workers, read=read))
+    assert results["1"] is None
+    assert [results[key][0] for key in ["0", "2", "3"]] == ["ids_0", "ids_2", "ids_3"]
+    if max_workers != 1:
+        assert results["0"][1] != threading.current_thread().name
+    assert len(responses) == 4
+    assert all(response.closed for response in responses)
+
+
+# Checks that chunks not yet requested are cancelled when the quota floor stops the run.
+def test_fetch_bibs_stops_on_quota(monkeypatch):
+    import src.api_call as api_call
+
+    requested = []
+
+    def fake_get_bibs(part, mms_ids, view="full", stream=False):
+        requested.append(part)
+        if part == "1":
+            raise QuotaExceeded("quota floor reached")
+        return mms_ids
+
+    monkeypatch.setattr(api_call, "get_bibs", fake_get_bibs)
+    request_dict = {str(i): f"ids_{i}" for i in range(40)}
+    with pytest.raises(QuotaExceeded):
+        list(fetch_bibs(request_dict, 2))
+    assert len(requested) < 40
+
+
+def make_response(status_code, headers=None):
+    import requests
+
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+class NullGovernor:
+    """Quota governor that allows every call without waiting."""
+
+    def acquire(self):
+        pass
+
+    def record_response(self, response):
+        pass
+
+
+class FakeSession:
+    """Returns queued responses in order and records the number of calls."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+# Checks that throttled and server error responses are retried with Retry-After honoured.
+def test_api_request_retries(monkeypatch):
+    import src.api_call as api_call
+
+    delays = []
+    session = FakeSession(
+        [
+            make_response(429, {"Retry-After": "3"}),
+            make_response(503),
+            make_response(200),
+        ]
+    )
+    monkeypatch.setattr(api_call, "get_session", lambda: session)
+    monkeypatch.setattr(api_call, "get_governor", lambda: NullGovernor())
+    monkeypatch.setattr(api_call.time, "sleep", delays.append)
+    response = api_request("GET", "https://example.org")
+    assert response.status_code == 200
+    assert session.calls == 3
+    assert delays[0] == 3
+    assert 0 <= delays[1] <= api_call.BACKOFF_BASE * 2
+
+
+# Checks that client errors are returned without retrying.
+def test_api_request_does_not_retry_client_error(monkeypatch):
+    import src.api_call as api_call
+
+    session = FakeSession([make_response(400), make_response(200)])
+    monkeypatch.setattr(api_call, "get_session", lambda: session)
+    monkeypatch.setattr(api_call, "get_governor", lambda: NullGovernor())
+    response = api_request("GET", "https://example.org")
+    assert response.status_code == 400
+    assert session.calls == 1
+
+
+@pytest.mark.parametrize(
+    "headers, attempt, low, high",
+    [
+        ({"Retry-After": "10"}, 0, 10, 10),
+        ({"Retry-After": "100000"}, 0, 60, 60),
+        ({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, 0, 0, 0),
+        ({}, 3, 0, 8),
+    ],
+)
+def test_get_retry_delay(headers, attempt, low, high):
+    delay = get_retry_delay(make_response(429, headers), attempt)
+    assert low <= delay <= high
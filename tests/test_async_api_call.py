@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import pytest
+from aiohttp import web
+
+import src.api_call as api_call
+import src.async_api_call as async_api_call
+from src.async_api_call import *
+
+ROOT_DIR = os.path.abspath(os.curdir)
+json_response = os.path.join(
+    ROOT_DIR,
+    "tests",
+    "test_data",
+    "extract_xml",
+    "input",
+    "json_language_encoding.json",
+)
+expected_ids = ["9938036653607636", "9938036613607636", "9938164143607636"]
+
+
+async def serve(handler, coroutine):
+    """Runs coroutine with BASEURL pointing at a local server using handler."""
+    app = web.Application()
+    app.router.add_get("/almaws/v1/bibs/", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    async_api_call.BASEURL = f"http://127.0.0.1:{port}/almaws/v1/bibs/"
+    try:
+        return await coroutine
+    finally:
+        await runner.cleanup()
+
+
+@pytest.fixture
+def offline_api(monkeypatch):
+    monkeypatch.setattr(api_call, "KEY", "test_key_value")
+    monkeypatch.setattr(async_api_call, "check_api_key", lambda: True)
+    monkeypatch.setattr(async_api_call, "get_retry_delay", lambda response, attempt: 0)
+    monkeypatch.setattr(async_api_call, "BASEURL", async_api_call.BASEURL)
+
+
+def test_async_get_missing_records(offline_api, tmp_path):
+    with open(json_response, "r", encoding="utf-8") as f:
+        body = f.read()
+
+    async def handler(request):
+        return web.Response(text=body, content_type="application/json")
+
+    written = asyncio.run(
+        serve(
+            handler,
+            async_get_missing_records(["123"], expected_ids, tmp_path, use_cache=False),
+        )
+    )
+    assert sorted(written) == sorted(expected_ids)
+    for id in expected_ids:
+        assert os.path.isfile(tmp_path / f"record_{id}.mrc")
+
+
+def test_async_failed_chunk_is_logged(offline_api, tmp_path, caplog):
+    async def handler(request):
+        return web.Response(status=400, text="{}", content_type="application/json")
+
+    written = asyncio.run(
+        serve(
+            handler,
+            async_get_missing_records([], expected_ids, tmp_path, use_cache=False),
+        )
+    )
+    assert written == []
+    assert f"Records not retrieved: {','.join(expected_ids)}" in caplog.text
+
+
+def test_async_get_bibs_retries_throttled(offline_api):
+    with open(json_response, "r", encoding="utf-8") as f:
+        body = f.read()
+    calls = []
+
+    async def handler(request):
+        calls.append(request.query["mms_id"])
+        if len(calls) == 1:
+            return web.Response(status=429, headers={"Retry-After": "0"})
+        return web.Response(text=body, content_type="application/json")
+
+    async def fetch():
+        async with create_session() as session:
+            return await async_get_bibs(session, "0", ",".join(expected_ids))
+
+    body = asyncio.run(serve(handler, fetch()))
+    assert len(calls) == 2
+    assert len(json.loads(body)["bib"]) == 3
@@ -0,0 +1,103 @@
+import os
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+
+from src.bib_cache import *
+
+"""Tests for the local bib cache."""
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache" / "bib_cache.sqlite")
+
+
+def test_put_and_get(cache_path):
+    cache = BibCache(cache_path)
+    cache.put("9938036653607636", b"record one")
+    assert cache.get("9938036653607636") == b"record one"
+    assert cache.get("9938036613607636") is None
+
+
+def test_expired_records_are_missing(cache_path):
+    cache = BibCache(cache_path, ttl=-1)
+    cache.put("9938036653607636", b"record one")
+    assert cache.get("9938036653607636") is None
+
+
+def test_least_recently_used_records_evicted(cache_path):
+    cache = BibCache(cache_path, max_bytes=20)
+    cache.put("1", b"0123456789")
+    cache.put("2", b"0123456789")
+    cache.get("1")  # 1 is now more recently used than 2
+    cache.put("3", b"0123456789")
+    assert cache.get("1") == b"0123456789"
+    assert cache.get("2") is None
+    assert cache.get("3") == b"0123456789"
+
+
+def fill_cache(args):
+    path, start = args
+    cache = BibCache(path)
+    for number in range(start, start + 50):
+        cache.put(str(number), b"x" * 100)
+    return True
+
+
+def test_concurrent_processes(cache_path):
+    BibCache(cache_path)
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(fill_cache, [(cache_path, n * 50) for n in range(4)])
+        )
+    assert all(results)
+    assert len(BibCache(cache_path).get_many(str(n) for n in range(200))) == 200
+
+
+parent_dir = os.path.join(
+    os.path.abspath(os.curdir), "tests", "test_data", "marc_data", "parent"
+)
+
+
+def read_parent(id):
+    with open(os.path.join(parent_dir, f"record_{id}.mrc"), "rb") as f:
+        return f.read()
+
+
+def test_write_cached_records(cache_path, tmp_path):
+    cache = BibCache(cache_path)
+    data = read_parent("9933644453607636")
+    cache.put("9933644453607636", data)
+    cache.put("9938036613607636", b"not a record")
+    remaining = write_cached_records(
+        cache, ["9933644453607636", "9938036613607636"], tmp_path
+    )
+    assert remaining == ["9938036613607636"]
+    with open(os.path.join(tmp_path, "record_9933644453607636.mrc"), "rb") as f:
+        assert f.read() == data
+
+
+def test_write_cached_records_to_destinations(cache_path, tmp_path):
+    cache = BibCache(cache_path)
+    data = read_parent("9933644453607636")
+    cache.put("9933644453607636", data)
+    destinations = {"9933644453607636": [str(tmp_path / "a"), str(tmp_path / "b")]}
+    for directory in destinations["9933644453607636"]:
+        os.makedirs(directory)
+    remaining = write_cached_records(
+        cache, ["9933644453607636"], str(tmp_path / "output"), destinations
+    )
+    assert remaining == []
+    for directory in destinations["9933644453607636"]:
+        with open(os.path.join(directory, "record_9933644453607636.mrc"), "rb") as f:
+            assert f.read() == data
+    assert not os.path.exists(tmp_path / "output")
+
+
+def test_touch(cache_path):
+    cache = BibCache(cache_path, ttl=-1)
+    cache.put("9938036653607636", b"record one", "2023-10-20Z")
+    assert cache.get("9938036653607636") is None
+    cache.ttl = 60
+    cache.touch(["9938036653607636"])
+    assert cache.get("9938036653607636") == b"record one"
@@ -0,0 +1,89 @@
+import os
+import pytest
+
+import src.api_call as api_call
+from src.bulk_export import *
+
+"""Tests for bulk export mode against the local Alma API stand-in."""
+
+ROOT_DIR = os.path.abspath(os.curdir)
+test_parents = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data", "parent")
+
+
+@pytest.fixture
+def corpus(fake_api_corpus):
+    return fake_api_corpus
+
+
+@pytest.fixture
+def fake_api_options(tmp_path):
+    return {"export_dir": str(tmp_path / "export"), "job_polls": 2}
+
+
+@pytest.fixture
+def fake_api(fake_api):
+    os.makedirs("many")
+    yield fake_api
+
+
+def test_get_conf_url(monkeypatch):
+    monkeypatch.setattr(
+        api_call, "BASEURL", "https://api-ap.hosted.exlibrisgroup.com/almaws/v1/bibs/"
+    )
+    assert get_conf_url() == "https://api-ap.hosted.exlibrisgroup.com/almaws/v1/conf/"
+
+
+def test_get_records_by_export(fake_api, corpus, monkeypatch):
+    monkeypatch.setattr("src.bulk_export.SET_MEMBER_BATCH", 5)
+    request_ids = sorted(corpus)[:12]
+    written = get_records_by_export(
+        request_ids,
+        "many",
+        job_id="M123",
+        export_dir=fake_api.export_dir,
+        poll_interval=0,
+    )
+    assert sorted(written) == request_ids
+    assert sorted(os.listdir("many")) == [f"record_{id}.mrc" for id in request_ids]
+    # Set removed once the job completes. 1 create, 2 add member, 1 run, 3 polls, 1 delete.
+    assert fake_api.sets == {}
+    assert fake_api.stats()["requests"] == 8
+
+
+def test_get_records_with_export_falls_back(fake_api, corpus):
+    request_ids = sorted(corpus)[:3]
+    written = get_records_with_export(request_ids, "many", threshold=1, job_id=None)
+    assert sorted(written) == request_ids
+    assert fake_api.instances == {}
+
+
+@pytest.mark.parametrize("job_id", ["M123", None])
+def test_get_records_with_export_passes_options(fake_api, corpus, job_id):
+    from src.record_sinks import MemorySink
+
+    request_ids = sorted(corpus)[:3]
+    sink = MemorySink()
+    batches = []
+    written = get_records_with_export(
+        request_ids,
+        "many",
+        threshold=1,
+        job_id=job_id,
+        export_dir=fake_api.export_dir,
+        poll_interval=0,
+        sink=sink,
+        on_records=batches.append,
+        use_cache=False,
+    )
+    assert sorted(written) == request_ids
+    assert sorted(record["001"].value() for record in sink.records) == request_ids
+    assert sum(len(batch) for batch in batches) == 3
+    assert os.listdir("many") == []
+    assert (fake_api.instances != {}) == (job_id is not None)
+
+
+def test_ingest_export_file_filters(tmp_path):
+    export_file = os.path.join(test_parents, "record_9933644453607636.mrc")
+    assert ingest_export_file(export_file, str(tmp_path), wanted={"1"}) == []
+    assert ingest_export_file(export_file, str(tmp_path)) == ["9933644453607636"]
+    assert os.path.isfile(tmp_path / "record_9933644453607636.mrc")
@@ -4,37 +4,58 @@ import pytest
 from src.extract_xml import *
 
 ## Define paths
-extract_xml_test_path = path.join("tests","test_data","extract_xml")
+extract_xml_test_path = path.join("tests", "test_data", "extract_xml")
 input_path = path.join(extract_xml_test_path, "input")
 expected_path = path.join(extract_xml_test_path, "expected")
 
 ## Single item example
 single_record = "example_1_record.json"
 single_path = path.join(input_path, single_record)
-single_file_open = open(single_path, 'r', encoding="ascii", errors='backslashreplace')
+single_file_open = open(single_path, "r", encoding="ascii", errors="backslashreplace")
 single_file_read = single_file_open.read()
 single_file_id = "9939772237507636"
-single_file_expected = open(path.join(expected_path, f"record_{single_file_id}.xml"), 'r', encoding="utf-8", errors='backslashreplace')
+single_file_expected = open(
+    path.join(expected_path, f"record_{single_file_id}.xml"),
+    "r",
+    encoding="utf-8",
+    errors="backslashreplace",
+)
 single_file_expected_read = single_file_expected.read()
 
 ## Special character example
 example_json_special_char = "json_language_encoding.json"
 spec_char_file_path = path.join(input_path, example_json_special_char)
-spec_char_input_file = open(spec_char_file_path, 'r', encoding="ascii", errors='backslashreplace')
+spec_char_input_file = open(
+    spec_char_file_path, "r", encoding="ascii", errors="backslashreplace"
+)
 spec_char_id = "9938036653607636"
-spec_char_expected_xml = open(path.join(expected_path, f"record_{spec_char_id}.xml"), 'r', encoding="utf-8", errors='backslashreplace')
+spec_char_expected_xml = open(
+    path.join(expected_path, f"record_{spec_char_id}.xml"),
+    "r",
+    encoding="utf-8",
+    errors="backslashreplace",
+)
 spec_char_input_read = spec_char_input_file.read()
 spec_char_xml_read = spec_char_expected_xml.read()
 
 ## Tests
 
-@pytest.mark.parametrize("input, expected", [(single_file_read, 1), (spec_char_input_read, 3)])
+
+@pytest.mark.parametrize(
+    "input, expected", [(single_file_read, 1), (spec_char_input_read, 3)]
+)
 def test_get_records_from_json_dictionary_size(input, expected):
     records = get_record_from_json(input)
     assert len(records) == expected
 
 
-@pytest.mark.parametrize("input, expected, id", [(single_file_read, single_file_expected_read, single_file_id), (spec_char_input_read, spec_char_xml_read, spec_char_id)])
+@pytest.mark.parametrize(
+    "input, expected, id",
+    [
+        (single_file_read, single_file_expected_read, single_file_id),
+        (spec_char_input_read, spec_char_xml_read, spec_char_id),
+    ],
+)
 def test_get_record_from_json_first_matches_expected(input, expected, id):
     test_data = input
     expected_data = expected
@@ -42,16 +63,149 @@ def test_get_record_from_json_first_matches_expected(input, expected, id):
     target = records[id][0]
     assert target == expected_data
 
-xml_header_pass = "<?xml version=\"1.0\" encoding=\"UTF-16\"?><record>record content</record>"
+
+xml_header_pass = (
+    '<?xml version="1.0" encoding="UTF-16"?><record>record content</record>'
+)
 xml_no_header_pass = r"<record>record content</record>"
 
-@pytest.mark.parametrize("input, expected", [(xml_header_pass, "<record>"), (xml_no_header_pass, "<record>")])
+
+@pytest.mark.parametrize(
+    "input, expected", [(xml_header_pass, "<record>"), (xml_no_header_pass, "<record>")]
+)
 def test_fix_xml_header_encoding(input, expected):
     header_replaced = fix_xml_header_encoding(input)
     assert header_replaced.startswith(expected)
     assert header_replaced.endswith(expected.replace("<", "</"))
 
+
 @pytest.mark.parametrize("input", [("xyz"), ("1234")])
 def test_fix_xml_header_error_handling(input):
     header_replaced = fix_xml_header_encoding(input)
-    assert header_replaced == None
\ No newline at end of file
+    assert header_replaced == None
+
+
+def test_get_modified_dates_from_bibs():
+    dates = get_modified_dates_from_bibs(json.loads(spec_char_input_read))
+    assert len(dates) == 3
+    assert dates[spec_char_id] == "2023-10-20Z"
+
+
+def split_text(text, size):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 7, 1000, 1000000])
+def test_iter_bib_items_matches_json_loads(size):
+    items = list(iter_bib_items(split_text(spec_char_input_read, size)))
+    assert items == json.loads(spec_char_input_read)["bib"]
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"total_record_count": 12345, "bib": [{"mms_id": "1"}]}', [{"mms_id": "1"}]),
+        (
+            '{"bib": [{"mms_id": "1"}, {"mms_id": "2"}], "total_record_count": 12345}',
+            [{"mms_id": "1"}, {"mms_id": "2"}],
+        ),
+        ('{"bib": [], "total_record_count": 0}', []),
+        ('{"total_record_count": 0}', []),
+        ("{}", []),
+    ],
+)
+def test_iter_bib_items_other_keys(text, expected):
+    assert list(iter_bib_items(split_text(text, 3))) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    ['{"bib": [{"mms_id": "1"}', '{"bib": [{"mms_id": "1"} {"mms_id": "2"}]}', "[]"],
+)
+def test_iter_bib_items_invalid(text):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_bib_items(split_text(text, 4)))
+
+
+def test_iter_records_from_json_file():
+    records = list(iter_records_from_json(iter_text_file(spec_char_file_path, 100)))
+    assert [id for id, anies in records] == [
+        "9938036653607636",
+        "9938036613607636",
+        "9938164143607636",
+    ]
+    assert dict(records) == get_record_from_json(spec_char_input_read)
+
+
+def test_iter_response_text_splits_characters():
+    import requests
+
+    text = '{"bib": [{"mms_id": "1", "title": "한국 中文"}]}'
+    response = requests.Response()
+    response._content = text.encode("utf-8")
+    response._content_consumed = True
+    chunks = list(iter_response_text(response, chunk_size=5))
+    assert "".join(chunks) == text
+    assert list(iter_bib_items(chunks))[0]["title"] == "한국 中文"
+
+
+def test_get_pymarc_record_from_bib():
+    bibs = json.loads(spec_char_input_read)["bib"]
+    records = [get_pymarc_record_from_bib(item) for item in bibs]
+    assert [record["001"].value() for record in records] == [
+        "9938036653607636",
+        "9938036613607636",
+        "9938164143607636",
+    ]
+    assert get_pymarc_record_from_bib({"mms_id": "1"}) is None
+
+
+# Checks that a record with broken MARCxml fails the response with a ValueError.
+def test_iter_records_from_bibs_invalid_xml():
+    text = json.dumps({"bib": [{"mms_id": "1", "anies": ["<record><leader>"]}]})
+    with pytest.raises(ValueError):
+        list(iter_records_from_bibs([text]))
+
+
+def test_iterate_returned_requests(tmp_path):
+    output_dir = tmp_path / "xml"
+    output_dir.mkdir()
+    iterate_returned_requests(input_path, str(output_dir))
+    assert sorted(file.name for file in output_dir.iterdir()) == [
+        "record_9938036613607636.xml",
+        "record_9938036653607636.xml",
+        "record_9938164143607636.xml",
+        "record_9939772237507636.xml",
+    ]
+    assert (output_dir / f"record_{spec_char_id}.xml").read_text(
+        encoding="utf-8"
+    ) == fix_xml_header_encoding(spec_char_xml_read)
+
+
+@pytest.mark.parametrize("processes", [1, 2, None])
+def test_iterate_returned_requests_processes(tmp_path, processes):
+    import shutil
+
+    json_dir = tmp_path / "json"
+    output_dir = tmp_path / "xml"
+    json_dir.mkdir()
+    output_dir.mkdir()
+    for file in [single_record, example_json_special_char]:
+        shutil.copy(path.join(input_path, file), json_dir / file)
+    (json_dir / "broken.json").write_text('{"bib": [{"mms_id": ', encoding="utf-8")
+    written = iterate_returned_requests(str(json_dir), str(output_dir), processes)
+    assert sorted(written) == [
+        "9938036613607636",
+        "9938036653607636",
+        "9938164143607636",
+        "9939772237507636",
+    ]
+    assert len(list(output_dir.iterdir())) == 4
+
+
+def test_convert_json_file_reports_errors(tmp_path):
+    broken = tmp_path / "broken.json"
+    broken.write_text('{"bib": [{"mms_id": ', encoding="utf-8")
+    filename, written, errors = convert_json_file(str(broken), str(tmp_path))
+    assert written == []
+    assert len(errors) == 1
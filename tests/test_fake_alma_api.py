@@ -0,0 +1,82 @@
+import os
+import pytest
+import requests
+
+import src.api_call as api_call
+from src.fake_alma_api import *
+from src.shared_functions import get_missing_records
+
+"""Tests for the local Alma bibs API stand-in."""
+
+ROOT_DIR = os.path.abspath(os.curdir)
+test_parents = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data", "parent")
+json_response = os.path.join(
+    ROOT_DIR,
+    "tests",
+    "test_data",
+    "extract_xml",
+    "input",
+    "json_language_encoding.json",
+)
+
+
+@pytest.fixture(scope="module")
+def fake_api_corpus():
+    return load_corpus([test_parents, json_response])
+
+
+@pytest.fixture
+def corpus(fake_api_corpus):
+    return fake_api_corpus
+
+
+def test_load_corpus(corpus):
+    assert len(corpus) == 20
+    assert "9933644453607636" in corpus
+    assert "9938036653607636" in corpus
+    assert corpus["9933644453607636"]["anies"][0].startswith("<?xml")
+
+
+@pytest.mark.parametrize(
+    "view, has_anies",
+    [("full", True), ("brief", False)],
+)
+def test_get_bibs_views(fake_api, view, has_anies):
+    response = requests.get(
+        api_call.BASEURL, params={"mms_id": "9933644453607636,123", "view": view}
+    )
+    assert response.status_code == 200
+    bibs = response.json()["bib"]
+    assert [bib["mms_id"] for bib in bibs] == ["9933644453607636"]
+    assert ("anies" in bibs[0]) == has_anies
+
+
+def test_quota_header_decreases_until_exhausted(fake_api):
+    fake_api.remaining = 2
+    remaining = []
+    statuses = []
+    for i in range(3):
+        response = requests.get(api_call.BASEURL + "test")
+        remaining.append(response.headers["X-Exl-Api-Remaining"])
+        statuses.append(response.status_code)
+    assert remaining == ["1", "0", "0"]
+    assert statuses == [200, 200, 429]
+
+
+def test_partial_responses(fake_api, corpus):
+    fake_api.partial_rate = 1.0
+    ids = ",".join(list(corpus)[:10])
+    response = requests.get(api_call.BASEURL, params={"mms_id": ids})
+    assert 1 <= len(response.json()["bib"]) < 10
+
+
+def test_get_missing_records_with_throttling(fake_api, corpus):
+    fake_api.throttle_rate = 0.2
+    fake_api.error_rate = 0.2
+    request_ids = sorted(corpus)
+    retrieved = get_missing_records([], request_ids, ".", use_cache=False)
+    assert sorted(retrieved) == request_ids
+    for id in request_ids:
+        assert os.path.isfile(f"record_{id}.mrc")
+    stats = fake_api.stats()
+    assert stats["records_served"] == len(request_ids)
@@ -0,0 +1,69 @@
+import os
+import pytest
+
+from src.fetch_journal import *
+
+"""Tests for the resumable fetch journal."""
+
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path / "journal")
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    path = tmp_path / "many"
+    path.mkdir()
+    return str(path)
+
+
+def write_records(output_dir, ids):
+    files = {}
+    for id in ids:
+        output_file = os.path.join(output_dir, f"record_{id}.mrc")
+        write_record_file(output_file, b"record")
+        files[id] = [output_file]
+    return files
+
+
+def test_write_record_file_leaves_no_temporary_file(output_dir):
+    output_file = os.path.join(output_dir, "record_9938036653607636.mrc")
+    write_record_file(output_file, b"record one")
+    write_record_file(output_file, b"record two")
+    with open(output_file, "rb") as f:
+        assert f.read() == b"record two"
+    assert os.listdir(output_dir) == ["record_9938036653607636.mrc"]
+
+
+def test_completed_ids_across_chunks(journal_dir, output_dir):
+    journal = FetchJournal(output_dir, journal_dir)
+    assert journal.completed_ids() == set()
+    journal.record_chunk("0", write_records(output_dir, ["1", "2"]))
+    journal.record_chunk("1", write_records(output_dir, ["3"]))
+    # A new journal for the same directory picks up where the last one stopped.
+    assert FetchJournal(output_dir, journal_dir).completed_ids() == {"1", "2", "3"}
+
+
+def test_completed_ids_requires_files(journal_dir, output_dir):
+    journal = FetchJournal(output_dir, journal_dir)
+    journal.record_chunk("0", write_records(output_dir, ["1", "2"]))
+    os.remove(os.path.join(output_dir, "record_2.mrc"))
+    assert journal.completed_ids() == {"1"}
+
+
+def test_truncated_entry_ignored(journal_dir, output_dir):
+    journal = FetchJournal(output_dir, journal_dir)
+    journal.record_chunk("0", write_records(output_dir, ["1"]))
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"chunk": "1", "records": {"2": [')
+    assert journal.completed_ids() == {"1"}
+
+
+def test_finish_removes_journal(journal_dir, output_dir):
+    journal = FetchJournal(output_dir, journal_dir)
+    journal.record_chunk("0", write_records(output_dir, ["1"]))
+    assert get_unfinished_journals(journal_dir) == [journal.path]
+    journal.finish()
+    assert get_unfinished_journals(journal_dir) == []
+    assert journal.completed_ids() == set()
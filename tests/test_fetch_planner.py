@@ -0,0 +1,69 @@
+import os
+import pytest
+
+from src.bib_cache import BibCache
+from src.fetch_planner import *
+
+"""Tests for the fetch planner."""
+
+
+def write_record(directory, identifier, data=b"record"):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"record_{identifier}.mrc"), "wb") as f:
+        f.write(data)
+
+
+@pytest.fixture
+def phase_directories(tmp_path):
+    many = str(tmp_path / "many")
+    parent = str(tmp_path / "parent")
+    os.makedirs(many)
+    os.makedirs(parent)
+    return many, parent
+
+
+def test_get_ids_on_disk(phase_directories):
+    many, parent = phase_directories
+    write_record(many, "9938036653607636")
+    with open(os.path.join(many, "notes.txt"), "w") as f:
+        f.write("not a record")
+    assert get_ids_on_disk(many) == {"9938036653607636"}
+    assert get_ids_on_disk(os.path.join(many, "missing")) == set()
+
+
+def test_plan_merges_phases_and_skips_existing(phase_directories):
+    many, parent = phase_directories
+    write_record(parent, "2")
+    write_record(many, "3", b"copied")
+    phases = [(["1", "2", "3", "4"], many), (["2", "3", "4", "5"], parent)]
+    plan = plan_fetch(phases)
+    assert plan["request_ids"] == ["1", "4", "5"]
+    assert plan["destinations"] == {"1": [many], "4": [many, parent], "5": [parent]}
+    assert plan["on_disk"] == 2
+    assert plan["calls"] == 1
+    # record 2 copied to many, record 3 copied to parent
+    with open(os.path.join(parent, "record_3.mrc"), "rb") as f:
+        assert f.read() == b"copied"
+    assert os.path.isfile(os.path.join(many, "record_2.mrc"))
+
+
+def test_plan_uses_cache(phase_directories, tmp_path):
+    many, parent = phase_directories
+    cache = BibCache(str(tmp_path / "cache.sqlite"))
+    cache.put("4", b"cached")
+    plan = plan_fetch([(["1", "4"], many), (["4"], parent)], cache)
+    assert plan["request_ids"] == ["1"]
+    assert plan["from_cache"] == 1
+    for directory in (many, parent):
+        with open(os.path.join(directory, "record_4.mrc"), "rb") as f:
+            assert f.read() == b"cached"
+
+
+def test_plan_packs_full_chunks(phase_directories):
+    many, parent = phase_directories
+    phases = [
+        ([str(n) for n in range(150)], many),
+        ([str(n) for n in range(150, 250)], parent),
+    ]
+    plan = plan_fetch(phases)
+    assert plan["calls"] == 3
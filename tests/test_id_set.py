@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from src.id_set import *
+
+"""Tests for the array backed MMS Id set."""
+
+ids_a = ["9938036653607636", "9938036613607636", "9938164143607636"]
+ids_b = ["9938164143607636", "9999999999999999999"]
+
+
+def test_set_sorted_unique_strings():
+    id_set = MMSIdSet(ids_a + ids_a)
+    assert len(id_set) == 3
+    assert id_set.to_list() == sorted(ids_a)
+    assert id_set.array.dtype == np.uint64
+
+
+# Checks that ids which would not convert back to the same string are rejected.
+@pytest.mark.parametrize(
+    "identifier",
+    ["0099123457636", " 9938036653607636", "99.5", "-1", "18446744073709551616", 99],
+)
+def test_set_rejects_non_canonical_ids(identifier):
+    with pytest.raises(ValueError):
+        MMSIdSet([identifier])
+
+
+@pytest.mark.parametrize(
+    "operation, expected",
+    [
+        ("union", sorted(set(ids_a) | set(ids_b))),
+        ("difference", sorted(set(ids_a) - set(ids_b))),
+        ("intersection", sorted(set(ids_a) & set(ids_b))),
+    ],
+)
+def test_set_operations(operation, expected):
+    result = getattr(MMSIdSet(ids_a), operation)(ids_b)
+    assert result.to_list() == expected
+    assert result == getattr(MMSIdSet(ids_a), operation)(MMSIdSet(ids_b))
+
+
+# Ids to exclude that are not canonical cannot be in the set, so they are ignored.
+def test_difference_ignores_non_canonical_ids():
+    result = MMSIdSet(ids_a).difference(["nan", " 9938036653607636", ids_a[1]])
+    assert result.to_list() == sorted([ids_a[0], ids_a[2]])
+
+
+@pytest.mark.parametrize(
+    "identifier, expected",
+    [
+        ("9938036653607636", True),
+        ("09938036653607636", False),
+        (9938036653607636, False),
+        ("9999999999999999999", False),
+        ("not an mms id", False),
+        ("99999999999999999999", False),
+    ],
+)
+def test_contains(identifier, expected):
+    assert (identifier in MMSIdSet(ids_a)) == expected
+
+
+def test_joined_chunks():
+    mms_ids = [str(9900000000000007636 + i * 10000) for i in range(250)]
+    chunks = list(MMSIdSet(mms_ids).joined_chunks(100))
+    assert [len(chunk.split(",")) for chunk in chunks] == [100, 100, 50]
+    assert ",".join(chunks).split(",") == mms_ids
+
+
+@pytest.mark.parametrize(
+    "request_ids, excluded, expected",
+    [
+        (ids_a, ids_b, ids_a[:2]),
+        (ids_a, set(ids_b), ids_a[:2]),
+        (ids_a, MMSIdSet(ids_b), ids_a[:2]),
+        (ids_a, [], ids_a),
+        (MMSIdSet(ids_a), ids_b, MMSIdSet(ids_a[:2])),
+    ],
+)
+def test_without(request_ids, excluded, expected):
+    assert without(request_ids, excluded) == expected
+
+
+# Checks that a set of requested ids is only turned into strings for each request.
+def test_get_missing_records_with_set(monkeypatch, tmp_path):
+    import src.shared_functions as shared_functions
+
+    requested = []
+
+    def fake_fetch_bibs(request_dict, max_workers, read=None):
+        for key, chunk in request_dict.items():
+            requested.append(chunk)
+            yield key, None
+
+    monkeypatch.setattr(shared_functions, "check_api_key", lambda: True)
+    monkeypatch.setattr(shared_functions, "fetch_bibs", fake_fetch_bibs)
+    request_ids = MMSIdSet(ids_a)
+    shared_functions.get_missing_records(
+        ids_a[:1], request_ids, str(tmp_path), use_cache=False
+    )
+    assert requested == [",".join(sorted(ids_a[1:]))]
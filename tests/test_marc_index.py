@@ -0,0 +1,247 @@
+import os
+from copy import deepcopy
+import pymarc
+import pytest
+
+from src.marc_index import *
+
+"""Tests for random access to records in a memory mapped MARC file."""
+
+ROOT_DIR = os.path.abspath(os.curdir)
+marc_data = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data")
+many_file = os.path.join(marc_data, "test_file_with_errors.mrc")
+parent_dir = os.path.join(marc_data, "parent")
+
+
+def read_records(filename):
+    with open(filename, "rb") as fh:
+        return [record for record in pymarc.MARCReader(fh)]
+
+
+@pytest.fixture
+def many_records():
+    return read_records(many_file)
+
+
+def test_index_matches_marc_reader(many_records):
+    with MappedMARCFile(many_file) as marc_file:
+        assert marc_file.ids() == [record["001"].value() for record in many_records]
+        assert marc_file.skipped == 0
+        for record in many_records:
+            id = record["001"].value()
+            assert id in marc_file
+            assert marc_file.get_record(id).as_marc() == record.as_marc()
+        assert marc_file.get_record("9900000000007636") is None
+
+
+def test_iter_records_in_file_order(many_records):
+    ids = [record["001"].value() for record in many_records]
+    with MappedMARCFile(many_file) as marc_file:
+        assert [r["001"].value() for r in marc_file.iter_records()] == ids
+        wanted = [ids[5], ids[1], "9900000000007636"]
+        assert [r["001"].value() for r in marc_file.iter_records(wanted)] == [
+            ids[1],
+            ids[5],
+        ]
+
+
+def test_find_control_number():
+    filename = os.path.join(parent_dir, "record_9933644453607636.mrc")
+    with open(filename, "rb") as fh:
+        data = fh.read()
+    assert find_control_number(data) == "9933644453607636"
+    assert find_control_number(b"xx" + data, 2) == "9933644453607636"
+
+
+def test_skips_unreadable_record(tmp_path, many_records):
+    filename = str(tmp_path / "damaged.mrc")
+    with open(filename, "wb") as fh:
+        fh.write(many_records[0].as_marc())
+        fh.write(b"garbage without a leader\x1d")
+        fh.write(many_records[1].as_marc())
+    with MappedMARCFile(filename) as marc_file:
+        assert marc_file.skipped == 1
+        assert marc_file.ids() == [
+            many_records[0]["001"].value(),
+            many_records[1]["001"].value(),
+        ]
+        assert (
+            marc_file.get(many_records[1]["001"].value()) == many_records[1].as_marc()
+        )
+
+
+def test_duplicate_returns_last(tmp_path, many_records):
+    filename = str(tmp_path / "duplicates.mrc")
+    changed = pymarc.Record(many_records[0].as_marc())
+    changed.add_field(
+        pymarc.Field(
+            tag="500",
+            indicators=[" ", " "],
+            subfields=[pymarc.Subfield(code="a", value="Second copy")],
+        )
+    )
+    with open(filename, "wb") as fh:
+        fh.write(many_records[0].as_marc())
+        fh.write(changed.as_marc())
+    with MappedMARCFile(filename) as marc_file:
+        assert len(marc_file) == 1
+        record = marc_file.get_record(many_records[0]["001"].value())
+        assert record["500"]["a"] == "Second copy"
+
+
+def test_empty_file(tmp_path):
+    filename = tmp_path / "empty.mrc"
+    filename.write_bytes(b"")
+    with MappedMARCFile(str(filename)) as marc_file:
+        assert len(marc_file) == 0
+        assert list(marc_file.iter_records()) == []
+
+
+def marc_files():
+    return [many_file] + [
+        os.path.join(parent_dir, file) for file in sorted(os.listdir(parent_dir))
+    ]
+
+
+@pytest.mark.parametrize("filename", marc_files())
+def test_scan_relationship_matches_pymarc(filename):
+    from src.get_parent_ids import get_parent_id, get_record_type
+    from src.xml_load_and_process import is_parent
+
+    scanned = list(iter_relationships(filename))
+    records = read_records(filename)
+    assert len(scanned) == len(records)
+    for (relationship, data), record in zip(scanned, records):
+        assert relationship == (
+            record["001"].value(),
+            get_parent_id(record),
+            get_record_type(record),
+            is_parent(record),
+        )
+        assert bytes(data) == record.as_marc()
+
+
+def make_field(tag, **subfields):
+    return pymarc.Field(
+        tag=tag,
+        indicators=[" ", " "],
+        subfields=[
+            pymarc.Subfield(code=code, value=value) for code, value in subfields.items()
+        ],
+    )
+
+
+@pytest.mark.parametrize(
+    "fields, expected",
+    [
+        ([], (None, None, False)),
+        ([make_field("950", a="x")], (None, None, False)),
+        (
+            [make_field("950", a="x", p="991"), make_field("950", p="992")],
+            ("991", None, False),
+        ),
+        (
+            [make_field("956", a="x"), make_field("956", b="PARENT")],
+            (None, None, True),
+        ),
+        (
+            [make_field("956", b="MANY", c="PARENT"), make_field("956", b="ONE")],
+            (None, "MANY", False),
+        ),
+        (
+            [make_field("956", b="PARENT"), make_field("950", p="993")],
+            ("993", "PARENT", True),
+        ),
+    ],
+)
+def test_scan_relationship_fields(fields, expected):
+    record = pymarc.Record()
+    record.add_field(pymarc.Field(tag="001", data="9912345607636"))
+    record.add_field(*fields)
+    relationship = scan_relationship(record.as_marc())
+    assert relationship.mms_id == "9912345607636"
+    assert relationship[1:] == expected
+
+
+@pytest.mark.parametrize("filename", marc_files())
+def test_lazy_record_matches_pymarc(filename):
+    for record in read_records(filename):
+        data = record.as_marc()
+        lazy = LazyRecord(data)
+        assert lazy.decoded_count() == 0
+        assert lazy.as_marc() == data
+        assert lazy["001"].value() == record["001"].value()
+        assert [str(f) for f in lazy.get_fields("245", "650")] == [
+            str(f) for f in record.get_fields("245", "650")
+        ]
+        assert lazy.decoded_count() == len(record.get_fields("001", "245", "650"))
+        assert [str(f) for f in lazy.fields] == [str(f) for f in record.fields]
+        assert lazy.as_marc() == data
+
+
+def test_lazy_record_cleanup_matches_pymarc(many_records):
+    from src.get_parent_ids import get_parent_id, many_record_cleanup
+
+    parents = {record["001"].value(): record for record in marc_parent_records()}
+    cleaned = 0
+    for record in many_records:
+        parent = parents.get(get_parent_id(record))
+        if parent is None:
+            continue
+        expected = many_record_cleanup(
+            pymarc.Record(record.as_marc()), pymarc.Record(parent.as_marc())
+        )
+        lazy = many_record_cleanup(
+            LazyRecord(record.as_marc()), LazyRecord(parent.as_marc())
+        )
+        assert isinstance(lazy, LazyRecord)
+        assert lazy.decoded_count() < len(lazy.fields)
+        assert lazy.as_marc() == expected.as_marc()
+        cleaned += 1
+    assert cleaned > 0
+
+
+def marc_parent_records():
+    records = []
+    for file in sorted(os.listdir(parent_dir)):
+        records.extend(read_records(os.path.join(parent_dir, file)))
+    return records
+
+
+@pytest.mark.parametrize(
+    "tags, expected",
+    [
+        (("500",), ["001", "245", "500", "650", "700"]),
+        (("100",), ["001", "100", "245", "650", "700"]),
+        (("999",), ["001", "245", "650", "700", "999"]),
+        (("001",), ["001", "001", "245", "650", "700"]),
+    ],
+)
+def test_lazy_record_add_ordered_field(tags, expected):
+    record = pymarc.Record()
+    record.add_field(pymarc.Field(tag="001", data="9912345607636"))
+    for tag in ["245", "650", "700"]:
+        record.add_field(make_field(tag, a=tag))
+    lazy = LazyRecord(record.as_marc())
+    for tag in tags:
+        field = pymarc.Field(tag="001", data="x") if tag == "001" else make_field(tag)
+        lazy.add_ordered_field(field)
+        record.add_ordered_field(field)
+    assert [f.tag for f in lazy.fields] == [f.tag for f in record.fields] == expected
+
+
+def test_lazy_record_remove_and_copy():
+    record = pymarc.Record()
+    record.add_field(pymarc.Field(tag="001", data="9912345607636"))
+    record.add_field(make_field("650", a="Subject"), make_field("655", a="Form"))
+    lazy = LazyRecord(record.as_marc())
+    copy = deepcopy(lazy)
+    lazy.remove_fields("650")
+    assert "650" not in lazy and "650" in copy
+    assert lazy.decoded_count() == 0
+    copy["655"]["a"] = "Changed"
+    assert lazy["655"]["a"] == "Form"
+    record.remove_fields("650")
+    assert lazy.as_marc() == record.as_marc()
+    assert copy.get("655")["a"] == "Changed"
+    assert copy.get("500") is None
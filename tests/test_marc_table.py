@@ -0,0 +1,122 @@
+import os
+import numpy as np
+import pymarc
+import pytest
+
+from src.marc_table import *
+
+"""Tests for scanning a MARC file into columnar record and field arrays."""
+
+ROOT_DIR = os.path.abspath(os.curdir)
+marc_data = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data")
+many_file = os.path.join(marc_data, "test_file_with_errors.mrc")
+parent_dir = os.path.join(marc_data, "parent")
+
+
+def read_records(filename):
+    with open(filename, "rb") as fh:
+        return [record for record in pymarc.MARCReader(fh)]
+
+
+def marc_files():
+    return [many_file] + [
+        os.path.join(parent_dir, file) for file in sorted(os.listdir(parent_dir))
+    ]
+
+
+@pytest.mark.parametrize("filename", marc_files())
+def test_scan_matches_pymarc(filename):
+    records = read_records(filename)
+    table = scan_marc_file(filename)
+    assert len(table) == len(records)
+    assert table.valid.all()
+    assert table.field_count == sum(len(record.fields) for record in records)
+    assert table.ids == [record["001"].value() for record in records]
+    for index, record in enumerate(records):
+        assert table.get(index) == record.as_marc()
+        fields = table.record_fields(index)
+        assert ["%03d" % table.field_tags[field] for field in fields] == [
+            field.tag for field in record.fields
+        ]
+        assert table.field_data(fields[-1]) == record.fields[-1].as_marc("utf-8")[:-1]
+
+
+def test_tag_counts():
+    records = read_records(many_file)
+    table = scan_marc_file(many_file)
+    assert list(table.tag_counts("650", "651")) == [
+        len(record.get_fields("650", "651")) for record in records
+    ]
+    assert table.ids_where(table.tag_counts("245") == 0) == []
+    assert table.ids_where(table.tag_counts("245") == 1) == table.ids
+    assert table.ids_where(table.tag_counts("999") > 0) == []
+
+
+def make_record(id, *tags):
+    record = pymarc.Record(force_utf8=True)
+    record.add_field(pymarc.Field(tag="001", data=id))
+    for tag in tags:
+        record.add_field(
+            pymarc.Field(
+                tag=tag,
+                indicators=[" ", " "],
+                subfields=[pymarc.Subfield(code="a", value=tag)],
+            )
+        )
+    return record.as_marc()
+
+
+def test_batch_questions():
+    data = b"".join(
+        [
+            make_record("991", "245", "260", "264"),
+            make_record("992", "245", "264"),
+            make_record("993", "264", "264"),
+            make_record("994", "100"),
+        ]
+    )
+    table = scan_marc_data(data)
+    assert table.ids_where(table.tag_counts("260", "264") >= 2) == ["991", "993"]
+    assert table.ids_where(table.tag_counts("245") == 0) == ["993", "994"]
+    assert list(table.record_field_counts) == [4, 3, 3, 2]
+
+
+def test_unreadable_records_are_marked():
+    first, second = make_record("991", "245"), make_record("992", "245")
+    bad_directory = bytearray(make_record("993", "245"))
+    bad_directory[LEADER_LENGTH + 3] = ord("x")
+    data = (
+        first
+        + b"garbage without a leader\x1d"
+        + bytes(bad_directory)
+        + second
+        + second[:40]
+    )
+    table = scan_marc_data(data)
+    assert list(table.valid) == [True, False, False, True, False]
+    assert table.ids == ["991", None, None, "992", None]
+    assert list(table.record_field_counts) == [2, 0, 0, 2, 0]
+    assert table.ids_where(table.tag_counts("245") == 1) == ["991", "992"]
+    assert table.get(3) == second
+
+
+def test_empty_file(tmp_path):
+    filename = tmp_path / "empty.mrc"
+    filename.write_bytes(b"")
+    table = scan_marc_file(str(filename))
+    assert len(table) == 0
+    assert table.field_count == 0
+    assert len(table.tag_counts("245")) == 0
+
+
+def test_non_numeric_tag():
+    record = pymarc.Record(force_utf8=True)
+    record.add_field(pymarc.Field(tag="001", data="991"))
+    record.add_field(
+        pymarc.Field(
+            tag="FMT", indicators=[" ", " "], subfields=[pymarc.Subfield("a", "x")]
+        )
+    )
+    table = scan_marc_data(record.as_marc())
+    assert list(table.field_tags) == [1, NON_NUMERIC_TAG]
+    assert table.field_tags.dtype == np.int16
@@ -0,0 +1,81 @@
+import os
+import pytest
+
+import src.api_call as api_call
+from src.fake_alma_api import load_corpus
+from src.parent_prefetch import *
+from src.shared_functions import get_missing_records
+
+"""Tests for prefetching parent records during the many record download."""
+
+ROOT_DIR = os.path.abspath(os.curdir)
+marc_data = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data")
+many_file = os.path.join(marc_data, "test_file_with_errors.mrc")
+parent_dir = os.path.join(marc_data, "parent")
+
+
+@pytest.fixture(scope="module")
+def fake_api_corpus():
+    return load_corpus([many_file, parent_dir])
+
+
+@pytest.fixture
+def corpus(fake_api_corpus):
+    return fake_api_corpus
+
+
+@pytest.fixture
+def fake_api(fake_api):
+    os.makedirs("many")
+    yield fake_api
+
+
+def test_parents_fetched_during_many_download(fake_api, corpus):
+    parent_ids = {file[7:-4] for file in os.listdir(parent_dir)}
+    many_ids = sorted(set(corpus) - parent_ids)
+    prefetcher = ParentPrefetcher("many", skip=many_ids, batch_size=5)
+    get_missing_records(
+        [], many_ids, "many", use_cache=False, on_records=prefetcher.on_records
+    )
+    written = prefetcher.finish()
+    assert sorted(written) == sorted(parent_ids)
+    assert prefetcher.failed == []
+    for id in parent_ids:
+        assert os.path.isfile(os.path.join("many", f"record_{id}.mrc"))
+
+
+def test_add_skips_seen_requested_and_on_disk(fake_api):
+    on_disk = os.path.join("many", "record_9933644453607636.mrc")
+    with open(on_disk, "wb"):
+        pass
+    prefetcher = ParentPrefetcher("many", skip=["9934338203607636"])
+    prefetcher.add(
+        ["9933644453607636", "9934338203607636", "9934559073607636", "9934559073607636"]
+    )
+    assert prefetcher.finish() == ["9934559073607636"]
+    assert os.path.getsize(on_disk) == 0
+    assert sorted(os.listdir("many")) == [
+        "record_9933644453607636.mrc",
+        "record_9934559073607636.mrc",
+    ]
+
+
+@pytest.mark.parametrize("refused", [True, False])
+def test_failed_requests_are_logged(
+    fake_api, monkeypatch, temp_quota_governor, caplog, refused
+):
+    parent_ids = ["9934559073607636", "9935092283607636"]
+    if refused:
+        # The quota governor refuses the prefetch's call.
+        temp_quota_governor.record_remaining(5)
+        monkeypatch.setattr(temp_quota_governor, "floor", 10)
+    else:
+        fake_api.error_rate = 1.0
+        monkeypatch.setattr(api_call, "get_retry_delay", lambda response, attempt: 0)
+    prefetcher = ParentPrefetcher("many")
+    prefetcher.add(parent_ids)
+    assert prefetcher.finish() == []
+    assert prefetcher.failed == parent_ids
+    assert os.listdir("many") == []
+    assert str(parent_ids) in caplog.text
+    assert (fake_api.stats()["requests"] == 0) == refused
@@ -0,0 +1,107 @@
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+
+from src.quota_governor import *
+
+"""Tests for the shared API quota governor."""
+
+
+@pytest.fixture
+def quota_path(tmp_path):
+    return str(tmp_path / "api_quota.sqlite")
+
+
+@pytest.mark.parametrize(
+    "id_count, passes, expected",
+    [(0, 1, 0), (1, 1, 1), (100, 1, 1), (101, 1, 2), (250, 2, 6)],
+)
+def test_estimate_calls(id_count, passes, expected):
+    assert estimate_calls(id_count, passes) == expected
+
+
+def test_unknown_quota_admits_job(quota_path):
+    governor = QuotaGovernor(quota_path, floor=100)
+    assert governor.available() is None
+    assert governor.reserve(1000)
+
+
+def test_reserve_respects_floor_and_other_jobs(quota_path):
+    governor = QuotaGovernor(quota_path, floor=100)
+    governor.record_remaining(200)
+    other_job = QuotaGovernor(quota_path, floor=100)
+    other_job.pid = -1  # simulate a second process
+    other_token = other_job.reserve(60)
+    assert other_token is not None
+    assert governor.available() == 40
+    assert governor.reserve(41) is None
+    assert governor.reserve(40) is not None
+    other_job.release(other_token)
+    assert governor.available() == 100
+
+
+def test_release_keeps_other_jobs_in_process(quota_path):
+    governor = QuotaGovernor(quota_path, floor=100, rate_limit=1000)
+    governor.record_remaining(200)
+    first = governor.reserve(50)
+    second = governor.reserve(50)
+    assert first != second
+    assert governor.reserve(1) is None
+    governor.release(first)
+    # The second job keeps its reservation, so only the first job's calls are freed.
+    assert governor.reserve(51) is None
+    assert governor.reserve(50) is not None
+    governor.release(None)
+
+
+def test_old_reservations_table_is_replaced(tmp_path):
+    import sqlite3
+
+    quota_path = str(tmp_path / "old_quota.sqlite")
+    conn = sqlite3.connect(quota_path)
+    conn.execute(
+        "CREATE TABLE reservations (pid INTEGER PRIMARY KEY, calls INTEGER NOT NULL, "
+        "created_at REAL NOT NULL)"
+    )
+    conn.commit()
+    conn.close()
+    governor = QuotaGovernor(quota_path, floor=0)
+    assert governor.reserve(10) is not None
+
+
+def test_acquire_uses_reservation_then_stops_at_floor(quota_path):
+    governor = QuotaGovernor(quota_path, floor=100, rate_limit=1000)
+    governor.record_remaining(102)
+    assert governor.reserve(1)
+    governor.acquire()  # reserved call
+    governor.acquire()  # unreserved, leaves 100
+    with pytest.raises(QuotaExceeded):
+        governor.acquire()
+
+
+def test_record_response_reads_header(quota_path):
+    class Response:
+        headers = {"X-Exl-Api-Remaining": "5000"}
+
+    governor = QuotaGovernor(quota_path, floor=1000)
+    governor.record_response(Response())
+    assert governor.available() == 4000
+
+
+def claim_calls(args):
+    path, count = args
+    governor = QuotaGovernor(path, floor=0, rate_limit=10000)
+    claimed = 0
+    for _ in range(count):
+        try:
+            governor.acquire()
+            claimed += 1
+        except QuotaExceeded:
+            pass
+    return claimed
+
+
+def test_processes_share_quota(quota_path):
+    QuotaGovernor(quota_path, floor=0).record_remaining(50)
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        claimed = list(executor.map(claim_calls, [(quota_path, 30)] * 4))
+    assert sum(claimed) == 50
@@ -0,0 +1,76 @@
+import os
+import pymarc
+import pytest
+
+from src.record_sinks import *
+from src.shared_functions import get_missing_records
+
+"""Tests for the record sinks used by get_missing_records."""
+
+ROOT_DIR = os.path.abspath(os.curdir)
+parent_dir = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data", "parent")
+record_file = os.path.join(parent_dir, "record_9933644453607636.mrc")
+
+
+@pytest.fixture
+def record():
+    with open(record_file, "rb") as fh:
+        return next(pymarc.MARCReader(fh))
+
+
+def test_directory_sink_destinations(record, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    sink = DirectorySink(
+        str(tmp_path / "a"),
+        {"9933644453607636": [str(tmp_path / "a"), str(tmp_path / "b")]},
+    )
+    files = sink.write(record)
+    assert files == [
+        str(tmp_path / "a" / "record_9933644453607636.mrc"),
+        str(tmp_path / "b" / "record_9933644453607636.mrc"),
+    ]
+    with open(record_file, "rb") as fh:
+        assert (
+            tmp_path / "b" / "record_9933644453607636.mrc"
+        ).read_bytes() == fh.read()
+
+
+def test_marc_file_sink_appends(record, tmp_path):
+    sink = MarcFileSink(str(tmp_path / "merged.mrc"))
+    sink.write(record)
+    sink.write(record)
+    sink.close()
+    with open(tmp_path / "merged.mrc", "rb") as fh:
+        assert len(list(pymarc.MARCReader(fh))) == 2
+
+
+def test_get_missing_records_to_memory(fake_api):
+    api = fake_api
+    sink = MemorySink()
+    retrieved = get_missing_records(
+        [], sorted(api.corpus), "unused", use_cache=False, sink=sink
+    )
+    assert retrieved == [record["001"].value() for record in sink.records]
+    assert sorted(retrieved) == sorted(api.corpus)
+    # Nothing written to disk and no intermediate xml file.
+    assert not os.path.exists("unused")
+    assert not os.path.exists(os.path.join("output", "xml", "records_retrieved.xml"))
+
+
+def test_cache_hits_go_to_sink(fake_api, record):
+    from src.bib_cache import BibCache
+
+    api = fake_api
+    cached_id = record["001"].value()
+    BibCache().put(cached_id, record.as_marc())
+    sink = MemorySink()
+    seen = []
+    retrieved = get_missing_records(
+        [], sorted(api.corpus), "unused", sink=sink, on_records=seen.extend
+    )
+    assert cached_id not in retrieved
+    ids = [sunk["001"].value() for sunk in sink.records]
+    assert sorted(ids) == sorted(api.corpus)
+    assert sorted(r["001"].value() for r in seen) == sorted(api.corpus)
+    assert not os.path.exists("unused")
@@ -0,0 +1,231 @@
+import os
+import pymarc
+import pytest
+
+from src.get_parent_ids import get_id_dictionary
+from src.record_store import *
+from src.shared_functions import (
+    get_missing_records,
+    merge_marc_records,
+    split_marc_records,
+)
+
+"""Tests for the single file record store used in place of one file per record."""
+
+ROOT_DIR = os.path.abspath(os.curdir)
+marc_data = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data")
+many_file = os.path.join(marc_data, "test_file_with_errors.mrc")
+parent_dir = os.path.join(marc_data, "parent")
+
+
+def load_records():
+    records = {}
+    for file in sorted(os.listdir(parent_dir)):
+        with open(os.path.join(parent_dir, file), "rb") as fh:
+            data = fh.read()
+        records[pymarc.Record(data)["001"].value()] = data
+    return records
+
+
+@pytest.fixture
+def records():
+    return load_records()
+
+
+@pytest.fixture(autouse=True)
+def shared_stores():
+    yield
+    close_stores()
+
+
+def test_put_and_get(records, tmp_path):
+    with RecordStore(str(tmp_path)) as store:
+        store.put_many(records)
+        assert len(store) == len(records)
+        for id, data in records.items():
+            assert id in store
+            assert store.get(id) == data
+        assert store.get("9900000000007636") is None
+        ids = list(records)[:3] + ["9900000000007636"]
+        assert store.get_many(ids) == {id: records[id] for id in ids[:3]}
+        assert store.get_record(ids[0])["001"].value() == ids[0]
+
+
+def test_data_file_is_marc(records, tmp_path):
+    with RecordStore(str(tmp_path)) as store:
+        store.put_many(records)
+    with open(tmp_path / "records.mrc", "rb") as fh:
+        ids = [record["001"].value() for record in pymarc.MARCReader(fh)]
+    assert ids == list(records)
+
+
+def test_reopen(records, tmp_path):
+    with RecordStore(str(tmp_path)) as store:
+        store.put_many(records)
+    with RecordStore(str(tmp_path)) as store:
+        assert store.ids() == list(records)
+        assert [id for id, data in store.iter_raw()] == list(records)
+
+
+def test_put_replaces_record(records, tmp_path):
+    first, second = list(records)[:2]
+    with RecordStore(str(tmp_path)) as store:
+        store.put_many(records)
+        store.put(first, records[second])
+        assert store.get(first) == records[second]
+        assert len(store) == len(records)
+        assert [id for id, data in store.iter_raw()][-1] == first
+        output = tmp_path / "merged.mrc"
+        with open(output, "wb") as fh:
+            assert store.write_to(fh) == len(records)
+    with open(output, "rb") as fh:
+        assert len(list(pymarc.MARCReader(fh))) == len(records)
+    with RecordStore(str(tmp_path)) as store:
+        assert store.get(first) == records[second]
+
+
+@pytest.mark.parametrize("remove_index", [True, False])
+def test_recovers_unindexed_records(records, tmp_path, remove_index):
+    with RecordStore(str(tmp_path)) as store:
+        store.put_many(records)
+    index_file = tmp_path / "records.idx"
+    if remove_index:
+        index_file.unlink()
+    else:
+        lines = index_file.read_text(encoding="utf-8").splitlines(keepends=True)
+        index_file.write_text("".join(lines[:4]), encoding="utf-8")
+    with RecordStore(str(tmp_path)) as store:
+        assert store.ids() == list(records)
+    with RecordStore(str(tmp_path)) as store:
+        assert store.ids() == list(records)
+
+
+def test_removes_truncated_record(records, tmp_path):
+    with RecordStore(str(tmp_path)) as store:
+        store.put_many(records)
+        size = store.size
+    last = list(records)[-1]
+    with open(tmp_path / "records.mrc", "r+b") as fh:
+        fh.truncate(size - 10)
+    with RecordStore(str(tmp_path)) as store:
+        assert last not in store
+        assert len(store) == len(records) - 1
+        assert store.size == size - len(records[last])
+        store.put(last, records[last])
+    with RecordStore(str(tmp_path)) as store:
+        assert store.get(last) == records[last]
+
+
+def test_directory_without_store(records, tmp_path):
+    directory = str(tmp_path / "parent")
+    os.makedirs(directory)
+    id = list(records)[0]
+    assert open_store(directory) is None
+    assert write_record(directory, id, records[id]) == os.path.join(
+        directory, f"record_{id}.mrc"
+    )
+    assert has_record(directory, id)
+    assert read_record_data(directory, id) == records[id]
+    assert get_directory_ids(directory) == {id}
+
+
+def test_directory_with_store(records, tmp_path):
+    directory = str(tmp_path / "parent")
+    os.makedirs(directory)
+    ids = list(records)
+    write_record(directory, ids[0], records[ids[0]])
+    store = open_store(directory, create=True)
+    assert open_store(directory) is store
+    for id in ids[1:]:
+        assert write_record(directory, id, records[id]) == store.data_path
+    assert sorted(os.listdir(directory)) == [
+        f"record_{ids[0]}.mrc",
+        "records.idx",
+        "records.mrc",
+    ]
+    assert get_directory_ids(directory) == set(ids)
+    assert count_directory_records(directory) == len(ids)
+    assert get_directory_record(directory, ids[0])["001"].value() == ids[0]
+    assert get_directory_record(directory, ids[1])["001"].value() == ids[1]
+    assert get_directory_record(directory, "9900000000007636") is None
+    assert sorted(
+        record["001"].value() for record in iter_directory_records(directory)
+    ) == sorted(ids)
+    assert get_marc_files(directory) == [
+        store.data_path,
+        os.path.join(directory, f"record_{ids[0]}.mrc"),
+    ]
+
+
+def test_merge_marc_records_with_store(records, tmp_path):
+    directory = str(tmp_path / "many")
+    ids = list(records)
+    os.makedirs(directory)
+    write_record(directory, ids[0], records[ids[0]])
+    open_store(directory, create=True).put_many({id: records[id] for id in ids[1:]})
+    merge_file = str(tmp_path / "merged.mrc")
+    merge_marc_records(directory, merge_file)
+    with open(merge_file, "rb") as fh:
+        merged = [record["001"].value() for record in pymarc.MARCReader(fh)]
+    assert merged == ids[1:] + ids[:1]
+
+
+def test_split_marc_records_with_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    many_path = os.path.join("output", "mrc", "split", "many")
+    parent_path = os.path.join("output", "mrc", "split", "parent")
+    store = open_store(many_path, create=True)
+    open_store(parent_path, create=True)
+    identifiers = split_marc_records(many_file)
+    assert sorted(os.listdir(many_path)) == ["records.idx", "records.mrc"]
+    assert store.ids() == identifiers["many_records"]
+    store_file = [os.path.join(many_path, "records.mrc")]
+    assert get_id_dictionary(store_file) == get_id_dictionary([many_file])
+
+
+def test_input_file_named_like_store(tmp_path, monkeypatch):
+    # A user's input file called records.mrc, with a repeated record and trailing bytes.
+    monkeypatch.chdir(tmp_path)
+    input_path = os.path.join("input", "load", "mrc")
+    os.makedirs(input_path)
+    input_file = os.path.join(input_path, "records.mrc")
+    with open(many_file, "rb") as fh:
+        data = fh.read()
+    first = data[: int(data[:5])]
+    data = first + data + b"\n"
+    with open(input_file, "wb") as fh:
+        fh.write(data)
+    assert open_store(input_path) is None
+    assert not is_store_file(input_file)
+    assert get_record_files(input_path) == [input_file]
+    identifiers = split_marc_records(input_file, write_records=False)
+    expected = split_marc_records(many_file, write_records=False)
+    repeated = pymarc.Record(first)["001"].value()
+    assert identifiers["many_records"] == [repeated] + expected["many_records"]
+    assert os.listdir(input_path) == ["records.mrc"]
+    with open(input_file, "rb") as fh:
+        assert fh.read() == data
+
+
+def test_implicit_store_not_truncated(records, tmp_path):
+    directory = str(tmp_path)
+    with RecordStore(directory) as store:
+        store.put_many(records)
+        size = store.size
+    with open(tmp_path / "records.mrc", "ab") as fh:
+        fh.write(b"00100")
+    store = open_store(directory)
+    assert store.ids() == list(records)
+    assert os.path.getsize(tmp_path / "records.mrc") == size + 5
+    with open(tmp_path / "merged.mrc", "wb") as output:
+        assert store.write_to(output) == len(records)
+    assert os.path.getsize(tmp_path / "merged.mrc") == size
+
+
+def test_get_missing_records_into_store(fake_api, records):
+    store = open_store("parent", create=True)
+    retrieved = get_missing_records([], list(records), "parent", use_cache=False)
+    assert sorted(retrieved) == sorted(records)
+    assert sorted(os.listdir("parent")) == ["records.idx", "records.mrc"]
+    for id, data in records.items():
+        assert pymarc.Record(store.get(id)).as_marc() == pymarc.Record(data).as_marc()
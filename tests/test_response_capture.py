@@ -0,0 +1,77 @@
+import os
+import pytest
+
+import src.api_call as api_call
+import src.response_capture as response_capture
+from src.response_capture import *
+from src.shared_functions import get_missing_records
+
+"""Tests for recording API responses and replaying them without a network."""
+
+
+@pytest.fixture
+def workspace(monkeypatch, tmp_path):
+    monkeypatch.setattr(response_capture, "CAPTURE_DIR", str(tmp_path / "capture"))
+    monkeypatch.setattr(api_call, "KEY", "test_key_value")
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join("output", "xml"), exist_ok=True)
+    return tmp_path
+
+
+bibs = "https://a/almaws/v1/bibs/"
+
+
+@pytest.mark.parametrize(
+    "first, second, same",
+    [
+        (
+            ("GET", bibs, {"mms_id": "1", "view": "full"}),
+            ("GET", "http://b/almaws/v1/bibs/", {"mms_id": "1"}),
+            True,
+        ),
+        (
+            ("GET", bibs, {"mms_id": "1", "view": "brief"}),
+            ("GET", bibs, {"mms_id": "1"}),
+            False,
+        ),
+        (("GET", bibs, {"mms_id": "1"}), ("GET", bibs, {"mms_id": "2"}), False),
+        (("PUT", bibs + "1", None), ("GET", bibs + "1", None), False),
+    ],
+)
+def test_capture_key(first, second, same):
+    assert (capture_key(*first) == capture_key(*second)) == same
+
+
+def test_record_then_replay(fake_api, workspace, monkeypatch):
+    api = fake_api
+    request_ids = sorted(api.corpus)
+    os.makedirs("recorded")
+    os.makedirs("replayed")
+
+    monkeypatch.setattr(response_capture, "CAPTURE_MODE", "record")
+    recorded = get_missing_records([], request_ids, "recorded")
+    requests_sent = api.stats()["requests"]
+    assert len(os.listdir(workspace / "capture")) == requests_sent
+
+    # The cache is bypassed, so the recorded chunks are requested again.
+    monkeypatch.setattr(response_capture, "CAPTURE_MODE", "replay")
+    monkeypatch.setattr(api_call, "KEY", None)
+    replayed = get_missing_records([], request_ids, "replayed", incremental=True)
+    assert replayed == recorded
+    assert api.stats()["requests"] == requests_sent
+    for id in request_ids:
+        with open(os.path.join("recorded", f"record_{id}.mrc"), "rb") as a:
+            with open(os.path.join("replayed", f"record_{id}.mrc"), "rb") as b:
+                assert a.read() == b.read()
+
+
+def test_replay_key(monkeypatch):
+    monkeypatch.setattr(api_call, "KEY", None)
+    assert api_call.get_api_key() is None
+    monkeypatch.setattr(response_capture, "CAPTURE_MODE", "replay")
+    assert api_call.get_api_key() == "replay"
+
+
+def test_replay_missing(workspace):
+    with pytest.raises(CaptureMissing):
+        replay_response("GET", "https://a/almaws/v1/bibs/", {"mms_id": "1"})
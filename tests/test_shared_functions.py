@@ -1,4 +1,7 @@
+import json
 import os
+import pytest
+from datetime import datetime, timezone
 from src.shared_functions import *
 
 """Tests for shared functions.
@@ -116,3 +119,198 @@ def test_get_list_error_ids(get_validation_report):
     assert len(ids) == 386
     assert "9939647904007636" in ids
     assert "9939662982307636" in ids
+
+
+# Test remove_unchanged_records()
+def set_fetched_at(cache, mms_ids, timestamp):
+    import sqlite3
+
+    with sqlite3.connect(cache.path) as conn:
+        conn.executemany(
+            "UPDATE bibs SET fetched_at = ? WHERE mms_id = ?",
+            [(timestamp, mms_id) for mms_id in mms_ids],
+        )
+    conn.close()
+
+
+FETCHED_AT = datetime(2023, 10, 20, 9, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.mark.parametrize(
+    "modified, expected",
+    [
+        ("2023-10-19Z", False),
+        ("2023-10-20Z", True),  # edited later on the day it was fetched
+        ("2024-01-01Z", True),
+        (None, True),
+        ("unknown", True),
+    ],
+)
+def test_is_modified_since(modified, expected):
+    assert is_modified_since(modified, FETCHED_AT) == expected
+
+
+def test_remove_unchanged_records(monkeypatch, tmp_path):
+    import src.shared_functions as shared_functions
+    from src.bib_cache import BibCache
+
+    class BriefResponse:
+        status_code = 200
+
+        def json(self):
+            return {
+                "bib": [
+                    {"mms_id": "9938036653607636", "last_modified_date": "2023-10-19Z"},
+                    {"mms_id": "9938036613607636", "last_modified_date": "2023-10-20Z"},
+                ]
+            }
+
+    requested = []
+
+    def fake_fetch_bibs(request_dict, max_workers, view):
+        requested.extend(",".join(request_dict.values()).split(","))
+        assert view == "brief"
+        yield "0", BriefResponse()
+
+    monkeypatch.setattr(shared_functions, "fetch_bibs", fake_fetch_bibs)
+    cache = BibCache(str(tmp_path / "cache.sqlite"))
+    cache.put("9938036653607636", b"unchanged", "2023-10-19Z")
+    cache.put("9938036613607636", b"changed", "2023-10-19Z")
+    set_fetched_at(cache, ["9938036653607636", "9938036613607636"], FETCHED_AT)
+    request_ids = ["9938036653607636", "9938036613607636", "9938164143607636"]
+    remaining = remove_unchanged_records(cache, request_ids)
+    assert remaining == ["9938036613607636", "9938164143607636"]
+    assert sorted(requested) == ["9938036613607636", "9938036653607636"]
+    assert cache.get_fetched(["9938036653607636"])["9938036653607636"] > FETCHED_AT
+
+
+# Test get_missing_records() with a failed chunk
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = json.dumps(body).encode("utf-8")
+
+    def json(self):
+        return json.loads(self.body)
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start : start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def test_get_missing_records_failed_chunk(monkeypatch, tmp_path):
+    import src.api_call as api_call
+    import src.shared_functions as shared_functions
+    from src.fake_alma_api import FakeAlmaAPI, error_body, load_corpus
+    from src.fetch_journal import FetchJournal
+
+    parent_dir = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data", "parent")
+    api = FakeAlmaAPI(load_corpus([parent_dir]))
+    request_ids = sorted(api.corpus)
+    good, bad, truncated = request_ids[:2], request_ids[2:4], request_ids[4:6]
+
+    def fake_get_bibs(part, ids, view="full", on_response=None, stream=False):
+        assert stream
+        if ids == ",".join(bad):
+            return FakeResponse(500, error_body("GENERAL_ERROR", "Failed"))
+        response = FakeResponse(200, api.get_bibs({"mms_id": [ids]}, 1.0))
+        if ids == ",".join(truncated):
+            # The connection drops part way through the chunk.
+            response.body = response.body[: response.body.index(b'"mms_id"', 100)]
+        return response
+
+    monkeypatch.setattr(api_call, "get_bibs", fake_get_bibs)
+    monkeypatch.setattr(shared_functions, "check_api_key", lambda: True)
+    monkeypatch.setattr(
+        shared_functions,
+        "chunk_identifiers",
+        lambda ids: {"0": ",".join(good), "1": ",".join(bad), "2": ",".join(truncated)},
+    )
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("output_dir")
+    retrieved = get_missing_records(
+        [], good + bad + truncated, "output_dir", use_cache=False
+    )
+    assert retrieved[:2] == good
+    journal = FetchJournal("output_dir")
+    assert os.path.exists(journal.path)
+    assert journal.completed_ids() == set(good)
+
+
+def test_get_missing_records_incremental(monkeypatch, tmp_path):
+    import src.api_call as api_call
+    import src.shared_functions as shared_functions
+    from src.bib_cache import BibCache
+    from src.fake_alma_api import FakeAlmaAPI, load_corpus
+
+    parent_dir = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data", "parent")
+    api = FakeAlmaAPI(load_corpus([parent_dir]))
+    request_ids = sorted(api.corpus)[:4]
+    for id in request_ids:
+        api.corpus[id]["last_modified_date"] = "2023-10-19Z"
+    api.corpus[request_ids[1]]["last_modified_date"] = "2023-10-20Z"
+    full_requests = []
+
+    def fake_get_bibs(part, ids, view="full", on_response=None, stream=False):
+        if view == "full":
+            full_requests.extend(ids.split(","))
+        body = api.get_bibs({"mms_id": [ids], "view": [view]}, 1.0)
+        return FakeResponse(200, body)
+
+    monkeypatch.setattr(api_call, "get_bibs", fake_get_bibs)
+    monkeypatch.setattr(shared_functions, "check_api_key", lambda: True)
+    monkeypatch.chdir(tmp_path)
+    cache = BibCache()
+    for id in request_ids[:3]:
+        with open(os.path.join(parent_dir, f"record_{id}.mrc"), "rb") as f:
+            cache.put(id, f.read())
+    set_fetched_at(cache, request_ids[:3], FETCHED_AT)
+    os.makedirs("output_dir")
+    retrieved = get_missing_records([], request_ids, "output_dir", incremental=True)
+    # Changed on the fetch day, and not cached, are downloaded.
+    assert (
+        sorted(full_requests)
+        == sorted(retrieved)
+        == [
+            request_ids[1],
+            request_ids[3],
+        ]
+    )
+    # Unchanged records are written from the cache, so none are missing.
+    assert sorted(os.listdir("output_dir")) == [
+        f"record_{id}.mrc" for id in request_ids
+    ]
+
+
+# Test iter_ids_from_file()
+def test_iter_ids_from_file():
+    directory = os.path.join(ROOT_DIR, "tests", "test_data", "api_call")
+    ids = iter_ids_from_file(directory, ["mms_ids_493.txt"])
+    assert next(ids).startswith("99")
+    assert len(get_ids_from_file(directory, ["mms_ids_493.txt"])) == 493
+
+
+# Checks that ids split between chunks are read whole, whatever the chunk size.
+@pytest.mark.parametrize("chunk_size", [1, 7, 16, 17, 1000, 1000000])
+def test_iter_ids_from_text_chunks(chunk_size):
+    import io
+
+    file = os.path.join(ROOT_DIR, "tests", "test_data", "api_call", "mms_ids_493.txt")
+    with open(file, "r") as f:
+        text = f.read()
+    expected = MMS_ID_PATTERN.findall(text)
+    assert len(expected) == 493
+    assert list(iter_ids_from_text(io.StringIO(text), chunk_size)) == expected
+    with_noise = "mms_id\n" + text.replace(",", ", x ") + "\n99123"
+    assert list(iter_ids_from_text(io.StringIO(with_noise), chunk_size)) == expected
+
+
+def test_split_marc_records_without_writing(temp_marc_file, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_directories()
+    identifiers = split_marc_records(temp_marc_file, write_records=False)
+    assert len(identifiers["many_records"]) == 17
+    assert os.listdir(os.path.join("output", "mrc", "split", "many")) == []
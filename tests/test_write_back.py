@@ -0,0 +1,81 @@
+import os
+import pymarc
+import pytest
+
+from src.write_back import *
+
+"""Tests for writing updated records back to Alma against the local API stand-in."""
+
+ROOT_DIR = os.path.abspath(os.curdir)
+parent_dir = os.path.join(ROOT_DIR, "tests", "test_data", "marc_data", "parent")
+
+
+@pytest.fixture
+def updated_file(tmp_path):
+    """A MARC file of the parent records with an added 500, plus one unknown record."""
+    marc_file = str(tmp_path / "updated_records.mrc")
+    with open(marc_file, "wb") as out:
+        for file in sorted(os.listdir(parent_dir)):
+            with open(os.path.join(parent_dir, file), "rb") as fh:
+                for record in pymarc.MARCReader(fh):
+                    record.add_ordered_field(
+                        pymarc.Field(
+                            tag="500",
+                            indicators=[" ", " "],
+                            subfields=[pymarc.Subfield(code="a", value="Updated.")],
+                        )
+                    )
+                    out.write(record.as_marc())
+        record.get_fields("001")[0].data = "9900000000007636"
+        out.write(record.as_marc())
+    return marc_file
+
+
+def test_write_back_file(fake_api, updated_file):
+    assert count_records(updated_file) == 18
+    results = write_back_file(updated_file, max_workers=3)
+    assert len(results["updated"]) == 17
+    assert results["failed"] == ["9900000000007636"]
+    assert sorted(fake_api.updated) == sorted(results["updated"])
+    assert "Updated." in fake_api.corpus["9933644453607636"]["anies"][0]
+    with open(os.path.splitext(updated_file)[0] + "_write_back.csv") as report:
+        lines = report.read().splitlines()
+    assert len(lines) == 19
+    assert lines[-1].startswith("9900000000007636,failed,400,")
+
+
+def test_write_back_reports_errors(fake_api, updated_file, monkeypatch):
+    import src.write_back as write_back
+
+    put_bib = write_back.put_bib
+
+    def failing_put_bib(record):
+        if record["001"].value() == "9933644453607636":
+            raise requests.exceptions.InvalidURL("bad url")
+        return put_bib(record)
+
+    monkeypatch.setattr(write_back, "put_bib", failing_put_bib)
+    results = write_back_file(updated_file, max_workers=3)
+    assert len(results["updated"]) == 16
+    assert sorted(results["failed"]) == ["9900000000007636", "9933644453607636"]
+    with open(os.path.splitext(updated_file)[0] + "_write_back.csv") as report:
+        lines = report.read().splitlines()
+    assert "9933644453607636,failed,,InvalidURL: bad url" in lines
+
+
+def test_write_back_stops_at_quota_floor(fake_api, updated_file, temp_quota_governor):
+    fake_api.remaining = temp_quota_governor.floor + 5
+    temp_quota_governor.record_remaining(fake_api.remaining)
+    with open(updated_file, "rb") as fh:
+        results = write_back_records(pymarc.MARCReader(fh), max_workers=1)
+    assert len(results["updated"]) == 5
+    assert len(results["not_sent"]) == 13
+
+
+def test_write_back_filter(fake_api, updated_file):
+    results = write_back_file(
+        updated_file,
+        record_filter=lambda record: record["001"].value() != "9900000000007636",
+    )
+    assert results["failed"] == []
+    assert len(results["updated"]) == 17
@@ -525,3 +525,35 @@ def test_check_fields(single_record, input_a, input_b, input_c, expected):
         input_c,
     )
     assert outcome == expected
+
+
+@pytest.mark.parametrize("input_file", input_files)
+def test_iter_marcxml_records_matches_pymarc(input_file):
+    expected = pymarc.parse_xml_to_array(input_file)
+    records = list(iter_marcxml_records(input_file))
+    assert [record.as_marc() for record in records] == [
+        record.as_marc() for record in expected
+    ]
+
+
+def test_iter_marcxml_records_collection(tmp_path):
+    records = [
+        "<record><leader>00000nam a2200000 i 4500</leader>"
+        f'<controlfield tag="001">99{i}</controlfield>'
+        '<datafield tag="245" ind1="1" ind2="0"><subfield code="a">Title</subfield>'
+        "<!-- comment --></datafield></record>"
+        for i in range(3)
+    ]
+    xml_file = tmp_path / "collection.xml"
+    xml_file.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<collection xmlns="http://www.loc.gov/MARC21/slim">'
+        + "".join(records)
+        + "</collection>",
+        encoding="utf-8",
+    )
+    output = list(iter_marcxml_records(str(xml_file)))
+    assert [record["001"].value() for record in output] == ["990", "991", "992"]
+    assert output[0]["245"].indicators == ["1", "0"]
+    assert output[0]["245"]["a"] == "Title"
+    assert output[0].leader == "00000nam a2200000 i 4500"
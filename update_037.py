@@ -8,6 +8,10 @@ from src.xml_load_and_process import *
 from src.get_parent_ids import *
 from src.transform_marc_file import *
 from src.api_call import *
+from src.bulk_export import get_records_with_export
+from src.fetch_planner import get_planned_records
+from src.record_store import get_directory_record, get_marc_files
+from src.write_back import write_back_file
 
 formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
@@ -70,6 +74,8 @@ other_exceptions = os.path.join(merge_path, "other_exceptions.mrc")
 # cleanup directories for temporary files
 if downloaded_records:
     print("Not clearing directory, working with downloaded records.")
+elif resume_unfinished_download():
+    print("Not clearing directory, resuming unfinished download.")
 else:
     clear_temporary_files()
 
@@ -97,14 +103,14 @@ else:
     if len(identifiers) > 0:
         if check_api_key():
             try:
-                get_missing_records([], identifiers, output_dir_many)
+                get_records_with_export(identifiers, output_dir_many)
             except Exception as e:
                 print(f"Error retrieving bibs: {e}")
                 logger.error(f"Error retrieving bibs: {e}")
 
 
 # Get PARENT records from API
-record_files = get_callable_files(output_dir_many)
+record_files = get_marc_files(output_dir_many)
 parent_id_dict = get_id_dictionary(record_files)
 logger.info(parent_id_dict)
 
@@ -117,7 +123,7 @@ if downloaded_records:
 else:
     if check_api_key():
         try:
-            get_missing_records([], unique_parents, output_dir_parent)
+            get_planned_records([(unique_parents, output_dir_parent)])
         except Exception as e:
             print(f"Error retrieving bibs: {e}")
             logger.error(f"Error retrieving bibs: {e}")
@@ -152,129 +158,121 @@ list_already_present = []
 # Iterate through parent dictionary
 for key in unique_parents:
     if key.startswith("99"):
-        parent_filename = f"record_{key}.mrc"
-        with open(os.path.join(output_dir_parent, parent_filename), "rb") as pf:
-            p_reader = pymarc.MARCReader(pf)
-            for parent_rec in p_reader:
-                parent_written = False
-                try:
-                    p_title = normalise_title(parent_rec.title)
-                except Exception as e:
-                    p_title = None
-                manys = parent_id_dict.get(key)
-                for many in manys:
-                    has_exception = False
-                    match_parent = False
-                    filename = f"record_{many}.mrc"
-                    # Get the file label from the dataframe
-                    file_label = df.loc[df["mms_id"] == many, "file_label"].values[0]
-                    new_label = subfield_is_in_record(
-                        parent_rec, file_label, "037", "a"
-                    )
-                    if new_label is None:
-                        parent_accession = parent_rec.get_fields("037")
-                        if len(parent_accession) == 0:
-                            first_record = "No 037"
-                        else:
-                            first_record = parent_accession[0].get("a")
+        parent_rec = get_directory_record(output_dir_parent, key)
+        if parent_rec is None:
+            logger.error(f"Parent record {key} not found in {output_dir_parent}.")
+            continue
+        parent_written = False
+        try:
+            p_title = normalise_title(parent_rec.title)
+        except Exception as e:
+            p_title = None
+        manys = parent_id_dict.get(key)
+        for many in manys:
+            has_exception = False
+            match_parent = False
+            # Get the file label from the dataframe
+            file_label = df.loc[df["mms_id"] == many, "file_label"].values[0]
+            new_label = subfield_is_in_record(parent_rec, file_label, "037", "a")
+            if new_label is None:
+                parent_accession = parent_rec.get_fields("037")
+                if len(parent_accession) == 0:
+                    first_record = "No 037"
+                else:
+                    first_record = parent_accession[0].get("a")
+                logger.info(
+                    f"File label match failed - MANY: {many}, "
+                    f"file_label: {file_label}, "
+                    f"parent_id: {parent_rec['001'].value()}, "
+                    f"num_037: {len(parent_accession)}, "
+                    f"data: {first_record}"
+                )
+            else:
+                match_parent = True
+            record = get_directory_record(output_dir_many, many)
+            if record is None:
+                logger.error(f"MANY record {many} not found in {output_dir_many}.")
+                continue
+            try:
+                w_title = normalise_title(record["950"]["l"])
+                if p_title is not None and w_title != p_title:
+                    if record["245"]["a"] not in list_name_not_match:
+                        list_name_not_match.append(record["950"]["l"])
+                        logger_2.debug(
+                            f"Failed title match: MANY 950$l {record['950']['l']} PARENT {parent_rec['245']['a']}"
+                        )
+            except Exception as e:
+                w_title = None
+
+            wr = deepcopy(record)
+            try:
+                fix_record = many_record_cleanup(wr, parent_rec)
+                has_exception = check_fields(
+                    fix_record,
+                    ("100", "110", "111", "130"),
+                    ("700", "710", "711", "720", "730"),
+                )
+            except Exception as e:
+                has_exception = True
+                logger.error(f"Error while cleaning MANY record {str(many)} : {e}")
+            if match_parent:
+                # check for existing 037
+                if len(record.get_fields("037")) > 0:
+                    for identifier in record.get_fields("037"):
+                        if identifier.get("a") == new_label:
+                            list_already_present.append((many, file_label, identifier))
+                        list_has_037.append(
+                            (
+                                record["001"].value(),
+                                file_label,
+                                identifier,
+                            )
+                        )
                         logger.info(
-                            f"File label match failed - MANY: {many}, "
-                            f"file_label: {file_label}, "
-                            f"parent_id: {parent_rec['001'].value()}, "
-                            f"num_037: {len(parent_accession)}, "
-                            f"data: {first_record}"
+                            f"Record {record['001'].value()} has existing 037: {identifier}. Will not apply file label {file_label}"
+                        )
+                        has_exception = True
+                else:
+                    identifier_subfield = pymarc.Subfield(code="a", value=new_label)
+                    field_037 = pymarc.Field(
+                        tag="037",
+                        indicators=["\\", "\\"],
+                        subfields=[
+                            identifier_subfield,
+                            pymarc.Subfield(
+                                code="b",
+                                value="State Library of Victoria",
+                            ),
+                        ],
+                    )
+                    fix_record.add_ordered_field(field_037)
+                    list_match.append(
+                        (
+                            record["001"].value(),
+                            file_label,
+                            parent_rec["001"].value(),
                         )
-                    else:
-                        match_parent = True
-                    with open(os.path.join(output_dir_many, filename), "rb") as fh:
-                        reader = pymarc.MARCReader(fh)
-                        for record in reader:
-                            try:
-                                w_title = normalise_title(record["950"]["l"])
-                                if p_title is not None and w_title != p_title:
-                                    if record["245"]["a"] not in list_name_not_match:
-                                        list_name_not_match.append(record["950"]["l"])
-                                        logger_2.debug(
-                                            f"Failed title match: MANY 950$l {record['950']['l']} PARENT {parent_rec['245']['a']}"
-                                        )
-                            except Exception as e:
-                                w_title = None
-
-                            wr = deepcopy(record)
-                            try:
-                                fix_record = many_record_cleanup(wr, parent_rec)
-                                has_exception = check_fields(
-                                    fix_record,
-                                    ("100", "110", "111", "130"),
-                                    ("700", "710", "711", "720", "730"),
-                                )
-                            except Exception as e:
-                                has_exception = True
-                                logger.error(
-                                    f"Error while cleaning MANY record {str(many)} : {e}"
-                                )
-                            if match_parent:
-                                # check for existing 037
-                                if len(record.get_fields("037")) > 0:
-                                    for identifier in record.get_fields("037"):
-                                        if identifier.get("a") == new_label:
-                                            list_already_present.append(
-                                                (many, file_label, identifier)
-                                            )
-                                        list_has_037.append(
-                                            (
-                                                record["001"].value(),
-                                                file_label,
-                                                identifier,
-                                            )
-                                        )
-                                        logger.info(
-                                            f"Record {record['001'].value()} has existing 037: {identifier}. Will not apply file label {file_label}"
-                                        )
-                                        has_exception = True
-                                else:
-                                    identifier_subfield = pymarc.Subfield(
-                                        code="a", value=new_label
-                                    )
-                                    field_037 = pymarc.Field(
-                                        tag="037",
-                                        indicators=["\\", "\\"],
-                                        subfields=[
-                                            identifier_subfield,
-                                            pymarc.Subfield(
-                                                code="b",
-                                                value="State Library of Victoria",
-                                            ),
-                                        ],
-                                    )
-                                    fix_record.add_ordered_field(field_037)
-                                    list_match.append(
-                                        (
-                                            record["001"].value(),
-                                            file_label,
-                                            parent_rec["001"].value(),
-                                        )
-                                    )
-                            else:
-                                list_not_match.append(
-                                    (
-                                        record["001"].value(),
-                                        file_label,
-                                        parent_rec["001"].value(),
-                                    )
-                                )
-                            if has_exception:
-                                output_file = other_exceptions
-                            elif match_parent:
-                                output_file = valid_output
-                                parent_written = True
-                            else:
-                                output_file = invalid_output
-                            with open(output_file, "ab") as output:
-                                if not parent_written:
-                                    output.write(parent_rec.as_marc())
-                                    parent_written = True
-                                output.write(fix_record.as_marc())
+                    )
+            else:
+                list_not_match.append(
+                    (
+                        record["001"].value(),
+                        file_label,
+                        parent_rec["001"].value(),
+                    )
+                )
+            if has_exception:
+                output_file = other_exceptions
+            elif match_parent:
+                output_file = valid_output
+                parent_written = True
+            else:
+                output_file = invalid_output
+            with open(output_file, "ab") as output:
+                if not parent_written:
+                    output.write(parent_rec.as_marc())
+                    parent_written = True
+                output.write(fix_record.as_marc())
 
 # Checks for items added to both valid and invalid lists
 for item in list_match:
@@ -330,6 +328,15 @@ if os.path.isfile(other_exceptions):
 else:
     print("No other exceptions written to file.")
 
+# Send updated many records back to Alma instead of importing the file by hand.
+if os.path.isfile(valid_output):
+    print("Write updated records back to Alma? (y/n)")
+    response = input()
+    if response.lower().startswith("y"):
+        write_back_file(
+            valid_output, record_filter=lambda record: get_record_type(record) == "MANY"
+        )
+
 # Build archive file of unmodified MANY records.
 output_dir_many
 output_file_with_validation(